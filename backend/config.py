@@ -26,9 +26,71 @@ class Settings:
     
     # Rate Limiting
     MAX_REQUESTS_PER_MINUTE: int = int(os.getenv("MAX_REQUESTS_PER_MINUTE", "60"))
+    RATE_LIMIT_VIDEOS_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_VIDEOS_PER_MINUTE", "120"))
+    RATE_LIMIT_WRITES_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_WRITES_PER_MINUTE", "30"))
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" or "sqlite" (shared by workers)
+    RATE_LIMIT_SQLITE_PATH: str = os.getenv("RATE_LIMIT_SQLITE_PATH", "data/rate_limit.db")
+    RATE_LIMIT_MAX_CONCURRENCY: int = int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "4"))  # executor slots for the sqlite store
+    
+    # Health
+    HEALTH_PROBE_INTERVAL: int = int(os.getenv("HEALTH_PROBE_INTERVAL", "30"))
+    HEALTH_PROBE_TIMEOUT: int = int(os.getenv("HEALTH_PROBE_TIMEOUT", "10"))
+    
+    # Video catalog (kept in sync from the Drive changes feed)
+    VIDEO_CATALOG_SYNC: bool = os.getenv("VIDEO_CATALOG_SYNC", "true").lower() == "true"
+    VIDEO_CATALOG_POLL_INTERVAL: int = int(os.getenv("VIDEO_CATALOG_POLL_INTERVAL", "10"))
     
     # Cache
     VIDEO_CACHE_DURATION: int = int(os.getenv("VIDEO_CACHE_DURATION", "1800"))  # 30 minutes
+    CACHE_STALE_WHILE_REVALIDATE: int = int(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "300"))  # 5 minutes
+    CACHE_STALE_IF_ERROR: int = int(os.getenv("CACHE_STALE_IF_ERROR", "86400"))  # 24 hours
+    CATALOG_CACHE_MAX_AGE: int = int(os.getenv("CATALOG_CACHE_MAX_AGE", "3600"))  # diseases, symptom types, contact
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")  # "memory" or "sqlite" (shared by workers)
+    CACHE_SQLITE_PATH: str = os.getenv("CACHE_SQLITE_PATH", "data/cache.db")
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+    CACHE_MAX_CONCURRENCY: int = int(os.getenv("CACHE_MAX_CONCURRENCY", "4"))  # executor slots for the sqlite backend
+    
+    # Google API executor
+    GOOGLE_EXECUTOR_WORKERS: int = int(os.getenv("GOOGLE_EXECUTOR_WORKERS", "0"))  # 0 = sum of backend caps
+    SHEETS_MAX_CONCURRENCY: int = int(os.getenv("SHEETS_MAX_CONCURRENCY", "8"))
+    DRIVE_MAX_CONCURRENCY: int = int(os.getenv("DRIVE_MAX_CONCURRENCY", "4"))
+    SQLITE_MAX_CONCURRENCY: int = int(os.getenv("SQLITE_MAX_CONCURRENCY", "4"))
+    GOOGLE_CALL_TIMEOUT: float = float(os.getenv("GOOGLE_CALL_TIMEOUT", "15"))  # seconds
+    GOOGLE_RETRY_MAX_ATTEMPTS: int = int(os.getenv("GOOGLE_RETRY_MAX_ATTEMPTS", "4"))
+    GOOGLE_RETRY_BASE_DELAY: float = float(os.getenv("GOOGLE_RETRY_BASE_DELAY", "0.5"))  # seconds
+    GOOGLE_RETRY_MAX_DELAY: float = float(os.getenv("GOOGLE_RETRY_MAX_DELAY", "8"))  # longer Retry-After opens the circuit instead
+    GOOGLE_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("GOOGLE_BREAKER_FAILURE_THRESHOLD", "5"))
+    GOOGLE_BREAKER_RESET_TIMEOUT: float = float(os.getenv("GOOGLE_BREAKER_RESET_TIMEOUT", "30"))  # seconds
+    HISTORY_HEDGE_DELAY: float = float(os.getenv("HISTORY_HEDGE_DELAY", "1.5"))  # seconds, 0 disables
+    GOOGLE_TRANSPORT: str = os.getenv("GOOGLE_TRANSPORT", "httpx")  # "httpx" (pooled, async) or "httplib2" (executor fallback)
+    GOOGLE_HTTP_MAX_CONNECTIONS: int = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "20"))
+    GOOGLE_HTTP_MAX_KEEPALIVE: int = int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE", "10"))
+    
+    # Symptom storage: "sheets" or "sqlite"
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "sheets")
+    SQLITE_PATH: str = os.getenv("SQLITE_PATH", "data/symptoms.db")
+    SQLITE_MIRROR_TO_SHEETS: bool = os.getenv("SQLITE_MIRROR_TO_SHEETS", "false").lower() == "true"
+    SQLITE_MIRROR_INTERVAL: float = float(os.getenv("SQLITE_MIRROR_INTERVAL", "30"))  # seconds
+    IDEMPOTENCY_WINDOW: int = int(os.getenv("IDEMPOTENCY_WINDOW", "100000"))  # recent batch keys kept (sheets)
+    
+    # Symptom write-behind queue
+    SYMPTOM_WRITE_BEHIND: bool = os.getenv("SYMPTOM_WRITE_BEHIND", "true").lower() == "true"
+    SYMPTOM_JOURNAL_PATH: str = os.getenv("SYMPTOM_JOURNAL_PATH", "data/symptom_journal.jsonl")
+    SYMPTOM_FLUSH_MAX_BATCH: int = int(os.getenv("SYMPTOM_FLUSH_MAX_BATCH", "100"))
+    SYMPTOM_FLUSH_INTERVAL: float = float(os.getenv("SYMPTOM_FLUSH_INTERVAL", "5"))  # seconds
+    SYMPTOM_FLUSH_MAX_ATTEMPTS: int = int(os.getenv("SYMPTOM_FLUSH_MAX_ATTEMPTS", "5"))  # non-transient failures
+    SYMPTOM_DEAD_LETTER_PATH: str = os.getenv("SYMPTOM_DEAD_LETTER_PATH", "data/symptom_dead_letter.jsonl")
+    
+    # Spreadsheet tab index
+    SHEET_INDEX_TTL: int = int(os.getenv("SHEET_INDEX_TTL", "600"))  # 10 minutes
+    
+    # Per-user write locks
+    SHEET_LOCK_BACKEND: str = os.getenv("SHEET_LOCK_BACKEND", "memory")  # "memory" or "file" (shared by workers)
+    SHEET_LOCK_DIR: str = os.getenv("SHEET_LOCK_DIR", "data/locks")
+    
+    # Symptom history cache
+    HISTORY_CACHE_MAX_USERS: int = int(os.getenv("HISTORY_CACHE_MAX_USERS", "1000"))
+    HISTORY_CACHE_TTL: int = int(os.getenv("HISTORY_CACHE_TTL", "300"))  # 5 minutes
     
     # Disease folders mapping
     DISEASE_FOLDERS = {
@@ -43,6 +105,9 @@ class Settings:
     
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records beyond this are dropped
+    LOG_SAMPLING: str = os.getenv("LOG_SAMPLING", "backend.routers.education=0.1")  # "logger=rate,..." for INFO/DEBUG
 
 @lru_cache()
 def get_settings() -> Settings:
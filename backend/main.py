@@ -4,16 +4,31 @@ Patient Education API - Version 3.0.0
 """
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
 from datetime import datetime
+import math
 
 # ✅ تغییر به relative imports
 from .config import get_settings
+from .middleware.metrics import MetricsMiddleware
 from .middleware.rate_limit import RateLimitMiddleware
+from .middleware.request_id import RequestIDMiddleware
 from .routers import education, symptoms, contact
+from .services.google_clients import google_clients
 from .services.google_drive import drive_service
+from .services.google_http import google_transport
 from .services.google_sheets import sheets_service
-from .utils.logger import setup_logger
+from .services.executor import google_executor
+from .services.storage import symptom_storage
+from .services.history_cache import history_cache
+from .services.symptom_summary import summary_cache
+from .services.health import health_prober
+from .services.resilience import CircuitOpenError, google_resilience
+from .services.cache import cache_service
+from .services.video_catalog import video_catalog
+from .services.metrics import metrics, loop_lag_monitor, first_success
+from .utils.fast_json import FastJSONResponse
+from .utils.logger import get_logging_stats, setup_logger
 
 # Setup
 settings = get_settings()
@@ -23,7 +38,8 @@ logger = setup_logger(__name__)
 app = FastAPI(
     title=settings.APP_TITLE,
     version=settings.APP_VERSION,
-    description="API for patient education and symptom tracking"
+    description="API for patient education and symptom tracking",
+    default_response_class=FastJSONResponse
 )
 
 # CORS Middleware
@@ -38,6 +54,12 @@ app.add_middleware(
 # Rate Limiting Middleware
 app.add_middleware(RateLimitMiddleware)
 
+# Metrics Middleware (outside the limiter, so rejected requests are timed too)
+app.add_middleware(MetricsMiddleware)
+
+# Request ID Middleware (outermost, so every response and log line carries one)
+app.add_middleware(RequestIDMiddleware)
+
 # Include routers
 app.include_router(education.router)
 app.include_router(symptoms.router)
@@ -60,44 +82,148 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     """
-    Detailed health check with service status
+    Detailed health check, served from the background prober's snapshot
     """
-    try:
-        # Test Google Drive connection
-        _ = drive_service.service
-        drive_status = "connected"
-    except Exception as e:
-        logger.error(f"Drive service error: {e}")
-        drive_status = "error"
-    
-    try:
-        # Test Google Sheets connection
-        _ = sheets_service.service
-        sheets_status = "connected"
-    except Exception as e:
-        logger.error(f"Sheets service error: {e}")
-        sheets_status = "error"
+    probes = health_prober.snapshot()
+    statuses = {name: probe['status'] for name, probe in probes.items()}
     
-    overall_status = "healthy" if (drive_status == "connected" and sheets_status == "connected") else "degraded"
+    if all(status == "ok" for status in statuses.values()):
+        overall_status = "healthy"
+    elif all(status == "unknown" for status in statuses.values()):
+        overall_status = "starting"
+    else:
+        overall_status = "degraded"
     
     return {
         "status": overall_status,
         "services": {
-            "drive": drive_status,
-            "sheets": sheets_status
+            name: {"ok": "connected", "error": "error"}.get(status, "unknown")
+            for name, status in statuses.items()
         },
+        "probes": probes,
+        "executor": google_executor.get_stats(),
+        "storage": symptom_storage.get_stats(),
+        "history_cache": history_cache.get_stats(),
+        "summary_cache": summary_cache.get_stats(),
+        "video_catalog": video_catalog.get_stats(),
+        "logging": get_logging_stats(),
+        "resilience": {name: r.get_stats() for name, r in google_resilience.items()},
+        "startup": {**google_clients.timings, "time_to_first_success": first_success},
         "version": settings.APP_VERSION,
         "timestamp": datetime.now().isoformat()
     }
 
+# Liveness: the process and event loop are responsive
+@app.get("/api/health/live")
+async def liveness():
+    """
+    Liveness probe; never depends on upstream services
+    """
+    return {"status": "alive"}
+
+# Readiness: upstream backends answered recently
+@app.get("/api/health/ready")
+async def readiness():
+    """
+    Readiness probe; 503 until every backend has answered a recent probe
+    """
+    ready = health_prober.is_ready()
+    return FastJSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready"}
+    )
+
+# Service gauges, read from existing stats at scrape time
+def _cache_hit_ratio():
+    stats = cache_service.get_counters()
+    served = stats['hits'] + stats['stale_hits']
+    total = served + stats['misses']
+    return round(served / total, 4) if total else None
+
+metrics.gauge(
+    "cache_requests_total", "CacheService lookups by result",
+    lambda: {(result,): cache_service.get_counters()[result] for result in ('hits', 'stale_hits', 'misses', 'coalesced', 'stale_on_error')},
+    ("result",), kind="counter"
+)
+metrics.gauge("cache_hit_ratio", "Share of CacheService lookups served from cache", _cache_hit_ratio)
+metrics.gauge(
+    "history_cache_hit_ratio", "Share of history reads served from memory",
+    lambda: history_cache.get_stats()['hit_ratio']
+)
+metrics.gauge(
+    "executor_in_flight", "Blocking calls running per backend",
+    lambda: {(backend,): stats['in_flight'] for backend, stats in google_executor.get_stats()['backends'].items()},
+    ("backend",)
+)
+metrics.gauge(
+    "executor_waiting", "Blocking calls queued for a concurrency slot per backend",
+    lambda: {(backend,): stats['waiting'] for backend, stats in google_executor.get_stats()['backends'].items()},
+    ("backend",)
+)
+metrics.gauge(
+    "backend_up", "Whether the last health probe of a backend succeeded",
+    lambda: {(name,): int(probe['status'] == 'ok') for name, probe in health_prober.snapshot().items()},
+    ("backend",)
+)
+metrics.gauge(
+    "google_client_startup_seconds", "Client build and token refresh timings",
+    lambda: {(step,): seconds for step, seconds in google_clients.timings.items()},
+    ("step",)
+)
+metrics.gauge(
+    "circuit_breaker_state", "Circuit state per backend (0 closed, 1 half-open, 2 open)",
+    lambda: {(name,): {'closed': 0, 'half_open': 1, 'open': 2}[r.breaker.state] for name, r in google_resilience.items()},
+    ("backend",)
+)
+metrics.gauge(
+    "google_api_resilience_total", "Retries, give-ups, fast-fail rejections and hedged reads per backend",
+    lambda: {
+        (name, event): r.get_stats()[event]
+        for name, r in google_resilience.items()
+        for event in ('retries', 'gave_up', 'rejected', 'hedges', 'hedge_wins')
+    },
+    ("backend", "event"), kind="counter"
+)
+metrics.gauge(
+    "video_catalog_sync_age_seconds", "Seconds since the video catalog last synced with Drive",
+    lambda: video_catalog.get_stats()['seconds_since_sync']
+)
+metrics.gauge(
+    "log_records_dropped_total", "Log records dropped because the log queue was full",
+    lambda: get_logging_stats()['dropped'], kind="counter"
+)
+metrics.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: loop_lag_monitor.last_lag)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """
+    Prometheus text exposition
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Exception handlers
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    """
+    Upstream circuit is open; tell the client when to come back
+    """
+    logger.warning(f"Rejected {request.url.path}: {exc}")
+    return FastJSONResponse(
+        status_code=503,
+        content={
+            "error": "سرویس موقتاً در دسترس نیست",
+            "status_code": 503
+        },
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """
     Global exception handler
     """
     logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={
             "error": "خطای داخلی سرور",
@@ -105,6 +231,13 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
+def _connect_google() -> None:
+    """Fetch both API tokens and build both API clients (blocking)"""
+    google_clients.ensure_fresh('sheets')
+    google_clients.ensure_fresh('drive')
+    _ = sheets_service.service
+    _ = drive_service.service
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -114,6 +247,27 @@ async def startup_event():
     logger.info(f"Starting {settings.APP_TITLE} v{settings.APP_VERSION}")
     logger.info(f"CORS origins: {settings.ALLOWED_ORIGINS}")
     logger.info(f"Rate limit: {settings.MAX_REQUESTS_PER_MINUTE} requests/minute")
+    
+    loop_lag_monitor.start()
+    
+    # Build clients before the first request instead of during it
+    try:
+        await google_executor.run('sheets', _connect_google)
+        logger.info(f"Google clients ready: {google_clients.timings}")
+    except Exception as e:
+        logger.warning(f"Google clients not built at startup: {e}")
+    
+    logger.info(f"Symptom storage: {settings.STORAGE_BACKEND}")
+    await symptom_storage.start()
+    
+    try:
+        await google_executor.run('drive', drive_service.warm_folder_ids)
+    except Exception as e:
+        logger.warning(f"Disease folder IDs not resolved at startup: {e}")
+    
+    if settings.VIDEO_CATALOG_SYNC:
+        video_catalog.start()
+    health_prober.start()
 
 # Shutdown event
 @app.on_event("shutdown")
@@ -122,6 +276,13 @@ async def shutdown_event():
     Execute on application shutdown
     """
     logger.info("Shutting down application")
+    await health_prober.stop()
+    await video_catalog.stop()
+    await symptom_storage.stop()
+    await loop_lag_monitor.stop()
+    if google_transport is not None:
+        await google_transport.aclose()
+    google_executor.shutdown()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,44 @@
+"""
+Request latency middleware
+"""
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from ..services.metrics import http_request_latency
+
+class MetricsMiddleware:
+    """
+    Records request latency per route template
+    
+    Labels use the matched route's path ("/api/videos/{disease}") so the
+    series count stays bounded; anything that matched no route is grouped
+    as "unmatched".
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        started = time.perf_counter()
+        
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router adds the matched route to this same scope dict
+            route = scope.get("route")
+            http_request_latency.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status)
+            )
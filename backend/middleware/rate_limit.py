@@ -1,48 +1,124 @@
 """
 Rate limiting middleware
 """
-from datetime import datetime
-from typing import Dict, List
-from fastapi import HTTPException, Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import math
+from typing import List, NamedTuple, Optional, Tuple
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from ..config import get_settings
+from ..services.executor import google_executor
+from ..services.metrics import rate_limit_rejections, rate_limit_store_errors
+from .rate_limit_stores import MemoryRateLimitStore, RateLimitStore, SQLiteRateLimitStore
+from ..utils.fast_json import FastJSONResponse
 from ..utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Middleware for rate limiting requests"""
+class RateLimitRule(NamedTuple):
+    """Limit applied to requests matching a method set and a path; paths ending in "/" match as prefixes"""
+    name: str
+    paths: Tuple[str, ...]
+    methods: Tuple[str, ...]
+    per_minute: int
     
-    def __init__(self, app):
-        super().__init__(app)
+    def matches(self, method: str, path: str) -> bool:
+        if method not in self.methods:
+            return False
+        return any(path == p or (p.endswith("/") and path.startswith(p)) for p in self.paths)
+
+def default_rules() -> List[RateLimitRule]:
+    """Per-route limits from settings; first match wins"""
+    settings = get_settings()
+    return [
+        RateLimitRule("videos", ("/api/videos/",), ("GET",), settings.RATE_LIMIT_VIDEOS_PER_MINUTE),
+        # Only the endpoints that save; history and summary are POST reads
+        RateLimitRule(
+            "writes", ("/api/symptoms", "/api/symptoms/batch"), ("POST",), settings.RATE_LIMIT_WRITES_PER_MINUTE
+        ),
+    ]
+
+def create_rate_limit_store() -> RateLimitStore:
+    """Create the counter store selected in settings"""
+    settings = get_settings()
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteRateLimitStore(settings.RATE_LIMIT_SQLITE_PATH)
+    if settings.RATE_LIMIT_BACKEND != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+    return MemoryRateLimitStore()
+
+class RateLimitMiddleware:
+    """
+    Middleware for rate limiting requests
+    
+    A plain ASGI callable rather than BaseHTTPMiddleware, so allowed
+    requests go straight to the app and streamed bodies pass through
+    untouched; only the response start message is rewritten to add headers.
+    """
+    
+    def __init__(
+        self,
+        app: ASGIApp,
+        rules: Optional[List[RateLimitRule]] = None,
+        default_per_minute: Optional[int] = None,
+        store: Optional[RateLimitStore] = None
+    ):
+        self.app = app
         self.settings = get_settings()
-        self.request_limits: Dict[str, List[float]] = {}
+        self.rules = default_rules() if rules is None else rules
+        self.default_rule = RateLimitRule(
+            "default", (), (), default_per_minute or self.settings.MAX_REQUESTS_PER_MINUTE
+        )
+        self.store = store or create_rate_limit_store()
+    
+    def _match(self, method: str, path: str) -> RateLimitRule:
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        return self.default_rule
     
-    async def dispatch(self, request: Request, call_next):
-        """Process request and apply rate limiting"""
-        client_ip = request.client.host
-        current_time = datetime.now().timestamp()
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Clean old requests
-        if client_ip in self.request_limits:
-            self.request_limits[client_ip] = [
-                req_time for req_time in self.request_limits[client_ip]
-                if current_time - req_time < 60
-            ]
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        rule = self._match(scope["method"], scope["path"])
         
-        # Check rate limit
-        if client_ip in self.request_limits:
-            if len(self.request_limits[client_ip]) >= self.settings.MAX_REQUESTS_PER_MINUTE:
-                logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-                raise HTTPException(
-                    status_code=429,
-                    detail="Too many requests. Please try again later."
+        try:
+            if self.store.blocking:
+                # Own executor slots, so checks never queue behind symptom storage or the cache
+                allowed, remaining, wait = await google_executor.run(
+                    'rate_limit', self.store.hit, rule.name, client_ip, rule.per_minute
                 )
+            else:
+                allowed, remaining, wait = self.store.hit(rule.name, client_ip, rule.per_minute)
+        except Exception as e:
+            # Fail open: a locked or broken store must not turn every request into a 500
+            rate_limit_store_errors.inc(rule.name)
+            logger.error("Rate limit store failed, letting request through: %s", e)
+            await self.app(scope, receive, send)
+            return
+        headers = [
+            (b"ratelimit-limit", str(rule.per_minute).encode()),
+            (b"ratelimit-remaining", str(remaining).encode()),
+            (b"ratelimit-reset", str(math.ceil(wait)).encode()),
+        ]
+        
+        if not allowed:
+            rate_limit_rejections.inc(rule.name)
+            logger.warning(f"Rate limit exceeded for IP: {client_ip} ({rule.name})")
+            response = FastJSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests. Please try again later."},
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+            response.raw_headers.extend(headers)
+            await response(scope, receive, send)
+            return
         
-        # Record new request
-        if client_ip not in self.request_limits:
-            self.request_limits[client_ip] = []
-        self.request_limits[client_ip].append(current_time)
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
         
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send_with_headers)
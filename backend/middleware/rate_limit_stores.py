@@ -0,0 +1,156 @@
+"""
+Counter stores for the rate limiter
+"""
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+# (allowed, remaining, seconds until retry when rejected / until full when allowed)
+Decision = Tuple[bool, int, float]
+
+def gcra(tat: Optional[float], now: float, interval: float, tolerance: float) -> Tuple[Decision, float]:
+    """One GCRA step; returns the decision and the new theoretical arrival time"""
+    tat = now if tat is None or tat < now else tat
+    if tat - now > tolerance:
+        return (False, 0, tat - tolerance - now), tat
+    tat += interval
+    remaining = int((tolerance - (tat - now)) / interval) + 1
+    return (True, max(remaining, 0), tat - now), tat
+
+class GCRALimiter:
+    """
+    Generic cell rate algorithm (token bucket equivalent)
+    
+    Each key is a single float, its theoretical arrival time, so a check is
+    O(1) and memory per client is fixed. Keys whose bucket has refilled
+    carry no information and are swept periodically.
+    """
+    
+    def __init__(self, per_minute: int, burst: Optional[int] = None, sweep_interval: float = 60):
+        self.per_minute = per_minute
+        self.burst = burst or per_minute
+        self.interval = 60.0 / per_minute
+        self.tolerance = self.interval * (self.burst - 1)
+        self.sweep_interval = sweep_interval
+        self._tat: Dict[str, float] = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+    
+    def hit(self, key: str, now: Optional[float] = None) -> Decision:
+        """Consume one request for a key"""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep:
+            self.sweep(now)
+        
+        decision, tat = gcra(self._tat.get(key), now, self.interval, self.tolerance)
+        if decision[0]:
+            self._tat[key] = tat
+        return decision
+    
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop keys whose bucket is full again"""
+        now = time.monotonic() if now is None else now
+        idle = [key for key, tat in self._tat.items() if tat <= now]
+        for key in idle:
+            del self._tat[key]
+        self._next_sweep = now + self.sweep_interval
+        return len(idle)
+    
+    def __len__(self) -> int:
+        return len(self._tat)
+
+class RateLimitStore(ABC):
+    """Where limiter state lives; one bucket per (rule, client) pair"""
+    
+    # Whether hit may block on I/O and belongs on the executor, off the event loop
+    blocking: bool = False
+    
+    @abstractmethod
+    def hit(self, rule: str, key: str, per_minute: int) -> Decision:
+        """Consume one request from a client's bucket for a rule"""
+    
+    @abstractmethod
+    def size(self) -> int:
+        """Number of tracked buckets"""
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Per-process counters (the default)"""
+    
+    def __init__(self):
+        self._limiters: Dict[str, GCRALimiter] = {}
+    
+    def hit(self, rule: str, key: str, per_minute: int) -> Decision:
+        limiter = self._limiters.get(rule)
+        if limiter is None:
+            limiter = self._limiters[rule] = GCRALimiter(per_minute)
+        return limiter.hit(key)
+    
+    def size(self) -> int:
+        return sum(len(limiter) for limiter in self._limiters.values())
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    Counters in a SQLite file shared by every worker on the host
+    
+    The read-modify-write runs inside BEGIN IMMEDIATE so concurrent workers
+    serialize on the row. Wall-clock time is used because monotonic clocks
+    are not comparable across processes. Workers contending for the file
+    wait up to the busy timeout, so the middleware calls hit through the
+    executor rather than on the event loop.
+    """
+    
+    blocking = True
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_limit (
+            rule TEXT NOT NULL,
+            key TEXT NOT NULL,
+            tat REAL NOT NULL,
+            PRIMARY KEY (rule, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_rate_limit_tat ON rate_limit (tat);
+    """
+    
+    def __init__(self, path: str, sweep_interval: float = 60):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+    
+    def hit(self, rule: str, key: str, per_minute: int) -> Decision:
+        interval = 60.0 / per_minute
+        tolerance = interval * (per_minute - 1)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tat FROM rate_limit WHERE rule = ? AND key = ?", (rule, key)
+                ).fetchone()
+                decision, tat = gcra(row[0] if row else None, now, interval, tolerance)
+                if decision[0]:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO rate_limit (rule, key, tat) VALUES (?, ?, ?)",
+                        (rule, key, tat)
+                    )
+                if now >= self._next_sweep:
+                    self._conn.execute("DELETE FROM rate_limit WHERE tat <= ?", (now,))
+                    self._next_sweep = now + self.sweep_interval
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return decision
+    
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limit").fetchone()[0]
@@ -0,0 +1,46 @@
+"""
+Request ID middleware
+"""
+import re
+import uuid
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from ..utils.logger import request_id_var
+
+# Accept a caller's ID only if it is short and safe to echo into logs and headers
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+class RequestIDMiddleware:
+    """
+    Tags every request with an ID for log correlation
+    
+    An incoming X-Request-ID is reused when it looks sane, otherwise a new
+    one is generated. The ID is set in a context variable that log records
+    pick up, and echoed back in the X-Request-ID response header.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+        
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
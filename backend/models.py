@@ -2,7 +2,51 @@
 Pydantic models for request/response validation
 """
 from pydantic import BaseModel, validator, Field
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
+from datetime import datetime, timedelta, timezone
+import re
+import pytz
+
+# Symptom types with their units and accepted ranges
+SYMPTOM_TYPE_CATALOG = [
+    {
+        "id": "fasting_glucose",
+        "name": "قند ناشتا",
+        "unit": "mg/dL",
+        "range": {"min": 20, "max": 1500}
+    },
+    {
+        "id": "postprandial_glucose",
+        "name": "قند بعد از غذا",
+        "unit": "mg/dL",
+        "range": {"min": 20, "max": 1500}
+    },
+    {
+        "id": "blood_pressure",
+        "name": "فشار خون",
+        "unit": "mmHg",
+        "format": "systolic/diastolic",
+        "range": {
+            "systolic": {"min": 70, "max": 300},
+            "diastolic": {"min": 30, "max": 200}
+        }
+    },
+    {
+        "id": "weight",
+        "name": "وزن",
+        "unit": "kg",
+        "range": {"min": 10, "max": 200}
+    }
+]
+
+SYMPTOM_TYPES = [t["name"] for t in SYMPTOM_TYPE_CATALOG]
+
+MAX_BATCH_ITEMS = 500
+
+# Offline readings older than this are typos; jdatetime cannot convert years before 622 at all
+EARLIEST_CLIENT_TIMESTAMP = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+JALALI_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
 class SymptomData(BaseModel):
     """Model for symptom data submission"""
@@ -18,9 +62,8 @@ class SymptomData(BaseModel):
 
     @validator('symptom_type')
     def validate_symptom_type(cls, v):
-        allowed_types = ['قند ناشتا', 'قند بعد از غذا', 'فشار خون', 'وزن']
-        if v not in allowed_types:
-            raise ValueError(f'symptom_type must be one of {allowed_types}')
+        if v not in SYMPTOM_TYPES:
+            raise ValueError(f'symptom_type must be one of {SYMPTOM_TYPES}')
         return v
 
     @validator('value')
@@ -57,10 +100,37 @@ class SymptomData(BaseModel):
         
         return v
 
+class SymptomBatchItem(SymptomData):
+    """Model for one reading in an offline-sync batch"""
+    idempotency_key: str = Field(..., min_length=8, max_length=64)
+    client_timestamp: Optional[datetime] = None
+
+    @validator('client_timestamp')
+    def validate_client_timestamp(cls, v):
+        if v is None:
+            return v
+        if v.tzinfo is None:
+            # Eitaa clients without an offset report local Iran time
+            v = pytz.timezone('Asia/Tehran').localize(v)
+        if v > datetime.now(timezone.utc) + timedelta(minutes=5):
+            raise ValueError('زمان ثبت نمی‌تواند در آینده باشد')
+        if v < EARLIEST_CLIENT_TIMESTAMP:
+            raise ValueError('زمان ثبت بیش از حد قدیمی است')
+        return v
+
+class SymptomBatch(BaseModel):
+    """Model for bulk/offline-sync symptom submission"""
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
 class UserHistory(BaseModel):
     """Model for fetching user history"""
     user_id: str = Field(..., min_length=5, max_length=50)
     symptom_filter: Optional[str] = Field(None, max_length=50)
+    symptom_type: Optional[str] = Field(None, max_length=50)
+    from_date: Optional[str] = Field(None, description="Jalali date, YYYY-MM-DD")
+    to_date: Optional[str] = Field(None, description="Jalali date, YYYY-MM-DD")
+    limit: Optional[int] = Field(None, ge=1, le=1000)
+    cursor: int = Field(0, ge=0)
 
     @validator('user_id')
     def validate_user_id(cls, v):
@@ -68,6 +138,28 @@ class UserHistory(BaseModel):
             raise ValueError('Invalid user_id format')
         return v
 
+    @validator('symptom_type')
+    def validate_symptom_type(cls, v):
+        if v is not None and v not in SYMPTOM_TYPES:
+            raise ValueError(f'symptom_type must be one of {SYMPTOM_TYPES}')
+        return v
+
+    @validator('from_date', 'to_date')
+    def validate_jalali_date(cls, v):
+        if v is not None and not JALALI_DATE_PATTERN.match(v):
+            raise ValueError('تاریخ باید به فرمت YYYY-MM-DD باشد')
+        return v
+
+class SummaryRequest(BaseModel):
+    """Model for fetching a user's symptom summary"""
+    user_id: str = Field(..., min_length=5, max_length=50)
+    
+    @validator('user_id')
+    def validate_user_id(cls, v):
+        if not v.startswith('user_'):
+            raise ValueError('Invalid user_id format')
+        return v
+
 class VideoResponse(BaseModel):
     """Model for video information"""
     id: str
@@ -86,6 +178,22 @@ class SymptomResponse(BaseModel):
     message: str
     timestamp: str
 
+class BatchItemResult(BaseModel):
+    """Model for the outcome of one batch item"""
+    index: int
+    idempotency_key: Optional[str] = None
+    success: bool
+    duplicate: bool = False
+    timestamp: Optional[str] = None
+    error: Optional[str] = None
+
+class SymptomBatchResponse(BaseModel):
+    """Model for batch save response"""
+    saved: int
+    duplicates: int
+    failed: int
+    results: List[BatchItemResult]
+
 class HistoryItem(BaseModel):
     """Model for a single history item"""
     date: str
@@ -96,6 +204,45 @@ class HistoryItem(BaseModel):
 class HistoryResponse(BaseModel):
     """Model for history response"""
     data: List[HistoryItem]
+    next_cursor: Optional[int] = None
+
+class SeriesSummary(BaseModel):
+    """Model for aggregates of one numeric series"""
+    count: int
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+    out_of_range: int
+    mean_7d: Optional[float] = None
+    mean_30d: Optional[float] = None
+
+class LastReading(BaseModel):
+    """Model for the most recent reading of a type"""
+    date: str
+    time: str
+    value: str
+
+class TypeSummary(BaseModel):
+    """Model for aggregates of one symptom type"""
+    id: str
+    name: str
+    unit: str
+    count: int
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+    out_of_range: Optional[int] = None
+    mean_7d: Optional[float] = None
+    mean_30d: Optional[float] = None
+    systolic: Optional[SeriesSummary] = None
+    diastolic: Optional[SeriesSummary] = None
+    last: Optional[LastReading] = None
+
+class SummaryResponse(BaseModel):
+    """Model for symptom summary response"""
+    as_of: str
+    types: List[TypeSummary]
+    invalid: int
 
 class ContactInfo(BaseModel):
     """Model for contact information"""
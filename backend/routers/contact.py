@@ -1,36 +1,49 @@
 """
 Contact endpoints - Contact information and support
 """
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from ..config import get_settings
 from ..models import ContactInfo
+from ..utils.http_cache import PrecomputedJSON
 from ..utils.logger import setup_logger
 
+settings = get_settings()
 logger = setup_logger(__name__)
 
 router = APIRouter(prefix="/api", tags=["contact"])
 
+CONTACT_RESPONSE = PrecomputedJSON(
+    ContactInfo(
+        eitaa="https://eitaa.com/joinchat/6055926614C5ed07fc3f6",
+        phone="021-12345678",
+        email="info@example.com",
+        address="تهران، خیابان ولیعصر، پلاک ۱۲۳"
+    ).model_dump(),
+    max_age=settings.CATALOG_CACHE_MAX_AGE
+)
+
+SUPPORT_RESPONSE = PrecomputedJSON(
+    {
+        "telegram": "@your_support_bot",
+        "eitaa": "https://eitaa.com/joinchat/6055926614C5ed07fc3f6",
+        "email": "support@example.com",
+        "working_hours": "شنبه تا پنجشنبه، ساعت 8 صبح تا 8 شب"
+    },
+    max_age=settings.CATALOG_CACHE_MAX_AGE
+)
+
 @router.get("/contact", response_model=ContactInfo)
-async def get_contact_info():
+async def get_contact_info(request: Request):
     """
     Get contact information for support and consultation
     """
-    logger.info("Contact information requested")
+    logger.debug("Contact information requested")
     
-    return {
-        "eitaa": "https://eitaa.com/joinchat/6055926614C5ed07fc3f6",
-        "phone": "021-12345678",
-        "email": "info@example.com",
-        "address": "تهران، خیابان ولیعصر، پلاک ۱۲۳"
-    }
+    return CONTACT_RESPONSE.respond(request)
 
 @router.get("/support")
-async def get_support_info():
+async def get_support_info(request: Request):
     """
     Get support channel information
     """
-    return {
-        "telegram": "@your_support_bot",
-        "eitaa": "https://eitaa.com/joinchat/6055926614C5ed07fc3f6",
-        "email": "support@example.com",
-        "working_hours": "شنبه تا پنجشنبه، ساعت 8 صبح تا 8 شب"
-    }
+    return SUPPORT_RESPONSE.respond(request)
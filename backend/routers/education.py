@@ -1,20 +1,34 @@
 """
 Education endpoints - Video management
 """
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Request
+from typing import Any, Dict, List
+from ..config import get_settings
 from ..models import VideosResponse, VideoResponse
 from ..services.google_drive import drive_service
 from ..services.cache import cache_service
+from ..services.resilience import CircuitOpenError
+from ..services.video_catalog import build_video_listing, video_catalog
+from ..utils.http_cache import PrecomputedJSON, http_date, json_response
 from ..utils.validators import validate_disease_type
 from ..utils.logger import setup_logger
 
+settings = get_settings()
 logger = setup_logger(__name__)
 
 router = APIRouter(prefix="/api", tags=["education"])
 
+# Always revalidate: the changes feed publishes catalog edits within seconds,
+# and a matching ETag is answered with a bodiless 304 straight from memory
+VIDEOS_CACHE_CONTROL = "public, no-cache"
+
+async def _fetch_listing(disease: str) -> Dict[str, Any]:
+    """Fetch a disease's videos and serialize the response body once"""
+    videos = await drive_service.get_videos_for_disease(disease)
+    return build_video_listing(videos, await cache_service.peek_async(f"video_listing_{disease}"))
+
 @router.get("/videos/{disease}", response_model=VideosResponse)
-async def get_videos(disease: str):
+async def get_videos(disease: str, request: Request):
     """
     Get educational videos for a specific disease
     
@@ -29,22 +43,27 @@ async def get_videos(disease: str):
                 detail=f"Disease '{disease}' not found"
             )
         
-        # Check cache first
-        cached_videos = cache_service.get(f"videos_{disease}")
-        if cached_videos is not None:
-            logger.info(f"Cache hit for disease: {disease}")
-            return {"videos": cached_videos}
-        
-        # Fetch from Google Drive
-        videos = drive_service.get_videos_for_disease(disease)
-        
-        # Cache the results
-        cache_service.set(f"videos_{disease}", videos)
-        
-        logger.info(f"Retrieved {len(videos)} videos for disease: {disease}")
-        return {"videos": videos}
+        # Served from the synced catalog; until it has loaded, from cache
+        # with misses and refreshes coalesced per disease
+        listing = video_catalog.get_listing(disease)
+        if listing is None:
+            listing = await cache_service.get_or_fetch(
+                f"video_listing_{disease}",
+                lambda: _fetch_listing(disease)
+            )
         
-    except HTTPException:
+        logger.info("Retrieved %d videos for disease: %s", listing['count'], disease)
+        headers = {
+            "ETag": listing['etag'],
+            "Last-Modified": http_date(listing['last_modified']),
+            "Cache-Control": VIDEOS_CACHE_CONTROL
+        }
+        return json_response(
+            request, listing['body'].encode("utf-8"), headers,
+            listing['etag'], listing['last_modified']
+        )
+    
+    except (HTTPException, CircuitOpenError):
         raise
     except Exception as e:
         logger.error(f"Error fetching videos: {e}")
@@ -53,25 +72,30 @@ async def get_videos(disease: str):
             detail="خطا در دریافت ویدیوها"
         )
 
+DISEASE_NAMES_FA = {
+    "diabetes": "دیابت نوع ۲",
+    "hypertension": "فشار خون بالا",
+    "cardiac": "بیماری قلبی عروقی"
+}
+
+# Serialized once; the catalog only changes with DISEASE_FOLDERS at deploy time
+DISEASES_RESPONSE = PrecomputedJSON(
+    {
+        "diseases": [
+            {
+                "id": key,
+                "name": value,
+                "name_fa": DISEASE_NAMES_FA.get(key, value)
+            }
+            for key, value in settings.DISEASE_FOLDERS.items()
+        ]
+    },
+    max_age=settings.CATALOG_CACHE_MAX_AGE
+)
+
 @router.get("/diseases")
-async def get_diseases():
+async def get_diseases(request: Request):
     """
     Get list of available diseases
     """
-    from ..config import get_settings
-    settings = get_settings()
-    
-    diseases = [
-        {
-            "id": key,
-            "name": value,
-            "name_fa": {
-                "diabetes": "دیابت نوع ۲",
-                "hypertension": "فشار خون بالا",
-                "cardiac": "بیماری قلبی عروقی"
-            }.get(key, value)
-        }
-        for key, value in settings.DISEASE_FOLDERS.items()
-    ]
-    
-    return {"diseases": diseases}
+    return DISEASES_RESPONSE.respond(request)
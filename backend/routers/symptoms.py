@@ -1,15 +1,41 @@
 """
 Symptoms endpoints - Symptom tracking
 """
-from fastapi import APIRouter, HTTPException
-from ..models import SymptomData, UserHistory, SymptomResponse, HistoryResponse
-from ..services.google_sheets import sheets_service
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from ..config import get_settings
+from ..models import (
+    SymptomData, SymptomBatch, SymptomBatchItem, SymptomBatchResponse,
+    UserHistory, SymptomResponse, HistoryResponse, SummaryRequest, SummaryResponse,
+    SYMPTOM_TYPE_CATALOG
+)
+from ..services.google_sheets import current_iran_timestamp
+from ..services.history_columns import HistoryColumns, jalali_ordinal
+from ..services.storage import symptom_storage
+from ..services.resilience import CircuitOpenError
+from ..services.symptom_summary import summary_cache
+from ..utils.fast_json import FastJSONResponse
+from ..utils.http_cache import PrecomputedJSON
 from ..utils.logger import setup_logger
 
+settings = get_settings()
 logger = setup_logger(__name__)
 
 router = APIRouter(prefix="/api/symptoms", tags=["symptoms"])
 
+STREAM_CHUNK_SIZE = 200
+
+async def _stream_history(records: HistoryColumns, next_cursor: Optional[int]) -> AsyncIterator[bytes]:
+    """Encode a history response in chunks instead of one large body"""
+    yield b'{"data":['
+    for i in range(0, len(records), STREAM_CHUNK_SIZE):
+        encoded = records.to_json(i, i + STREAM_CHUNK_SIZE)
+        yield (("," if i else "") + encoded).encode("utf-8")
+    yield f'],"next_cursor":{json.dumps(next_cursor)}}}'.encode("utf-8")
+
 @router.post("", response_model=SymptomResponse)
 async def save_symptom(data: SymptomData):
     """
@@ -20,15 +46,15 @@ async def save_symptom(data: SymptomData):
     - **value**: Symptom value
     """
     try:
-        result = await sheets_service.save_symptom(
+        result = await symptom_storage.save_symptom(
             data.user_id,
             data.symptom_type,
             data.value
         )
         
-        return result
+        return FastJSONResponse(result)
         
-    except HTTPException:
+    except (HTTPException, CircuitOpenError):
         raise
     except Exception as e:
         logger.error(f"Error saving symptom: {e}")
@@ -37,23 +63,121 @@ async def save_symptom(data: SymptomData):
             detail="خطا در ذخیره علامت"
         )
 
+@router.post("/batch", response_model=SymptomBatchResponse)
+async def save_symptom_batch(batch: SymptomBatch):
+    """
+    Save many readings at once (offline sync)
+    
+    - **items**: SymptomData objects with an **idempotency_key** and an
+      optional **client_timestamp** (ISO 8601) of when the reading was taken
+    
+    Invalid items are reported individually; retried items are reported as duplicates.
+    """
+    results: List[Dict[str, Any]] = []
+    records: List[Dict[str, str]] = []
+    record_results: List[Dict[str, Any]] = []
+    seen = set()
+    
+    # Validate everything in one pass before touching storage
+    for index, raw in enumerate(batch.items):
+        key = raw.get('idempotency_key') if isinstance(raw, dict) else None
+        if not isinstance(key, str):
+            key = None  # echoed back unvalidated, so only ever a string
+        try:
+            item = SymptomBatchItem(**raw)
+        except (ValidationError, TypeError) as e:
+            message = e.errors()[0]['msg'] if isinstance(e, ValidationError) else str(e)
+            results.append({
+                "index": index, "idempotency_key": key, "success": False,
+                "duplicate": False, "timestamp": None, "error": message
+            })
+            continue
+        
+        result = {
+            "index": index, "idempotency_key": item.idempotency_key, "success": True,
+            "duplicate": False, "timestamp": None, "error": None
+        }
+        results.append(result)
+        
+        if (item.user_id, item.idempotency_key) in seen:
+            result["duplicate"] = True
+            continue
+        
+        try:
+            date, time = current_iran_timestamp(item.client_timestamp)
+        except (ValueError, OverflowError) as e:
+            # A moment jdatetime or the timezone cannot represent fails only this item
+            result.update(success=False, error=f"زمان ثبت نامعتبر: {e}")
+            continue
+        seen.add((item.user_id, item.idempotency_key))
+        result["timestamp"] = f"{date} {time}"
+        records.append({
+            'user_id': item.user_id,
+            'symptom_type': item.symptom_type,
+            'value': item.value,
+            'date': date,
+            'time': time,
+            'idempotency_key': item.idempotency_key
+        })
+        record_results.append(result)
+    
+    try:
+        if records:
+            stored = await symptom_storage.save_batch(records)
+            for result, is_new in zip(record_results, stored):
+                result["duplicate"] = not is_new
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.error(f"Error saving symptom batch: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="خطا در ذخیره علائم"
+        )
+    
+    duplicates = sum(1 for r in results if r.get("duplicate"))
+    failed = sum(1 for r in results if not r["success"])
+    logger.info(
+        "Batch of %d symptoms: %d saved, %d duplicates, %d invalid",
+        len(results), len(results) - failed - duplicates, duplicates, failed
+    )
+    # Built here from validated items; skip the response_model pass
+    return FastJSONResponse({
+        "saved": len(results) - failed - duplicates,
+        "duplicates": duplicates,
+        "failed": failed,
+        "results": results
+    })
+
 @router.post("/history", response_model=HistoryResponse)
 async def get_symptoms(data: UserHistory):
     """
     Get symptom history for a user
     
     - **user_id**: User identifier
-    - **symptom_filter**: Optional filter for symptom type
+    - **symptom_filter**: Optional substring filter for symptom type
+    - **symptom_type**: Optional exact symptom type
+    - **from_date** / **to_date**: Optional Jalali date range (YYYY-MM-DD, inclusive)
+    - **limit**: Page size; pages are returned newest first
+    - **cursor**: Offset returned as next_cursor by the previous page
     """
     try:
-        history = sheets_service.get_user_history(
+        page, next_cursor = await symptom_storage.query_history(
             data.user_id,
-            data.symptom_filter
+            symptom_filter=data.symptom_filter,
+            symptom_type=data.symptom_type,
+            from_date=data.from_date,
+            to_date=data.to_date,
+            limit=data.limit,
+            cursor=data.cursor
         )
         
-        return {"data": history}
+        return StreamingResponse(
+            _stream_history(page, next_cursor),
+            media_type="application/json"
+        )
         
-    except HTTPException:
+    except (HTTPException, CircuitOpenError):
         raise
     except Exception as e:
         logger.error(f"Error fetching history: {e}")
@@ -62,40 +186,42 @@ async def get_symptoms(data: UserHistory):
             detail="خطا در دریافت تاریخچه"
         )
 
+@router.post("/summary", response_model=SummaryResponse)
+async def get_summary(data: SummaryRequest):
+    """
+    Get per-type aggregates for a user instead of the raw history
+    
+    - **user_id**: User identifier
+    
+    For each symptom type: count, min, max, mean, mean of the last 7 and 30
+    days, and readings outside the ranges listed by /types. Blood pressure
+    is reported separately for systolic and diastolic.
+    """
+    try:
+        history = await symptom_storage.get_user_history(data.user_id)
+        summary = summary_cache.get(data.user_id, history)
+        
+        today, _ = current_iran_timestamp()
+        return FastJSONResponse({"as_of": today, **summary.to_dict(jalali_ordinal(today))})
+        
+    except (HTTPException, CircuitOpenError):
+        raise
+    except Exception as e:
+        logger.error(f"Error building summary: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="خطا در دریافت خلاصه علائم"
+        )
+
+# Validated ranges are fixed in code, so the catalog is serialized once
+SYMPTOM_TYPES_RESPONSE = PrecomputedJSON(
+    {"types": SYMPTOM_TYPE_CATALOG},
+    max_age=settings.CATALOG_CACHE_MAX_AGE
+)
+
 @router.get("/types")
-async def get_symptom_types():
+async def get_symptom_types(request: Request):
     """
     Get list of available symptom types
     """
-    return {
-        "types": [
-            {
-                "id": "fasting_glucose",
-                "name": "قند ناشتا",
-                "unit": "mg/dL",
-                "range": {"min": 20, "max": 1500}
-            },
-            {
-                "id": "postprandial_glucose",
-                "name": "قند بعد از غذا",
-                "unit": "mg/dL",
-                "range": {"min": 20, "max": 1500}
-            },
-            {
-                "id": "blood_pressure",
-                "name": "فشار خون",
-                "unit": "mmHg",
-                "format": "systolic/diastolic",
-                "range": {
-                    "systolic": {"min": 70, "max": 300},
-                    "diastolic": {"min": 30, "max": 200}
-                }
-            },
-            {
-                "id": "weight",
-                "name": "وزن",
-                "unit": "kg",
-                "range": {"min": 10, "max": 200}
-            }
-        ]
-    }
+    return SYMPTOM_TYPES_RESPONSE.respond(request)
@@ -1,53 +1,175 @@
 """
 Cache management service
 """
-from datetime import datetime
-from typing import Optional, Dict, Any
+import asyncio
+import time
+from typing import Optional, Dict, Any, Awaitable, Callable, Set, Tuple
 from ..config import get_settings
+from .cache_backends import CacheBackend, MemoryCacheBackend, SQLiteCacheBackend
+from .executor import google_executor
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+def create_cache_backend() -> CacheBackend:
+    """Create the cache backend selected in settings"""
+    settings = get_settings()
+    if settings.CACHE_BACKEND == "sqlite":
+        return SQLiteCacheBackend(settings.CACHE_SQLITE_PATH, settings.CACHE_MAX_ENTRIES)
+    if settings.CACHE_BACKEND != "memory":
+        raise ValueError(f"Unknown CACHE_BACKEND: {settings.CACHE_BACKEND}")
+    return MemoryCacheBackend(settings.CACHE_MAX_ENTRIES)
 
 class CacheService:
-    """Simple in-memory cache service"""
+    """Cache service over a pluggable backend (in-memory by default)"""
     
-    def __init__(self):
-        self._cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, backend: Optional[CacheBackend] = None):
+        self.backend = backend or create_cache_backend()
         self.settings = get_settings()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshes: Set[asyncio.Task] = set()
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'stale_on_error': 0
+        }
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get value from cache if not expired"""
-        if key not in self._cache:
+    @property
+    def _retention(self) -> int:
+        """How long an entry is kept after it was written"""
+        return self.settings.VIDEO_CACHE_DURATION + max(
+            self.settings.CACHE_STALE_WHILE_REVALIDATE,
+            self.settings.CACHE_STALE_IF_ERROR
+        )
+    
+    def _lookup(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Get (value, age in seconds) for an entry still within retention"""
+        entry = self.backend.get(key)
+        if entry is None:
             return None
         
-        entry = self._cache[key]
-        current_time = datetime.now().timestamp()
-        
-        if current_time - entry['timestamp'] >= self.settings.VIDEO_CACHE_DURATION:
+        value, stored_at = entry
+        return value, time.time() - stored_at
+    
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Call the backend, on the executor if it does blocking I/O"""
+        if self.backend.blocking:
+            # Own executor slots, so catalog reads never queue behind symptom writes
+            return await google_executor.run('cache', func, *args)
+        return func(*args)
+    
+    async def peek_async(self, key: str) -> Optional[Any]:
+        """peek without blocking the event loop"""
+        entry = await self._run(self._lookup, key)
+        return None if entry is None else entry[0]
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Get value from cache if not expired"""
+        entry = self._lookup(key)
+        if entry is None or entry[1] >= self.settings.VIDEO_CACHE_DURATION:
             # Cache expired
-            del self._cache[key]
             return None
         
-        return entry['data']
+        return entry[0]
+    
+    def peek(self, key: str) -> Optional[Any]:
+        """Get a value even if stale, as long as it is still retained"""
+        entry = self._lookup(key)
+        return None if entry is None else entry[0]
     
     def set(self, key: str, value: Any) -> None:
         """Set value in cache with current timestamp"""
-        self._cache[key] = {
-            'data': value,
-            'timestamp': datetime.now().timestamp()
-        }
+        self.backend.set(key, value, ttl=self._retention)
+    
+    async def _fetch(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fetcher once per key; concurrent callers share the result"""
+        if key in self._inflight:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(self._inflight[key])
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetcher()
+            await self._run(self.set, key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged as lost
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+    
+    def _refresh_in_background(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> None:
+        """Start a single background refresh for a stale key"""
+        if key in self._inflight:
+            return
+        
+        async def refresh():
+            try:
+                await self._fetch(key, fetcher)
+            except Exception as e:
+                logger.warning(f"Background refresh failed for {key}: {e}")
+        
+        task = asyncio.create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+    
+    async def get_or_fetch(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get a value, fetching it on a miss
+        
+        Stale entries are served while a background refresh runs, concurrent
+        misses for a key share one fetch, and if the fetch fails an entry
+        within the stale-if-error grace period is served instead.
+        """
+        ttl = self.settings.VIDEO_CACHE_DURATION
+        entry = await self._run(self._lookup, key)
+        
+        if entry is not None and entry[1] < ttl:
+            self._stats['hits'] += 1
+            return entry[0]
+        
+        if entry is not None and entry[1] < ttl + self.settings.CACHE_STALE_WHILE_REVALIDATE:
+            self._stats['stale_hits'] += 1
+            self._refresh_in_background(key, fetcher)
+            return entry[0]
+        
+        self._stats['misses'] += 1
+        try:
+            return await self._fetch(key, fetcher)
+        except Exception as e:
+            if entry is not None and entry[1] < ttl + self.settings.CACHE_STALE_IF_ERROR:
+                self._stats['stale_on_error'] += 1
+                logger.warning(f"Serving stale {key} after upstream error: {e}")
+                return entry[0]
+            raise
     
     def delete(self, key: str) -> None:
         """Delete a key from cache"""
-        if key in self._cache:
-            del self._cache[key]
+        self.backend.delete(key)
     
     def clear(self) -> None:
         """Clear all cache"""
-        self._cache.clear()
+        self.backend.clear()
+    
+    def get_counters(self) -> Dict[str, int]:
+        """Lookup counters only; cheap enough for every metrics scrape"""
+        return dict(self._stats)
     
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
+        keys = self.backend.keys()
         return {
-            'total_keys': len(self._cache),
-            'keys': list(self._cache.keys())
+            'backend': type(self.backend).__name__,
+            'total_keys': len(keys),
+            'keys': keys,
+            'evictions': self.backend.evictions,
+            **self._stats
         }
 
 # Global cache instance
@@ -0,0 +1,162 @@
+"""
+Storage backends for CacheService
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+class CacheBackend(ABC):
+    """Key/value store with per-key expiry and bounded size"""
+    
+    evictions: int = 0
+    # Whether calls may block on I/O and belong on the executor, off the event loop
+    blocking: bool = False
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Get (value, stored_at) for an unexpired key"""
+    
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float, stored_at: Optional[float] = None) -> None:
+        """Store a value that expires ttl seconds after stored_at"""
+    
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete a key"""
+    
+    @abstractmethod
+    def clear(self) -> None:
+        """Delete all keys"""
+    
+    @abstractmethod
+    def keys(self) -> List[str]:
+        """List stored keys"""
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process LRU dict (the default)"""
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.evictions = 0
+    
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() >= entry['expires_at']:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry['data'], entry['timestamp']
+    
+    def set(self, key: str, value: Any, ttl: float, stored_at: Optional[float] = None) -> None:
+        stored_at = time.time() if stored_at is None else stored_at
+        self._entries[key] = {
+            'data': value,
+            'timestamp': stored_at,
+            'expires_at': stored_at + ttl
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+    
+    def clear(self) -> None:
+        self._entries.clear()
+    
+    def keys(self) -> List[str]:
+        return list(self._entries.keys())
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    File-backed cache shared by every worker on the host
+    
+    Values are stored as JSON text rather than pickles, and the file runs
+    in WAL mode so readers in other workers never block on a writer.
+    Writers still wait on each other for up to the busy timeout, so the
+    service calls this backend through the executor.
+    """
+    
+    blocking = True
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at);
+        CREATE INDEX IF NOT EXISTS idx_cache_stored ON cache (stored_at);
+    """
+    
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+    
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+    
+    def set(self, key: str, value: Any, ttl: float, stored_at: Optional[float] = None) -> None:
+        stored_at = time.time() if stored_at is None else stored_at
+        encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, encoded, stored_at, stored_at + ttl)
+                )
+                self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+                overflow = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM cache WHERE key IN "
+                        "(SELECT key FROM cache ORDER BY stored_at LIMIT ?)",
+                        (overflow,)
+                    )
+                    self.evictions += overflow
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+    
+    def keys(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM cache WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        return [row[0] for row in rows]
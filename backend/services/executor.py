@@ -0,0 +1,166 @@
+"""
+Async execution layer for blocking Google API calls
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from ..config import get_settings
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# time.monotonic() by which the caller of the current executor call stops waiting
+call_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('call_deadline', default=None)
+
+class BlockingExecutor:
+    """Runs blocking calls on a bounded thread pool with per-backend limits"""
+    
+    def __init__(self, max_workers: int, limits: Dict[str, int], timeout: float):
+        self.max_workers = max_workers
+        self.limits = dict(limits)
+        self.timeout = timeout
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+    
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        """Get or create the thread pool"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="google-io"
+            )
+        return self._pool
+    
+    def _get_semaphore(self, backend: str) -> asyncio.Semaphore:
+        """Get or create the concurrency cap for a backend"""
+        if backend not in self._semaphores:
+            self._semaphores[backend] = asyncio.Semaphore(
+                self.limits.get(backend, self.max_workers)
+            )
+        return self._semaphores[backend]
+    
+    def _get_stats(self, backend: str) -> Dict[str, int]:
+        """Get or create the counters for a backend"""
+        if backend not in self._stats:
+            self._stats[backend] = {
+                'waiting': 0,
+                'in_flight': 0,
+                'completed': 0,
+                'errors': 0,
+                'timeouts': 0
+            }
+        return self._stats[backend]
+    
+    def _release(self, backend: str) -> None:
+        """Free a backend slot once its worker thread is done"""
+        self._get_stats(backend)['in_flight'] -= 1
+        self._get_semaphore(backend).release()
+    
+    async def run(
+        self,
+        backend: str,
+        func: Callable[..., Any],
+        *args: Any,
+        timeout: Optional[float] = None,
+        wait_for_worker: bool = False,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Run a blocking callable off the event loop
+        
+        The backend slot is held until the worker thread returns, not until
+        the caller stops waiting, so a timed out call still counts against
+        the cap and abandoned calls cannot pile up in the shared pool. With
+        wait_for_worker a timeout is only logged and the caller keeps
+        waiting, for writes whose outcome has to be known.
+        """
+        stats = self._get_stats(backend)
+        call_timeout = self.timeout if timeout is None else timeout
+        
+        stats['waiting'] += 1
+        try:
+            await self._get_semaphore(backend).acquire()
+        finally:
+            stats['waiting'] -= 1
+        
+        stats['in_flight'] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            # Carry the caller's context (request ID) and deadline into the worker thread
+            context = contextvars.copy_context()
+            context.run(call_deadline.set, time.monotonic() + call_timeout)
+            future = self.pool.submit(context.run, func, *args, **kwargs)
+        except BaseException:
+            self._release(backend)
+            raise
+        future.add_done_callback(lambda _: self._release_soon(loop, backend))
+        
+        waiter = asyncio.wrap_future(future)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.shield(waiter) if wait_for_worker else waiter, timeout=call_timeout
+            )
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            name = getattr(func, '__name__', func)
+            if not wait_for_worker:
+                # The worker thread keeps running (and holds its slot); only the caller gives up
+                logger.error(f"{backend} call {name} timed out after {call_timeout}s")
+                raise
+            logger.warning(f"{backend} call {name} still running after {call_timeout}s, waiting for it")
+            try:
+                result = await waiter
+            except Exception:
+                stats['errors'] += 1
+                raise
+        except Exception:
+            stats['errors'] += 1
+            raise
+        stats['completed'] += 1
+        return result
+    
+    def _release_soon(self, loop: asyncio.AbstractEventLoop, backend: str) -> None:
+        """Done callback of a worker future, usually called on the worker thread"""
+        try:
+            loop.call_soon_threadsafe(self._release, backend)
+        except RuntimeError:
+            # Event loop already closed at shutdown; nobody is left waiting
+            pass
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and call statistics per backend"""
+        return {
+            'max_workers': self.max_workers,
+            'backends': {
+                backend: {**stats, 'limit': self.limits.get(backend, self.max_workers)}
+                for backend, stats in self._stats.items()
+            }
+        }
+    
+    def shutdown(self) -> None:
+        """Stop the thread pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+def _create_executor() -> BlockingExecutor:
+    settings = get_settings()
+    limits = {
+        'sheets': settings.SHEETS_MAX_CONCURRENCY,
+        'drive': settings.DRIVE_MAX_CONCURRENCY,
+        'sqlite': settings.SQLITE_MAX_CONCURRENCY,
+        'rate_limit': settings.RATE_LIMIT_MAX_CONCURRENCY,
+        'cache': settings.CACHE_MAX_CONCURRENCY
+    }
+    return BlockingExecutor(
+        max_workers=settings.GOOGLE_EXECUTOR_WORKERS or sum(limits.values()),
+        limits=limits,
+        timeout=settings.GOOGLE_CALL_TIMEOUT
+    )
+
+# Global executor instance
+google_executor = _create_executor()
@@ -0,0 +1,107 @@
+"""
+Per-API Google credentials and API client construction
+"""
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import httplib2
+from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import Request
+from googleapiclient.discovery import build
+from googleapiclient.http import build_http
+from ..config import get_settings
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class GoogleClients:
+    """
+    Service-account credentials for every Google API client
+    
+    The key is parsed once, and each API gets its own credentials scoped
+    to what it needs: Drive is read-only and only the Sheets token can
+    write spreadsheets. Refreshes happen here under a per-API lock so
+    worker threads never race to refresh the same token. Clients are
+    built from the discovery documents bundled with
+    google-api-python-client, so no network fetch.
+    """
+    
+    def __init__(self):
+        self.settings = get_settings()
+        self.scopes: Dict[str, List[str]] = {
+            'sheets': self.settings.SCOPES_SHEETS,
+            'drive': self.settings.SCOPES_DRIVE
+        }
+        self._key: Optional[Credentials] = None
+        self._credentials: Dict[str, Credentials] = {}
+        self._lock = threading.Lock()
+        self._refresh_locks = {api: threading.Lock() for api in self.scopes}
+        self.timings: Dict[str, float] = {}
+    
+    def credentials(self, api: str) -> Credentials:
+        """Get the credentials for one API, parsing the key on first use"""
+        credentials = self._credentials.get(api)
+        if credentials is None:
+            if api not in self.scopes:
+                raise ValueError(f"Unknown Google API: {api}")
+            with self._lock:
+                if api not in self._credentials:
+                    if self._key is None:
+                        self._key = self._load_credentials()
+                    self._credentials[api] = self._key.with_scopes(self.scopes[api])
+                credentials = self._credentials[api]
+        return credentials
+    
+    def _load_credentials(self) -> Credentials:
+        """Parse GOOGLE_CREDENTIALS_JSON (unscoped; each API scopes its own copy)"""
+        try:
+            creds_json = self.settings.GOOGLE_CREDENTIALS_JSON
+            if not creds_json:
+                raise Exception("GOOGLE_CREDENTIALS_JSON not found")
+            
+            return Credentials.from_service_account_info(json.loads(creds_json))
+        except Exception as e:
+            logger.error(f"Failed to load credentials: {e}")
+            raise
+    
+    def ensure_fresh(self, api: str) -> Credentials:
+        """Refresh an API's token if it is expired or about to expire (blocking)"""
+        credentials = self.credentials(api)
+        if credentials.valid:
+            return credentials
+        
+        with self._refresh_locks[api]:
+            # Another thread may have refreshed while we waited
+            if not credentials.valid:
+                started = time.perf_counter()
+                credentials.refresh(Request(self.http()))
+                self.timings[f'{api}_token_refresh_seconds'] = round(time.perf_counter() - started, 3)
+                logger.info(f"Refreshed Google {api} access token in {self.timings[f'{api}_token_refresh_seconds']}s")
+        return credentials
+    
+    def http(self) -> httplib2.Http:
+        """
+        New httplib2 connection that times out with the executor call
+        
+        build_http leaves the 60s socket default, four times
+        GOOGLE_CALL_TIMEOUT, so a stalled read would outlive its caller.
+        """
+        http = build_http()
+        http.timeout = self.settings.GOOGLE_CALL_TIMEOUT
+        return http
+    
+    def build(self, api: str, version: str) -> Any:
+        """Build an API client on that API's credentials from static discovery (blocking)"""
+        started = time.perf_counter()
+        client = build(
+            api, version,
+            credentials=self.credentials(api),
+            static_discovery=True,
+            cache_discovery=False
+        )
+        self.timings[f'{api}_build_seconds'] = round(time.perf_counter() - started, 3)
+        return client
+
+# Global clients instance
+google_clients = GoogleClients()
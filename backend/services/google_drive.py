@@ -1,52 +1,96 @@
 """
 Google Drive service for fetching educational videos
 """
-import json
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Callable, Optional
 from functools import lru_cache
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.errors import HttpError
 from ..config import get_settings
+from .executor import call_deadline, google_executor
+from .google_clients import google_clients
+from .google_http import google_transport
+from .metrics import GoogleCallTimer
+from .resilience import google_resilience, is_idempotent
 from ..utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+CHANGE_FIELDS = 'nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, size, parents, trashed))'
+
+def is_listed_file(file: Dict[str, Any]) -> bool:
+    """Local equivalent of the files.list query used for disease folders"""
+    name = file.get('name', '')
+    return not file.get('trashed') and (
+        'video/' in file.get('mimeType', '') or '.mp4' in name or '.pdf' in name
+    )
+
+def file_to_video(file: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a Drive file resource into a video entry"""
+    file_type = "video" if "video" in file.get('mimeType', '') else "pdf"
+    return {
+        'id': file['id'],
+        'name': file['name'],
+        'type': file_type,
+        'url': f"https://drive.google.com/file/d/{file['id']}/preview",
+        'size': int(file.get('size', 0))
+    }
+
 class GoogleDriveService:
     """Service for interacting with Google Drive"""
     
     def __init__(self):
         self.settings = get_settings()
         self._service = None
-    
-    def _get_credentials(self) -> Credentials:
-        """Get Google credentials from environment"""
-        try:
-            creds_json = self.settings.GOOGLE_CREDENTIALS_JSON
-            if not creds_json:
-                raise Exception("GOOGLE_CREDENTIALS_JSON not found")
-            
-            creds_dict = json.loads(creds_json)
-            return Credentials.from_service_account_info(creds_dict)
-        except Exception as e:
-            logger.error(f"Failed to load credentials: {e}")
-            raise
+        self._build_lock = threading.Lock()
+        self.transport = google_transport
+        self._http_local = threading.local()
+        self._folder_ids: Dict[str, str] = {}
     
     @property
     def service(self):
         """Get or create Drive service"""
         if self._service is None:
-            try:
-                credentials = self._get_credentials().with_scopes(
-                    self.settings.SCOPES_DRIVE
-                )
-                self._service = build('drive', 'v3', credentials=credentials)
-                logger.info("Google Drive service created successfully")
-            except Exception as e:
-                logger.error(f"Failed to create Drive service: {e}")
-                raise
+            with self._build_lock:
+                if self._service is None:
+                    try:
+                        self._service = google_clients.build('drive', 'v3')
+                        logger.info("Google Drive service created successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to create Drive service: {e}")
+                        raise
         return self._service
     
+    def _execute(self, request) -> Any:
+        """Execute a request on this thread's own HTTP connection (httplib2 is not thread-safe)"""
+        # Refresh centrally so per-thread connections never race to refresh the token
+        credentials = google_clients.ensure_fresh('drive')
+        http = getattr(self._http_local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(credentials, http=google_clients.http())
+            self._http_local.http = http
+        
+        def attempt():
+            with GoogleCallTimer('drive', request):
+                return request.execute(http=http)
+        return google_resilience['drive'].call_sync(
+            attempt, idempotent=is_idempotent(request), deadline=call_deadline.get()
+        )
+    
+    async def _call(self, request_factory: Callable[..., Any], *args: Any) -> Any:
+        """Build a request and send it on the async transport, or on the executor as a fallback"""
+        if self.transport is not None:
+            return await self.transport.execute('drive', request_factory(*args))
+        return await google_executor.run('drive', lambda: self._execute(request_factory(*args)))
+    
+    def ping(self) -> None:
+        """Cheapest authenticated call against the main folder (used by the health prober)"""
+        self._execute(self.service.files().get(
+            fileId=self.settings.MAIN_FOLDER_ID,
+            fields='id'
+        ))
+    
     def get_folder_id(self, folder_name: str) -> str:
         """Get folder ID by name"""
         try:
@@ -57,11 +101,11 @@ class GoogleDriveService:
                 f"trashed=false"
             )
             
-            results = self.service.files().list(
+            results = self._execute(self.service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name)'
-            ).execute()
+            ))
             
             items = results.get('files', [])
             if not items:
@@ -73,54 +117,131 @@ class GoogleDriveService:
             logger.error(f"Error finding folder: {e}")
             raise
     
-    def get_files_in_folder(self, folder_id: str) -> List[Dict[str, Any]]:
-        """Get all video and PDF files in a folder"""
+    def warm_folder_ids(self, refresh: bool = False) -> Dict[str, str]:
+        """Resolve every disease folder with a single listing of the main folder"""
+        query = (
+            f"mimeType='application/vnd.google-apps.folder' and "
+            f"'{self.settings.MAIN_FOLDER_ID}' in parents and "
+            f"trashed=false"
+        )
+        results = self._execute(self.service.files().list(
+            q=query,
+            spaces='drive',
+            fields='files(id, name)',
+            pageSize=1000
+        ))
+        
+        wanted = set(self.settings.DISEASE_FOLDERS.values())
+        folder_ids = {} if refresh else dict(self._folder_ids)
+        for item in results.get('files', []):
+            if item['name'] in wanted and item['name'] not in folder_ids:
+                folder_ids[item['name']] = item['id']
+        self._folder_ids = folder_ids
+        
+        missing = wanted - set(self._folder_ids)
+        if missing:
+            logger.warning(f"Disease folders not found: {sorted(missing)}")
+        logger.info(f"Resolved {len(self._folder_ids)} disease folder IDs")
+        return dict(self._folder_ids)
+    
+    def resolve_folder_id(self, folder_name: str, refresh: bool = False) -> str:
+        """Get a folder ID from the long-lived map, looking it up on a miss"""
+        if not refresh and folder_name in self._folder_ids:
+            return self._folder_ids[folder_name]
+        
+        folder_id = self.get_folder_id(folder_name)
+        if folder_id:
+            self._folder_ids[folder_name] = folder_id
+        else:
+            self._folder_ids.pop(folder_name, None)
+        return folder_id
+    
+    def _files_request(self, folder_id: str, page_token: Optional[str] = None):
+        """Build a files.list request for the videos and PDFs in a folder"""
+        query = (
+            f"'{folder_id}' in parents and "
+            f"(mimeType contains 'video/' or name contains '.mp4' or name contains '.pdf') and "
+            f"trashed=false"
+        )
+        return self.service.files().list(
+            q=query,
+            spaces='drive',
+            fields='nextPageToken, files(id, name, mimeType, size, webViewLink)',
+            orderBy='name',
+            pageSize=1000,
+            pageToken=page_token
+        )
+    
+    def _parse_files(self, folder_id: str, files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Turn files.list file resources into video entries"""
+        videos = [file_to_video(file) for file in files]
+        logger.info("Retrieved %d files from folder %s", len(videos), folder_id)
+        return videos
+    
+    def list_folder_files(self, folder_id: str) -> List[Dict[str, Any]]:
+        """Get the raw file resources in a folder, following every page (blocking)"""
+        files: List[Dict[str, Any]] = []
+        page_token = None
+        while True:
+            results = self._execute(self._files_request(folder_id, page_token))
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+    
+    def get_start_page_token(self) -> str:
+        """Token for the current head of the changes feed (blocking)"""
+        return self._execute(self.service.changes().getStartPageToken())['startPageToken']
+    
+    def list_changes(self, page_token: str) -> Dict[str, Any]:
+        """One page of the changes feed since page_token (blocking)"""
+        return self._execute(self.service.changes().list(
+            pageToken=page_token,
+            spaces='drive',
+            fields=CHANGE_FIELDS,
+            pageSize=1000
+        ))
+    
+    async def fetch_files_in_folder(self, folder_id: str) -> List[Dict[str, Any]]:
+        """Get all video and PDF files in a folder, following every page, without blocking the event loop"""
+        files: List[Dict[str, Any]] = []
+        page_token = None
         try:
-            query = (
-                f"'{folder_id}' in parents and "
-                f"(mimeType contains 'video/' or name contains '.mp4' or name contains '.pdf') and "
-                f"trashed=false"
-            )
-            
-            results = self.service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name, mimeType, size, webViewLink)',
-                orderBy='name'
-            ).execute()
-            
-            files = results.get('files', [])
-            
-            videos = []
-            for file in files:
-                file_type = "video" if "video" in file.get('mimeType', '') else "pdf"
-                
-                videos.append({
-                    'id': file['id'],
-                    'name': file['name'],
-                    'type': file_type,
-                    'url': f"https://drive.google.com/file/d/{file['id']}/preview",
-                    'size': int(file.get('size', 0))
-                })
-            
-            logger.info(f"Retrieved {len(videos)} files from folder {folder_id}")
-            return videos
+            while True:
+                results = await self._call(self._files_request, folder_id, page_token)
+                files.extend(results.get('files', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    return self._parse_files(folder_id, files)
         except HttpError as e:
             logger.error(f"Error fetching files: {e}")
             raise
     
-    def get_videos_for_disease(self, disease: str) -> List[Dict[str, Any]]:
+    async def get_videos_for_disease(self, disease: str) -> List[Dict[str, Any]]:
         """Get all videos for a specific disease"""
         folder_name = self.settings.DISEASE_FOLDERS.get(disease)
         if not folder_name:
             logger.warning(f"Invalid disease: {disease}")
             return []
         
-        folder_id = self.get_folder_id(folder_name)
+        # Known IDs are a dict lookup; only a miss needs a blocking Drive call
+        folder_id = self._folder_ids.get(folder_name)
+        if folder_id is None:
+            folder_id = await google_executor.run('drive', self.resolve_folder_id, folder_name)
         if not folder_id:
             return []
         
-        return self.get_files_in_folder(folder_id)
+        try:
+            return await self.fetch_files_in_folder(folder_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # Folder was moved or recreated; resolve its ID again once
+            logger.warning(f"Folder {folder_id} for {disease} not found, re-resolving")
+            folder_id = await google_executor.run('drive', self.resolve_folder_id, folder_name, True)
+            if not folder_id:
+                return []
+            return await self.fetch_files_in_folder(folder_id)
 
 # Global service instance
 drive_service = GoogleDriveService()
@@ -0,0 +1,107 @@
+"""
+Async HTTP transport for Google API requests
+"""
+from typing import Any, Optional
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from ..config import get_settings
+from .executor import google_executor
+from .google_clients import GoogleClients, google_clients
+from .metrics import GoogleCallTimer
+from .resilience import google_resilience, is_idempotent
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class GoogleAsyncTransport:
+    """
+    Sends googleapiclient requests over a pooled httpx.AsyncClient
+    
+    Requests are still built by the discovery client (no I/O), so URLs,
+    bodies and response parsing stay exactly as with httplib2; only the
+    network round trip changes. Connections are kept alive and shared, and
+    calls run concurrently on the event loop instead of occupying a thread.
+    """
+    
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive: int,
+        timeout: float,
+        clients: GoogleClients = google_clients,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self.clients = clients
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Get or create the pooled client"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive
+                ),
+                timeout=self.timeout,
+                transport=self._transport
+            )
+        return self._client
+    
+    async def _bearer_token(self, api: str) -> str:
+        """Current access token, refreshed on the executor when it is about to expire"""
+        credentials = self.clients.credentials(api)
+        if not credentials.valid:
+            credentials = await google_executor.run(api, self.clients.ensure_fresh, api)
+        return credentials.token
+    
+    async def execute(self, api: str, request: Any) -> Any:
+        """Send a googleapiclient HttpRequest with retries and circuit breaking"""
+        return await google_resilience[api].call_async(
+            lambda: self._send(api, request),
+            idempotent=is_idempotent(request)
+        )
+    
+    async def _send(self, api: str, request: Any) -> Any:
+        """Send a googleapiclient HttpRequest once and return its parsed response"""
+        headers = {
+            key: value for key, value in request.headers.items()
+            if key.lower() != 'content-length'
+        }
+        headers['authorization'] = f"Bearer {await self._bearer_token(api)}"
+        
+        with GoogleCallTimer(api, request):
+            response = await self.client.request(
+                request.method, request.uri, content=request.body, headers=headers
+            )
+            # googleapiclient's error and response handling expect an httplib2 response
+            resp = httplib2.Response({'status': response.status_code, **response.headers})
+            if response.status_code >= 300:
+                raise HttpError(resp, response.content, uri=request.uri)
+            return request.postproc(resp, response.content)
+    
+    async def aclose(self) -> None:
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def _create_transport() -> Optional[GoogleAsyncTransport]:
+    settings = get_settings()
+    if settings.GOOGLE_TRANSPORT == "httplib2":
+        return None
+    if settings.GOOGLE_TRANSPORT != "httpx":
+        raise ValueError(f"Unknown GOOGLE_TRANSPORT: {settings.GOOGLE_TRANSPORT}")
+    return GoogleAsyncTransport(
+        max_connections=settings.GOOGLE_HTTP_MAX_CONNECTIONS,
+        max_keepalive=settings.GOOGLE_HTTP_MAX_KEEPALIVE,
+        timeout=settings.GOOGLE_CALL_TIMEOUT
+    )
+
+# Global transport instance (None when the httplib2 fallback is selected)
+google_transport = _create_transport()
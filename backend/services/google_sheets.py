@@ -1,183 +1,279 @@
 """
 Google Sheets service for storing patient symptoms
 """
-import json
-import asyncio
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Callable, Optional, Tuple
 from datetime import datetime
 import jdatetime
 import pytz
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.errors import HttpError
 from ..config import get_settings
+from .executor import call_deadline, google_executor
+from .google_clients import google_clients
+from .google_http import google_transport
+from .metrics import GoogleCallTimer
+from .resilience import google_resilience, is_idempotent
+from .history_cache import history_cache
+from .history_columns import HistoryColumns
+from .history_query import select_history
+from .keyed_locks import create_keyed_locks
+from .sheet_index import SheetIndex
 from ..utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+HEADER_ROW = ['تاریخ', 'ساعت', 'نوع علامت', 'مقدار']
+
+def current_iran_timestamp(moment: Optional[datetime] = None) -> Tuple[str, str]:
+    """Get Jalali date and time in Iran timezone (now unless a moment is given)"""
+    iran_tz = pytz.timezone('Asia/Tehran')
+    now = moment.astimezone(iran_tz) if moment is not None else datetime.now(iran_tz)
+    jd = jdatetime.datetime.fromgregorian(datetime=now)
+    return jd.strftime('%Y-%m-%d'), now.strftime('%H:%M:%S')
+
+def row_to_record(row: List[str]) -> Dict[str, str]:
+    """Convert a sheet row to a history record"""
+    return {
+        'date': row[0],
+        'time': row[1],
+        'type': row[2],
+        'value': row[3]
+    }
+
+def is_sheet_missing_error(error: HttpError) -> bool:
+    """Check whether an API error means the tab does not exist"""
+    message = str(error)
+    return "not found" in message.lower() or "Unable to parse" in message
+
+def is_sheet_exists_error(error: HttpError) -> bool:
+    """Check whether an addSheet failed because the tab is already there"""
+    return error.resp.status == 400 and "already exists" in str(error)
+
 class GoogleSheetsService:
     """Service for interacting with Google Sheets"""
     
     def __init__(self):
         self.settings = get_settings()
         self._service = None
-        self._locks: Dict[str, asyncio.Lock] = {}
-    
-    def _get_credentials(self) -> Credentials:
-        """Get Google credentials from environment"""
-        try:
-            creds_json = self.settings.GOOGLE_CREDENTIALS_JSON
-            if not creds_json:
-                raise Exception("GOOGLE_CREDENTIALS_JSON not found")
-            
-            creds_dict = json.loads(creds_json)
-            return Credentials.from_service_account_info(creds_dict)
-        except Exception as e:
-            logger.error(f"Failed to load credentials: {e}")
-            raise
+        self._build_lock = threading.Lock()
+        self.transport = google_transport
+        self._http_local = threading.local()
+        self.write_locks = create_keyed_locks()
+        self.sheet_index = SheetIndex(self.get_sheet_ids, ttl=self.settings.SHEET_INDEX_TTL)
     
     @property
     def service(self):
         """Get or create Sheets service"""
         if self._service is None:
-            try:
-                credentials = self._get_credentials().with_scopes(
-                    self.settings.SCOPES_SHEETS
-                )
-                self._service = build('sheets', 'v4', credentials=credentials)
-                logger.info("Google Sheets service created successfully")
-            except Exception as e:
-                logger.error(f"Failed to create Sheets service: {e}")
-                raise
+            with self._build_lock:
+                if self._service is None:
+                    try:
+                        self._service = google_clients.build('sheets', 'v4')
+                        logger.info("Google Sheets service created successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to create Sheets service: {e}")
+                        raise
         return self._service
     
-    def _get_lock(self, sheet_name: str) -> asyncio.Lock:
-        """Get or create a lock for a specific sheet"""
-        if sheet_name not in self._locks:
-            self._locks[sheet_name] = asyncio.Lock()
-        return self._locks[sheet_name]
+    def _execute(self, request) -> Any:
+        """Execute a request on this thread's own HTTP connection (httplib2 is not thread-safe)"""
+        # Refresh centrally so per-thread connections never race to refresh the token
+        credentials = google_clients.ensure_fresh('sheets')
+        http = getattr(self._http_local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(credentials, http=google_clients.http())
+            self._http_local.http = http
+        
+        def attempt():
+            with GoogleCallTimer('sheets', request):
+                return request.execute(http=http)
+        return google_resilience['sheets'].call_sync(
+            attempt, idempotent=is_idempotent(request), deadline=call_deadline.get()
+        )
+    
+    async def _call(self, request_factory: Callable[..., Any], *args: Any) -> Any:
+        """Build a request and send it on the async transport, or on the executor as a fallback"""
+        if self.transport is not None:
+            return await self.transport.execute('sheets', request_factory(*args))
+        return await google_executor.run('sheets', lambda: self._execute(request_factory(*args)))
+    
+    def ping(self) -> None:
+        """Cheapest authenticated call against the spreadsheet (used by the health prober)"""
+        self._execute(self.service.spreadsheets().get(
+            spreadsheetId=self.settings.GOOGLE_SHEET_ID,
+            fields='spreadsheetId'
+        ))
     
-    def sheet_exists(self, sheet_name: str) -> bool:
-        """Check if a sheet exists"""
+    def ensure_sheet(self, sheet_name: str) -> int:
+        """Create a tab with headers unless it already exists; returns its sheetId"""
+        sheet_id = self.sheet_index.get(sheet_name)
+        if sheet_id is not None:
+            return sheet_id
+        
         try:
-            sheet_metadata = self.service.spreadsheets().get(
-                spreadsheetId=self.settings.GOOGLE_SHEET_ID
-            ).execute()
-            
-            sheets = sheet_metadata.get('sheets', [])
-            return any(s['properties']['title'] == sheet_name for s in sheets)
+            response = self._execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.settings.GOOGLE_SHEET_ID,
+                body={'requests': [{'addSheet': {'properties': {'title': sheet_name}}}]}
+            ))
         except HttpError as e:
-            logger.error(f"Error checking sheet existence: {e}")
-            return False
+            if not is_sheet_exists_error(e):
+                logger.error(f"Error creating sheet: {e}")
+                raise
+            # Another worker won the race; it writes the header too
+            self.sheet_index.load()
+            sheet_id = self.sheet_index.get(sheet_name)
+            if sheet_id is None:
+                raise
+            return sheet_id
+        
+        sheet_id = response['replies'][0]['addSheet']['properties']['sheetId']
+        self.sheet_index.add(sheet_name, sheet_id)
+        
+        # Add headers
+        self._execute(self.service.spreadsheets().values().update(
+            spreadsheetId=self.settings.GOOGLE_SHEET_ID,
+            range=f'{sheet_name}!A1:D1',
+            valueInputOption='RAW',
+            body={'values': [HEADER_ROW]}
+        ))
+        
+        logger.info(f"Created new sheet: {sheet_name}")
+        return sheet_id
     
-    def create_sheet(self, sheet_name: str) -> bool:
-        """Create a new sheet with headers"""
-        try:
-            # Create sheet
-            requests = [{
-                'addSheet': {
-                    'properties': {
-                        'title': sheet_name
-                    }
+    def _append_request(self, sheet_name: str, rows: List[List[str]]):
+        """Build a values.append request for rows at the end of a sheet"""
+        return self.service.spreadsheets().values().append(
+            spreadsheetId=self.settings.GOOGLE_SHEET_ID,
+            range=f'{sheet_name}!A:D',
+            valueInputOption='RAW',
+            body={'values': rows}
+        )
+    
+    def get_sheet_ids(self) -> Dict[str, int]:
+        """Get a title -> sheetId map for all tabs"""
+        sheet_metadata = self._execute(self.service.spreadsheets().get(
+            spreadsheetId=self.settings.GOOGLE_SHEET_ID,
+            fields='sheets.properties(sheetId,title)'
+        ))
+        return {
+            s['properties']['title']: s['properties']['sheetId']
+            for s in sheet_metadata.get('sheets', [])
+        }
+    
+    def append_rows_batch(self, rows_by_sheet: Dict[str, List[List[str]]]) -> None:
+        """Append rows to several sheets in a single batchUpdate call"""
+        for sheet_name in rows_by_sheet:
+            self.ensure_sheet(sheet_name)
+        
+        requests = [
+            {
+                'appendCells': {
+                    'sheetId': self.sheet_index.get(sheet_name),
+                    'rows': [
+                        {'values': [{'userEnteredValue': {'stringValue': cell}} for cell in row]}
+                        for row in rows
+                    ],
+                    'fields': 'userEnteredValue'
                 }
-            }]
-            
-            self.service.spreadsheets().batchUpdate(
+            }
+            for sheet_name, rows in rows_by_sheet.items()
+        ]
+        
+        try:
+            self._execute(self.service.spreadsheets().batchUpdate(
                 spreadsheetId=self.settings.GOOGLE_SHEET_ID,
                 body={'requests': requests}
-            ).execute()
-            
-            # Add headers
-            header = [['تاریخ', 'ساعت', 'نوع علامت', 'مقدار']]
-            self.service.spreadsheets().values().update(
-                spreadsheetId=self.settings.GOOGLE_SHEET_ID,
-                range=f'{sheet_name}!A1:D1',
-                valueInputOption='RAW',
-                body={'values': header}
-            ).execute()
-            
-            logger.info(f"Created new sheet: {sheet_name}")
-            return True
+            ))
         except HttpError as e:
-            logger.error(f"Error creating sheet: {e}")
-            return False
+            # A tab deleted by hand leaves a stale sheetId behind
+            if e.resp.status == 400:
+                self.sheet_index.load()
+            raise
+        logger.info(f"Appended {sum(len(r) for r in rows_by_sheet.values())} rows to {len(rows_by_sheet)} sheets")
+    
+    def get_rows(self, sheet_name: str) -> List[List[str]]:
+        """Read every data row of a sheet, none if the tab does not exist (blocking)"""
+        try:
+            result = self._execute(self._history_request(sheet_name))
+        except HttpError as e:
+            if is_sheet_missing_error(e):
+                return []
+            raise
+        return result.get('values', [])
     
     async def save_symptom(self, user_id: str, symptom_type: str, value: str) -> Dict[str, Any]:
         """Save a symptom to the user's sheet"""
         sheet_name = f"User_{user_id}"
         
-        # Use lock to prevent race conditions
-        async with self._get_lock(sheet_name):
-            # Ensure sheet exists
-            if not self.sheet_exists(sheet_name):
-                self.create_sheet(sheet_name)
+        # Serialize writes per user (across workers with SHEET_LOCK_BACKEND=file)
+        async with self.write_locks.hold(sheet_name):
+            await google_executor.run('sheets', self.ensure_sheet, sheet_name)
             
             try:
                 # Get current time in Iran timezone
-                iran_tz = pytz.timezone('Asia/Tehran')
-                now = datetime.now(iran_tz)
-                jd = jdatetime.datetime.fromgregorian(datetime=now)
-                current_date = jd.strftime('%Y-%m-%d')
-                current_time = now.strftime('%H:%M:%S')
+                current_date, current_time = current_iran_timestamp()
                 
                 # Append data
                 new_row = [[current_date, current_time, symptom_type, value]]
                 
-                self.service.spreadsheets().values().append(
-                    spreadsheetId=self.settings.GOOGLE_SHEET_ID,
-                    range=f'{sheet_name}!A:D',
-                    valueInputOption='RAW',
-                    body={'values': new_row}
-                ).execute()
+                await self._call(self._append_request, sheet_name, new_row)
+                history_cache.append(user_id, row_to_record(new_row[0]))
                 
-                logger.info(f"Saved symptom for {user_id}: {symptom_type} = {value}")
+                logger.info("Saved symptom for %s: %s = %s", user_id, symptom_type, value)
                 return {
                     "success": True,
                     "message": "Symptom saved successfully",
                     "timestamp": f"{current_date} {current_time}"
                 }
             except HttpError as e:
+                if is_sheet_missing_error(e):
+                    self.sheet_index.discard(sheet_name)
                 logger.error(f"Error saving symptom: {e}")
                 raise
     
-    def get_user_history(self, user_id: str, symptom_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+    async def get_user_history(self, user_id: str, symptom_filter: Optional[str] = None) -> HistoryColumns:
         """Get symptom history for a user"""
+        symptoms = history_cache.get(user_id)
+        if symptoms is None:
+            started = history_cache.begin_fill()
+            rows = await self._read_history(user_id)
+            symptoms = history_cache.fill(user_id, rows, started)
+        
+        # Apply filter if provided
+        if symptom_filter:
+            return select_history(symptoms, symptom_filter=symptom_filter)[0]
+        return symptoms.copy()
+    
+    def _history_request(self, sheet_name: str):
+        """Build a values.get request for every data row of a sheet"""
+        return self.service.spreadsheets().values().get(
+            spreadsheetId=self.settings.GOOGLE_SHEET_ID,
+            range=f'{sheet_name}!A2:D'
+        )
+    
+    async def _read_history(self, user_id: str) -> HistoryColumns:
+        """Read and parse a user's sheet"""
         sheet_name = f"User_{user_id}"
         
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.settings.GOOGLE_SHEET_ID,
-                range=f'{sheet_name}!A2:D'
-            ).execute()
+            result = await google_resilience['sheets'].hedged(
+                lambda: self._call(self._history_request, sheet_name),
+                delay=self.settings.HISTORY_HEDGE_DELAY
+            )
         except HttpError as e:
-            if "not found" in str(e).lower() or "Unable to parse" in str(e):
-                logger.info(f"No data found for user: {user_id}")
-                return []
+            if is_sheet_missing_error(e):
+                logger.info("No data found for user: %s", user_id)
+                if self.sheet_index.loaded and sheet_name in self.sheet_index:
+                    self.sheet_index.discard(sheet_name)
+                return HistoryColumns()
             logger.error(f"Error fetching history: {e}")
             raise
         
         rows = result.get('values', [])
+        symptoms = HistoryColumns.from_rows(row for row in rows if len(row) >= 4)
         
-        if not rows:
-            return []
-        
-        symptoms = []
-        for row in rows:
-            if len(row) >= 4:
-                symptom_type = row[2]
-                
-                # Apply filter if provided
-                if symptom_filter and symptom_filter not in symptom_type:
-                    continue
-                
-                symptoms.append({
-                    'date': row[0],
-                    'time': row[1],
-                    'type': symptom_type,
-                    'value': row[3]
-                })
-        
-        logger.info(f"Retrieved {len(symptoms)} records for user: {user_id}")
+        logger.info("Retrieved %d records for user: %s", len(symptoms), user_id)
         return symptoms
 
 # Global service instance
@@ -0,0 +1,114 @@
+"""
+Background health prober for upstream backends
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from ..config import get_settings
+from .executor import google_executor
+from .google_drive import drive_service
+from .google_sheets import sheets_service
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class HealthProber:
+    """
+    Periodically runs a minimal call against each backend
+    
+    Results are kept in an in-memory snapshot, so health endpoints never
+    touch Google themselves and answer without blocking.
+    """
+    
+    def __init__(self, probes: Dict[str, Callable[[], Any]], interval: float, timeout: float):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot: Dict[str, Dict[str, Any]] = {
+            name: {
+                'status': 'unknown',
+                'latency_ms': None,
+                'last_success': None,
+                'last_checked': None,
+                'last_error': None,
+                'consecutive_failures': 0
+            }
+            for name in probes
+        }
+        self._last_success_at: Dict[str, float] = {}
+    
+    async def probe(self, name: str) -> None:
+        """Run one backend's probe and record the outcome"""
+        entry = self._snapshot[name]
+        started = time.perf_counter()
+        try:
+            await google_executor.run(name, self.probes[name], timeout=self.timeout)
+        except Exception as e:
+            entry['status'] = 'error'
+            entry['last_error'] = f"{type(e).__name__}: {e}"[:200]
+            entry['consecutive_failures'] += 1
+            if entry['consecutive_failures'] == 1:
+                logger.warning(f"Health probe for {name} failed: {e}")
+        else:
+            if entry['consecutive_failures']:
+                logger.info(f"Health probe for {name} recovered")
+            entry['status'] = 'ok'
+            entry['last_error'] = None
+            entry['consecutive_failures'] = 0
+            entry['last_success'] = datetime.now().isoformat()
+            self._last_success_at[name] = time.monotonic()
+        finally:
+            entry['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            entry['last_checked'] = datetime.now().isoformat()
+    
+    async def probe_all(self) -> None:
+        """Probe every backend concurrently"""
+        await asyncio.gather(*(self.probe(name) for name in self.probes))
+    
+    async def _run(self) -> None:
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+    
+    def start(self) -> None:
+        """Start probing in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop probing"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def is_ready(self) -> bool:
+        """Every backend answered within the last few probe intervals"""
+        horizon = time.monotonic() - self.interval * 3
+        return all(
+            self._last_success_at.get(name, float('-inf')) >= horizon
+            for name in self.probes
+        )
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Latest probe results per backend"""
+        return {name: dict(entry) for name, entry in self._snapshot.items()}
+
+def _create_prober() -> HealthProber:
+    settings = get_settings()
+    return HealthProber(
+        probes={
+            'sheets': sheets_service.ping,
+            'drive': drive_service.ping
+        },
+        interval=settings.HEALTH_PROBE_INTERVAL,
+        timeout=settings.HEALTH_PROBE_TIMEOUT
+    )
+
+# Global prober instance
+health_prober = _create_prober()
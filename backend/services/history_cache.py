@@ -0,0 +1,127 @@
+"""
+Per-user symptom history cache
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+from ..config import get_settings
+from .history_columns import HistoryColumns
+
+class HistoryCache:
+    """
+    Bounded LRU/TTL cache of parsed history per user, in columnar form
+    
+    Saves are written through to cached entries. Rows still waiting in the
+    write-behind queue are tracked as pending so that a cache fill from Sheets
+    does not lose them; fills that race a write or flush are returned but not
+    stored.
+    """
+    
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._last_write: Dict[str, float] = {}
+        self._flushing: Set[str] = set()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'write_through': 0}
+    
+    def begin_fill(self) -> float:
+        """Get the marker a fill must be started with"""
+        return time.monotonic()
+    
+    def _touch(self, user_id: str) -> None:
+        """Record a write so that overlapping fills are not stored"""
+        now = time.monotonic()
+        self._last_write[user_id] = now
+        if len(self._last_write) > self.max_users:
+            # No fill outlives the TTL, so older markers can never matter
+            self._last_write = {
+                uid: ts for uid, ts in self._last_write.items() if now - ts < self.ttl
+            }
+    
+    def get(self, user_id: str) -> Optional[HistoryColumns]:
+        """Get a user's full history if cached and fresh"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+        
+        if time.monotonic() - entry['timestamp'] >= self.ttl:
+            del self._entries[user_id]
+            self._stats['misses'] += 1
+            return None
+        
+        self._entries.move_to_end(user_id)
+        self._stats['hits'] += 1
+        return entry['rows']
+    
+    def fill(self, user_id: str, rows: HistoryColumns, started: float) -> HistoryColumns:
+        """Store rows fetched from Sheets, merged with still-pending writes"""
+        merged = rows.copy()
+        for row in self._pending.get(user_id, {}).values():
+            merged.append_record(row)
+        
+        if self._last_write.get(user_id, 0.0) >= started or user_id in self._flushing:
+            # A write landed while fetching; the snapshot may be inconsistent
+            return merged
+        
+        self._entries[user_id] = {'rows': merged, 'timestamp': time.monotonic()}
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+        return merged
+    
+    def append(self, user_id: str, row: Dict[str, str]) -> None:
+        """Write a saved row through to the cached entry"""
+        self._touch(user_id)
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry['rows'].append_record(row)
+            self._stats['write_through'] += 1
+    
+    def add_pending(self, user_id: str, entry_id: str, row: Dict[str, str]) -> None:
+        """Track a queued row that is not in Sheets yet"""
+        self._pending.setdefault(user_id, {})[entry_id] = row
+        self.append(user_id, row)
+    
+    def begin_flush(self, user_ids: Set[str]) -> None:
+        """Mark users whose pending rows are being written"""
+        self._flushing.update(user_ids)
+        for user_id in user_ids:
+            self._touch(user_id)
+    
+    def end_flush(self, user_ids: Set[str], entry_ids: Set[str]) -> None:
+        """Drop rows that reached Sheets from the pending set"""
+        for user_id in user_ids:
+            pending = self._pending.get(user_id, {})
+            for entry_id in entry_ids:
+                pending.pop(entry_id, None)
+            if not pending:
+                self._pending.pop(user_id, None)
+            self._flushing.discard(user_id)
+            self._touch(user_id)
+    
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's cached history"""
+        self._entries.pop(user_id, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss/eviction counters"""
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'size': len(self._entries),
+            'hit_ratio': round(self._stats['hits'] / lookups, 3) if lookups else None
+        }
+
+def _create_cache() -> HistoryCache:
+    settings = get_settings()
+    return HistoryCache(
+        max_users=settings.HISTORY_CACHE_MAX_USERS,
+        ttl=settings.HISTORY_CACHE_TTL
+    )
+
+# Global history cache instance
+history_cache = _create_cache()
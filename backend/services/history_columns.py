@@ -0,0 +1,249 @@
+"""
+Columnar in-memory representation of symptom history
+"""
+import json
+import math
+from array import array
+from collections.abc import Sequence
+from datetime import date as gregorian_date
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import jdatetime
+from ..models import SYMPTOM_TYPES
+
+# Symptom type codes are fixed: one per catalog type, and a single code for
+# anything else typed into a sheet, whose rows keep their original strings.
+# Free text therefore never grows the table or overflows the 'H' column.
+_type_names: List[str] = list(SYMPTOM_TYPES)
+_type_json: List[str] = [json.dumps(name, ensure_ascii=False) for name in _type_names]
+_type_codes: Dict[str, int] = {name: code for code, name in enumerate(_type_names)}
+OTHER_TYPE = len(_type_names)
+
+def type_code(name: str) -> int:
+    """Small integer code for a symptom type name; OTHER_TYPE outside the catalog"""
+    return _type_codes.get(name, OTHER_TYPE)
+
+def type_name(code: int) -> Optional[str]:
+    """Catalog name of a code, None for OTHER_TYPE (read the row's own string instead)"""
+    return _type_names[code] if code < OTHER_TYPE else None
+
+def type_codes_where(predicate: Callable[[str], bool]) -> Set[int]:
+    """Codes of every catalog type whose name satisfies predicate"""
+    return {code for code, name in enumerate(_type_names) if predicate(name)}
+
+@lru_cache(maxsize=4096)
+def jalali_ordinal(date: str) -> Optional[int]:
+    """Day number of a Jalali YYYY-MM-DD date, for day arithmetic"""
+    try:
+        year, month, day = (int(part) for part in date.split('-'))
+        return jdatetime.date(year, month, day).togregorian().toordinal()
+    except (TypeError, ValueError):
+        return None
+
+@lru_cache(maxsize=4096)
+def jalali_date(ordinal: int) -> str:
+    """Inverse of jalali_ordinal"""
+    return jdatetime.date.fromgregorian(date=gregorian_date.fromordinal(ordinal)).strftime('%Y-%m-%d')
+
+# Times and readings repeat a lot across rows, so parsing and formatting are memoized
+
+@lru_cache(maxsize=4096)
+def _format_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+@lru_cache(maxsize=4096)
+def _parse_time(time: str) -> Tuple[int, bool]:
+    """Seconds since midnight (-1 if unparseable), and whether formatting gives time back"""
+    try:
+        hours, minutes, seconds = (int(part) for part in time.split(':'))
+    except (TypeError, ValueError):
+        return -1, False
+    total = hours * 3600 + minutes * 60 + seconds
+    return total, 0 <= total < 86400 and _format_time(total) == time
+
+@lru_cache(maxsize=4096)
+def _format_number(number: float) -> str:
+    if number.is_integer() and abs(number) < 1e15:
+        return str(int(number))
+    return repr(number)
+
+def _format_value(first: float, second: float) -> str:
+    if second != second:  # NaN: a single number
+        return _format_number(first)
+    return f"{_format_number(first)}/{_format_number(second)}"
+
+@lru_cache(maxsize=4096)
+def _parse_value(value: str) -> Tuple[float, float, bool]:
+    """
+    A reading as (first, second, exact)
+    
+    second is NaN for single numbers and both are NaN if the value is not
+    numeric (including "inf", "nan" and overflows like "1e400"); exact says
+    whether formatting gives value back.
+    """
+    parts = value.split('/')
+    try:
+        if len(parts) == 1:
+            first, second = float(parts[0]), math.nan
+        elif len(parts) == 2:
+            first, second = float(parts[0]), float(parts[1])
+        else:
+            return math.nan, math.nan, False
+    except ValueError:
+        return math.nan, math.nan, False
+    if not math.isfinite(first) or (len(parts) == 2 and not math.isfinite(second)):
+        # Would turn min/max/mean into Infinity, which is not valid JSON
+        return math.nan, math.nan, False
+    return first, second, _format_value(first, second) == value
+
+class HistoryColumns(Sequence):
+    """
+    A user's history as parallel arrays instead of one dict per row
+    
+    Each row costs 26 bytes: the Jalali date as a day ordinal, the time as
+    seconds since midnight, the symptom type as a code and the value as a
+    float pair (second is NaN for single numbers). Rows whose strings would
+    not survive that encoding byte for byte (hand-edited cells, "70.50",
+    types outside the catalog) also keep their original strings.
+    
+    Indexing and iteration still yield the familiar record dicts, and
+    to_json writes rows straight from the columns. sorted stays True while
+    every appended row is no earlier than the one before it.
+    """
+    
+    def __init__(self):
+        self.sorted = True
+        self.days = array('i')
+        self.seconds = array('i')
+        self.types = array('H')
+        self.first = array('d')
+        self.second = array('d')
+        self._exact: Dict[int, Tuple[str, str, str, str]] = {}
+    
+    @classmethod
+    def from_rows(cls, rows: Iterable[Iterable[str]]) -> "HistoryColumns":
+        """Build from (date, time, type, value) rows as read from a sheet or table"""
+        columns = cls()
+        for row in rows:
+            columns.append(*tuple(row)[:4])
+        return columns
+    
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, str]]) -> "HistoryColumns":
+        columns = cls()
+        for record in records:
+            columns.append_record(record)
+        return columns
+    
+    def append(self, date: str, time: str, symptom_type: str, value: str) -> None:
+        index = len(self.days)
+        day = jalali_ordinal(date) or 0
+        seconds, time_exact = _parse_time(time)
+        first, second, value_exact = _parse_value(value)
+        
+        if not time_exact:
+            seconds = 0
+        if index and (day, seconds) < (self.days[-1], self.seconds[-1]):
+            self.sorted = False
+        
+        code = type_code(symptom_type)
+        self.days.append(day)
+        self.seconds.append(seconds)
+        self.types.append(code)
+        self.first.append(first)
+        self.second.append(second)
+        
+        if not (day and time_exact and value_exact and code != OTHER_TYPE and jalali_date(day) == date):
+            self._exact[index] = (date, time, symptom_type, value)
+    
+    def append_record(self, record: Dict[str, str]) -> None:
+        self.append(record['date'], record['time'], record['type'], record['value'])
+    
+    def __len__(self) -> int:
+        return len(self.days)
+    
+    def _fields(self, index: int) -> Tuple[str, str, str, str]:
+        exact = self._exact.get(index)
+        if exact is not None:
+            return exact
+        return (
+            jalali_date(self.days[index]),
+            _format_time(self.seconds[index]),
+            _type_names[self.types[index]],
+            _format_value(self.first[index], self.second[index])
+        )
+    
+    def record(self, index: int) -> Dict[str, str]:
+        date, time, symptom_type, value = self._fields(index)
+        return {'date': date, 'time': time, 'type': symptom_type, 'value': value}
+    
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self.record(index)
+    
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        for index in range(len(self)):
+            yield self.record(index)
+    
+    def type_at(self, index: int) -> str:
+        """Symptom type name of a row, including types outside the catalog"""
+        exact = self._exact.get(index)
+        return exact[2] if exact is not None else _type_names[self.types[index]]
+    
+    def is_exact(self, index: int) -> bool:
+        """Whether a row is kept as its original strings"""
+        return index in self._exact
+    
+    def take(self, indices: Iterable[int]) -> "HistoryColumns":
+        """New container with the given rows, in the given order"""
+        if isinstance(indices, range) and indices.step == 1:
+            return self._slice(indices.start, indices.stop)
+        taken = HistoryColumns()
+        taken.sorted = False  # arbitrary order; not worth checking
+        for new_index, index in enumerate(indices):
+            taken.days.append(self.days[index])
+            taken.seconds.append(self.seconds[index])
+            taken.types.append(self.types[index])
+            taken.first.append(self.first[index])
+            taken.second.append(self.second[index])
+            exact = self._exact.get(index)
+            if exact is not None:
+                taken._exact[new_index] = exact
+        return taken
+    
+    def _slice(self, start: int, stop: int) -> "HistoryColumns":
+        taken = HistoryColumns()
+        taken.sorted = self.sorted
+        taken.days = self.days[start:stop]
+        taken.seconds = self.seconds[start:stop]
+        taken.types = self.types[start:stop]
+        taken.first = self.first[start:stop]
+        taken.second = self.second[start:stop]
+        taken._exact = {i - start: exact for i, exact in self._exact.items() if start <= i < stop}
+        return taken
+    
+    def copy(self) -> "HistoryColumns":
+        return self._slice(0, len(self))
+    
+    def to_json(self, start: int = 0, stop: Optional[int] = None) -> str:
+        """Rows start..stop as comma-separated JSON objects, same bytes as json.dumps of the records"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        parts = []
+        for index in range(start, stop):
+            exact = self._exact.get(index)
+            if exact is not None:
+                parts.append(json.dumps(self.record(index), ensure_ascii=False, separators=(",", ":")))
+                continue
+            # Dates, times and numbers are plain ASCII; type names are pre-encoded
+            parts.append(
+                '{"date":"' + jalali_date(self.days[index])
+                + '","time":"' + _format_time(self.seconds[index])
+                + '","type":' + _type_json[self.types[index]]
+                + ',"value":"' + _format_value(self.first[index], self.second[index]) + '"}'
+            )
+        return ",".join(parts)
@@ -0,0 +1,98 @@
+"""
+Filtering and pagination over parsed symptom history
+"""
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+from .history_columns import OTHER_TYPE, HistoryColumns, jalali_ordinal, type_codes_where
+
+def _date_bounds(records: HistoryColumns, from_date: Optional[str], to_date: Optional[str]) -> Tuple[int, int]:
+    """Row range for an inclusive Jalali date range, by binary search on the day column"""
+    def bound(search, date: str) -> int:
+        ordinal = jalali_ordinal(date)
+        if ordinal is None:
+            # Not a real calendar day; compare as strings like the raw rows would
+            return search(records, date, key=lambda r: r['date'])
+        return search(records.days, ordinal)
+    
+    start = bound(bisect_left, from_date) if from_date else 0
+    end = bound(bisect_right, to_date) if to_date else len(records)
+    return start, end
+
+def _date_rows(records: HistoryColumns, from_date: Optional[str], to_date: Optional[str]) -> List[int]:
+    """Rows in an inclusive Jalali date range by a linear scan, in (day, time) order"""
+    days = records.days
+    rows: Sequence[int] = range(len(records))
+    for date, keep in ((from_date, lambda a, b: a >= b), (to_date, lambda a, b: a <= b)):
+        if not date:
+            continue
+        ordinal = jalali_ordinal(date)
+        if ordinal is None:
+            rows = [i for i in rows if keep(records.record(i)['date'], date)]
+        else:
+            # Day 0 marks a row whose date did not parse; it is in no range
+            rows = [i for i in rows if days[i] and keep(days[i], ordinal)]
+    seconds = records.seconds
+    return sorted(rows, key=lambda i: (days[i], seconds[i]))
+
+def select_history(
+    records: Union[HistoryColumns, Sequence[Dict[str, Any]]],
+    symptom_filter: Optional[str] = None,
+    symptom_type: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: int = 0
+) -> Tuple[HistoryColumns, Optional[int]]:
+    """
+    Select a page of history records
+    
+    Rows are ordered by date and time. Sheets are usually appended in that
+    order, and then date bounds are found by binary search; backdated rows
+    (offline sync) make the container unsorted, and it is scanned and
+    ordered instead. Without a limit the whole match set is returned oldest
+    first; with a limit pages are read newest first and the returned cursor
+    is the offset of the next page. Type filters compare type codes, so no
+    row is decoded until the page is serialized.
+    """
+    if not isinstance(records, HistoryColumns):
+        records = HistoryColumns.from_records(records)
+    if records.sorted:
+        start, end = _date_bounds(records, from_date, to_date)
+        rows: Sequence[int] = range(start, end)
+    else:
+        rows = _date_rows(records, from_date, to_date)
+    
+    codes: Optional[Set[int]] = None
+    if symptom_type or symptom_filter:
+        def wanted(name: str) -> bool:
+            return (not symptom_type or name == symptom_type) and (not symptom_filter or symptom_filter in name)
+        codes = type_codes_where(wanted)
+    
+    if codes is None:
+        if limit is None:
+            return records.take(rows), None
+        # No per-row predicate: the page is a direct slice from the end
+        page_end = max(len(rows) - cursor, 0)
+        page_start = max(page_end - limit, 0)
+        return records.take(rows[page_start:page_end][::-1]), (cursor + limit if page_start > 0 else None)
+    
+    # Rows of types outside the catalog share one code and are matched by their own string
+    types = records.types
+    if limit is None:
+        return records.take([
+            i for i in rows
+            if types[i] in codes or (types[i] == OTHER_TYPE and wanted(records.type_at(i)))
+        ]), None
+    
+    page: List[int] = []
+    skipped = 0
+    for i in reversed(rows):
+        if types[i] not in codes and not (types[i] == OTHER_TYPE and wanted(records.type_at(i))):
+            continue
+        if skipped < cursor:
+            skipped += 1
+            continue
+        if len(page) == limit:
+            return records.take(page), cursor + limit
+        page.append(i)
+    return records.take(page), None
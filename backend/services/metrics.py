@@ -0,0 +1,303 @@
+"""
+Lightweight Prometheus-style metrics
+
+Counters and histograms are sharded per thread: each thread only ever
+writes to its own dict, so the hot path takes no lock, and a scrape sums
+the shards. Gauges are callbacks evaluated at scrape time, which lets
+existing stats (cache, executor) be exported without touching their
+code paths.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Baseline for time-to-first-successful-request; this module is imported at app start
+PROCESS_STARTED = time.monotonic()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Iterable[str], values: Iterable[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _ShardedMetric:
+    """Base for metrics whose samples are written into per-thread shards"""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Dict[Labels, Any]] = []
+        self._shards_lock = threading.Lock()
+    
+    def _shard(self) -> Dict[Labels, Any]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            # Taken once per thread, never on the hot path
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+    
+    def _snapshots(self) -> List[Dict[Labels, Any]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict.copy() runs without releasing the GIL, so it never sees a half-written shard
+        return [shard.copy() for shard in shards]
+
+class Counter(_ShardedMetric):
+    """Monotonic counter"""
+    
+    kind = "counter"
+    
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+    
+    def values(self) -> Dict[Labels, float]:
+        totals: Dict[Labels, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+    
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.values().items())
+        ]
+
+class Histogram(_ShardedMetric):
+    """Cumulative-bucket histogram; each series is [bucket counts..., sum, count]"""
+    
+    kind = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, *labels: Any) -> None:
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+    
+    def values(self) -> Dict[Labels, List[float]]:
+        totals: Dict[Labels, List[float]] = {}
+        for shard in self._snapshots():
+            for labels, series in shard.items():
+                series = list(series)
+                if labels in totals:
+                    totals[labels] = [a + b for a, b in zip(totals[labels], series)]
+                else:
+                    totals[labels] = series
+        return totals
+    
+    def render(self) -> List[str]:
+        lines = []
+        for labels, series in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+class GaugeCallback:
+    """Gauge read from a callback at scrape time; returns a number or {labels: number}"""
+    
+    kind = "gauge"
+    
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Union[float, Dict[Labels, float]]],
+        labelnames: Tuple[str, ...] = (),
+        kind: str = "gauge"
+    ):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+    
+    def render(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"Metric {self.name} failed: {e}")
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(sample)}"
+            for labels, sample in sorted(value.items())
+            if sample is not None
+        ]
+
+class MetricsRegistry:
+    """Holds metrics and renders the Prometheus text exposition format"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+    
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+    
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+    
+    def gauge(self, name: str, help: str, callback: Callable, labelnames: Tuple[str, ...] = (), kind: str = "gauge") -> GaugeCallback:
+        return self._register(GaugeCallback(name, help, callback, labelnames, kind))
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class GoogleCallTimer:
+    """Times one Google API request and records it under its API method"""
+    
+    __slots__ = ("api", "method", "started")
+    
+    def __init__(self, api: str, request: Any):
+        self.api = api
+        # "sheets.spreadsheets.values.append" -> "values.append"
+        self.method = ".".join((getattr(request, "methodId", None) or "unknown").split(".")[-2:])
+    
+    def __enter__(self) -> "GoogleCallTimer":
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        google_api_latency.observe(time.perf_counter() - self.started, self.api, self.method)
+        if exc is None:
+            if self.api not in first_success:
+                first_success[self.api] = round(time.monotonic() - PROCESS_STARTED, 3)
+        else:
+            status = getattr(getattr(exc, "resp", None), "status", None) or exc_type.__name__
+            google_api_errors.inc(self.api, self.method, str(status))
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task"""
+    
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(time.perf_counter() - started - self.interval, 0.0)
+            event_loop_lag.observe(self.last_lag)
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# Global registry and the metrics recorded on hot paths
+metrics = MetricsRegistry()
+
+http_request_latency = metrics.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status")
+)
+google_api_latency = metrics.histogram(
+    "google_api_request_duration_seconds",
+    "Google API call latency by API method",
+    ("api", "method")
+)
+google_api_errors = metrics.counter(
+    "google_api_errors_total",
+    "Failed Google API calls by API method and HTTP status or exception",
+    ("api", "method", "status")
+)
+rate_limit_rejections = metrics.counter(
+    "rate_limit_rejections_total",
+    "Requests rejected by the rate limiter",
+    ("rule",)
+)
+rate_limit_store_errors = metrics.counter(
+    "rate_limit_store_errors_total",
+    "Requests let through unchecked because the rate limit store failed",
+    ("rule",)
+)
+event_loop_lag = metrics.histogram(
+    "event_loop_lag_seconds",
+    "Delay between a timer's due time and the loop running it",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+# Seconds from process start to the first successful call, per API
+first_success: Dict[str, float] = {}
+metrics.gauge(
+    "google_time_to_first_success_seconds",
+    "Seconds from process start to the first successful Google API call",
+    lambda: {(api,): seconds for api, seconds in first_success.items()},
+    ("api",)
+)
+
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,302 @@
+"""
+Retries, backoff and circuit breaking for Google API calls
+"""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from ..config import get_settings
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE'}
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a backend's circuit is open"""
+    
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f"{backend} circuit open, retry in {retry_after:.0f}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+def is_idempotent(request: Any) -> bool:
+    """Whether a request may be repeated after an ambiguous failure"""
+    return getattr(request, 'method', 'GET').upper() in IDEMPOTENT_METHODS
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failure says the upstream is unhealthy rather than the request is wrong"""
+    if isinstance(error, HttpError):
+        return error.resp.status in TRANSIENT_STATUSES
+    return isinstance(error, (OSError, asyncio.TimeoutError, httpx.TransportError, httplib2.HttpLib2Error))
+
+def is_ambiguous(error: BaseException) -> bool:
+    """Whether a failed write may still have been applied upstream"""
+    if not is_transient(error):
+        return False
+    # Only quota rejections and refused connections are known not to have been applied
+    quota = isinstance(error, HttpError) and error.resp.status == 429
+    connect = isinstance(error, (ConnectionRefusedError, httpx.ConnectError))
+    return not (quota or connect)
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) from an API error"""
+    if not isinstance(error, HttpError):
+        return None
+    value = error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    """
+    Closed -> open after consecutive transient failures; open -> half-open
+    after reset_timeout, when a single trial call decides whether to close.
+    """
+    
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    def before_call(self) -> bool:
+        """Let a call through or fail fast; returns whether the call is the half-open trial"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            remaining = self.opened_until - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+        raise CircuitOpenError(self.name, max(remaining, 1.0))
+    
+    def release_trial(self) -> None:
+        """Free the trial slot of a call that ended without an outcome (cancelled)"""
+        with self._lock:
+            self._trial_in_flight = False
+    
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"{self.name} circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self, hold_for: Optional[float] = None) -> None:
+        """Count a transient failure; hold_for opens the circuit for at least that long"""
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold or hold_for:
+                duration = max(self.reset_timeout, hold_for or 0)
+                if self.state != self.OPEN:
+                    logger.warning(f"{self.name} circuit open for {duration:.0f}s after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_until = max(self.opened_until, time.monotonic() + duration)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'open_for_seconds': round(max(self.opened_until - time.monotonic(), 0), 1) if self.state == self.OPEN else 0
+        }
+
+class Resilience:
+    """Retry policy, circuit breaker and hedging for one backend"""
+    
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        breaker: CircuitBreaker
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self._stats = {
+            'retries': 0,
+            'gave_up': 0,
+            'rejected': 0,
+            'hedges': 0,
+            'hedge_wins': 0
+        }
+    
+    def _on_failure(
+        self,
+        error: Exception,
+        attempt: int,
+        idempotent: bool,
+        deadline: Optional[float] = None
+    ) -> Optional[float]:
+        """Record a failed attempt; returns the delay before retrying, or None to give up"""
+        if not is_transient(error):
+            # Upstream answered; the request itself was wrong
+            self.breaker.record_success()
+            return None
+        
+        retry_after = retry_after_seconds(error)
+        self.breaker.record_failure(hold_for=retry_after if retry_after and retry_after > self.max_delay else None)
+        
+        if attempt + 1 >= self.max_attempts or (is_ambiguous(error) and not idempotent):
+            self._stats['gave_up'] += 1
+            return None
+        if retry_after is not None and retry_after > self.max_delay:
+            self._stats['gave_up'] += 1
+            return None
+        
+        # Full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            # The caller will have stopped waiting before the retry even starts
+            self._stats['gave_up'] += 1
+            return None
+        self._stats['retries'] += 1
+        logger.warning(f"{self.name} call failed ({error}), retry {attempt + 1} in {delay:.2f}s")
+        return delay
+    
+    def _before_attempt(self) -> bool:
+        try:
+            return self.breaker.before_call()
+        except CircuitOpenError:
+            self._stats['rejected'] += 1
+            raise
+    
+    def call_sync(
+        self,
+        func: Callable[[], Any],
+        idempotent: bool = True,
+        deadline: Optional[float] = None
+    ) -> Any:
+        """
+        Run a blocking call with retries (on a worker thread)
+        
+        deadline is the time.monotonic() at which the caller stops waiting;
+        no retry is started past it, so an abandoned thread does not keep
+        sleeping and resending a request nobody will see the answer to.
+        """
+        attempt = 0
+        while True:
+            trial = self._before_attempt()
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._on_failure(e, attempt, idempotent, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+            except BaseException:
+                # Interrupted, so neither outcome was recorded
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+    
+    async def call_async(self, func: Callable[[], Awaitable[Any]], idempotent: bool = True) -> Any:
+        """Await a call with retries"""
+        attempt = 0
+        while True:
+            trial = self._before_attempt()
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._on_failure(e, attempt, idempotent)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException:
+                # Cancelled (a losing hedge, shutdown), so neither outcome was recorded
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+    
+    async def hedged(self, func: Callable[[], Awaitable[Any]], delay: float) -> Any:
+        """
+        Start a second identical read if the first is slower than delay
+        
+        The first successful result wins and the other is cancelled. No
+        hedge is sent unless the circuit is closed, so hedging never adds
+        load to a struggling backend.
+        """
+        first = asyncio.ensure_future(func())
+        if delay <= 0:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or self.breaker.state != CircuitBreaker.CLOSED:
+            return await first
+        
+        self._stats['hedges'] += 1
+        second = asyncio.ensure_future(func())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._stats['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.breaker.get_stats(), **self._stats}
+
+def _create_resilience(name: str) -> Resilience:
+    settings = get_settings()
+    return Resilience(
+        name,
+        max_attempts=settings.GOOGLE_RETRY_MAX_ATTEMPTS,
+        base_delay=settings.GOOGLE_RETRY_BASE_DELAY,
+        max_delay=settings.GOOGLE_RETRY_MAX_DELAY,
+        breaker=CircuitBreaker(
+            name,
+            failure_threshold=settings.GOOGLE_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.GOOGLE_BREAKER_RESET_TIMEOUT
+        )
+    )
+
+# Global per-backend instances
+google_resilience: Dict[str, Resilience] = {
+    'sheets': _create_resilience('sheets'),
+    'drive': _create_resilience('drive')
+}
@@ -0,0 +1,82 @@
+"""
+In-memory index of spreadsheet tabs
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class SheetIndex:
+    """Title -> sheetId map loaded once and refreshed in the background"""
+    
+    def __init__(self, loader: Callable[[], Dict[str, int]], ttl: float):
+        self._loader = loader
+        self.ttl = ttl
+        self._sheets: Optional[Dict[str, int]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+    
+    @property
+    def loaded(self) -> bool:
+        return self._sheets is not None
+    
+    def load(self) -> Dict[str, int]:
+        """Fetch the full tab list (blocking)"""
+        sheets = self._loader()
+        with self._lock:
+            self._sheets = dict(sheets)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Loaded sheet index with {len(sheets)} tabs")
+        return sheets
+    
+    def _refresh_in_background(self) -> None:
+        """Reload the index on a daemon thread, at most one at a time"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        
+        def refresh():
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Failed to refresh sheet index: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+        
+        threading.Thread(target=refresh, name="sheet-index-refresh", daemon=True).start()
+    
+    def get(self, sheet_name: str) -> Optional[int]:
+        """Get a tab's sheetId, loading the index on first use"""
+        if self._sheets is None:
+            self.load()
+        elif time.monotonic() - self._loaded_at >= self.ttl:
+            self._refresh_in_background()
+        return self._sheets.get(sheet_name)
+    
+    def __contains__(self, sheet_name: str) -> bool:
+        return self.get(sheet_name) is not None
+    
+    def add(self, sheet_name: str, sheet_id: int) -> None:
+        """Record a tab that was just created"""
+        with self._lock:
+            if self._sheets is not None:
+                self._sheets[sheet_name] = sheet_id
+    
+    def discard(self, sheet_name: str) -> None:
+        """Forget a tab after a "not found" error and reload in the background"""
+        with self._lock:
+            if self._sheets is not None:
+                self._sheets.pop(sheet_name, None)
+        self._refresh_in_background()
+    
+    def get_stats(self) -> Dict[str, float]:
+        """Get index statistics"""
+        return {
+            'tabs': len(self._sheets or {}),
+            'age_seconds': round(time.monotonic() - self._loaded_at, 1) if self.loaded else None
+        }
@@ -0,0 +1,407 @@
+"""
+Symptom storage backends
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from ..config import get_settings
+from .executor import google_executor
+from .google_sheets import sheets_service, current_iran_timestamp, row_to_record
+from .history_cache import history_cache
+from .history_columns import HistoryColumns
+from .history_query import select_history
+from .write_queue import symptom_queue
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class SymptomStorage(ABC):
+    """Interface for persisting and reading symptom records"""
+    
+    @abstractmethod
+    async def save_symptom(self, user_id: str, symptom_type: str, value: str) -> Dict[str, Any]:
+        """Save a symptom and return the SymptomResponse payload"""
+    
+    @abstractmethod
+    async def save_batch(self, records: List[Dict[str, str]]) -> List[bool]:
+        """
+        Save validated records with one grouped write
+        
+        Each record has user_id, symptom_type, value, date, time and
+        idempotency_key. Returns False for records already stored.
+        """
+    
+    @abstractmethod
+    async def get_user_history(self, user_id: str, symptom_filter: Optional[str] = None) -> HistoryColumns:
+        """Get a user's full history, oldest first"""
+    
+    @abstractmethod
+    async def query_history(
+        self,
+        user_id: str,
+        symptom_filter: Optional[str] = None,
+        symptom_type: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: int = 0
+    ) -> Tuple[HistoryColumns, Optional[int]]:
+        """Get a filtered page of history and the next cursor"""
+    
+    async def start(self) -> None:
+        """Prepare the backend on application startup"""
+    
+    async def stop(self) -> None:
+        """Release resources on application shutdown"""
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get backend statistics"""
+        return {}
+
+class RecentKeys:
+    """Bounded LRU set of recently stored idempotency keys"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+    
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._keys
+    
+    def add(self, key: Tuple[str, str]) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+    
+    def discard(self, key: Tuple[str, str]) -> None:
+        self._keys.pop(key, None)
+
+class SheetsStorage(SymptomStorage):
+    """
+    Google Sheets storage, optionally behind the write-behind queue
+    
+    The spreadsheet has no room for idempotency keys, so duplicates are
+    detected against a bounded in-process window of recent keys.
+    """
+    
+    def __init__(self, write_behind: bool, idempotency_window: int = 100000):
+        self.write_behind = write_behind
+        self._recent_keys = RecentKeys(idempotency_window)
+    
+    async def save_symptom(self, user_id: str, symptom_type: str, value: str) -> Dict[str, Any]:
+        if self.write_behind:
+            return await symptom_queue.submit(user_id, symptom_type, value)
+        return await sheets_service.save_symptom(user_id, symptom_type, value)
+    
+    async def save_batch(self, records: List[Dict[str, str]]) -> List[bool]:
+        stored = []
+        new_records = []
+        for record in records:
+            key = (record['user_id'], record['idempotency_key'])
+            is_new = key not in self._recent_keys
+            if is_new:
+                # Reserve before writing so a concurrent retry is a duplicate
+                self._recent_keys.add(key)
+                new_records.append(record)
+            stored.append(is_new)
+        
+        user_rows = [
+            (r['user_id'], [r['date'], r['time'], r['symptom_type'], r['value']])
+            for r in new_records
+        ]
+        try:
+            if self.write_behind:
+                await symptom_queue.submit_rows(user_rows)
+            elif user_rows:
+                rows_by_sheet: Dict[str, List[List[str]]] = {}
+                for user_id, row in user_rows:
+                    rows_by_sheet.setdefault(f"User_{user_id}", []).append(row)
+                await google_executor.run('sheets', sheets_service.append_rows_batch, rows_by_sheet)
+                for user_id, row in user_rows:
+                    history_cache.append(user_id, row_to_record(row))
+        except Exception:
+            for record in new_records:
+                self._recent_keys.discard((record['user_id'], record['idempotency_key']))
+            raise
+        return stored
+    
+    async def get_user_history(self, user_id: str, symptom_filter: Optional[str] = None) -> HistoryColumns:
+        return await sheets_service.get_user_history(user_id, symptom_filter)
+    
+    async def query_history(
+        self,
+        user_id: str,
+        symptom_filter: Optional[str] = None,
+        symptom_type: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: int = 0
+    ) -> Tuple[HistoryColumns, Optional[int]]:
+        history = await sheets_service.get_user_history(user_id)
+        return select_history(
+            history, symptom_filter, symptom_type, from_date, to_date, limit, cursor
+        )
+    
+    async def start(self) -> None:
+        try:
+            await google_executor.run('sheets', sheets_service.sheet_index.load)
+        except Exception as e:
+            logger.warning(f"Sheet index not loaded at startup: {e}")
+        
+        if self.write_behind:
+            await symptom_queue.start()
+    
+    async def stop(self) -> None:
+        if self.write_behind:
+            await symptom_queue.stop()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            'backend': 'sheets',
+            'sheet_index': sheets_service.sheet_index.get_stats(),
+            'write_locks': sheets_service.write_locks.get_stats()
+        }
+        if self.write_behind:
+            stats['write_queue'] = symptom_queue.get_stats()
+        return stats
+
+class SQLiteStorage(SymptomStorage):
+    """
+    Local SQLite storage in WAL mode
+    
+    With mirror_to_sheets enabled, rows not yet copied to the spreadsheet
+    are pushed in the background so clinicians keep seeing the data there.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS symptoms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            symptom_type TEXT NOT NULL,
+            value TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            mirrored INTEGER NOT NULL DEFAULT 0,
+            idempotency_key TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_symptoms_user_type_ts
+            ON symptoms (user_id, symptom_type, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_symptoms_user_ts
+            ON symptoms (user_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_symptoms_unmirrored
+            ON symptoms (mirrored) WHERE mirrored = 0;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_symptoms_idempotency
+            ON symptoms (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL;
+    """
+    
+    def __init__(self, path: str, mirror_to_sheets: bool = False, mirror_interval: float = 30, mirror_batch: int = 500):
+        self.path = path
+        self.mirror_to_sheets = mirror_to_sheets
+        self.mirror_interval = mirror_interval
+        self.mirror_batch = mirror_batch
+        self._local = threading.local()
+        self._mirror_task: Optional[asyncio.Task] = None
+        self._stats = {'saved': 0, 'mirrored': 0, 'failed_mirrors': 0}
+        self._initialized = False
+        self._init_lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection (sqlite3 connections are per-thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        with self._init_lock:
+            if not self._initialized:
+                columns = {row['name'] for row in conn.execute("PRAGMA table_info(symptoms)")}
+                if columns and 'idempotency_key' not in columns:
+                    conn.execute("ALTER TABLE symptoms ADD COLUMN idempotency_key TEXT")
+                conn.executescript(self.SCHEMA)
+                self._initialized = True
+        return conn
+    
+    async def _run(self, func, *args: Any) -> Any:
+        return await google_executor.run('sqlite', func, *args)
+    
+    def _insert(self, user_id: str, symptom_type: str, value: str, date: str, time: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO symptoms (user_id, symptom_type, value, date, time, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, symptom_type, value, date, time, f"{date} {time}")
+            )
+    
+    def _insert_many(self, records: List[Dict[str, str]]) -> List[bool]:
+        conn = self._connect()
+        stored = []
+        with conn:
+            for r in records:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO symptoms "
+                    "(user_id, symptom_type, value, date, time, timestamp, idempotency_key) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (r['user_id'], r['symptom_type'], r['value'], r['date'], r['time'],
+                     f"{r['date']} {r['time']}", r['idempotency_key'])
+                )
+                stored.append(cursor.rowcount == 1)
+        return stored
+    
+    def _select(
+        self,
+        user_id: str,
+        symptom_filter: Optional[str],
+        symptom_type: Optional[str],
+        from_date: Optional[str],
+        to_date: Optional[str],
+        limit: Optional[int],
+        cursor: int
+    ) -> Tuple[HistoryColumns, Optional[int]]:
+        clauses = ["user_id = ?"]
+        params: List[Any] = [user_id]
+        if symptom_type:
+            clauses.append("symptom_type = ?")
+            params.append(symptom_type)
+        if symptom_filter:
+            clauses.append("instr(symptom_type, ?) > 0")
+            params.append(symptom_filter)
+        if from_date:
+            clauses.append("timestamp >= ?")
+            params.append(from_date)
+        if to_date:
+            clauses.append("timestamp <= ?")
+            params.append(f"{to_date} 23:59:59")
+        
+        sql = f"SELECT date, time, symptom_type AS type, value FROM symptoms WHERE {' AND '.join(clauses)}"
+        if limit is None:
+            rows = self._connect().execute(sql + " ORDER BY timestamp, id", params).fetchall()
+            return HistoryColumns.from_rows(rows), None
+        
+        # Fetch one extra row to know whether another page exists
+        rows = self._connect().execute(
+            sql + " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+            params + [limit + 1, cursor]
+        ).fetchall()
+        page = HistoryColumns.from_rows(rows[:limit])
+        return page, (cursor + limit if len(rows) > limit else None)
+    
+    async def save_symptom(self, user_id: str, symptom_type: str, value: str) -> Dict[str, Any]:
+        current_date, current_time = current_iran_timestamp()
+        await self._run(self._insert, user_id, symptom_type, value, current_date, current_time)
+        self._stats['saved'] += 1
+        
+        logger.info("Saved symptom for %s: %s = %s", user_id, symptom_type, value)
+        return {
+            "success": True,
+            "message": "Symptom saved successfully",
+            "timestamp": f"{current_date} {current_time}"
+        }
+    
+    async def save_batch(self, records: List[Dict[str, str]]) -> List[bool]:
+        stored = await self._run(self._insert_many, records)
+        self._stats['saved'] += sum(stored)
+        return stored
+    
+    async def get_user_history(self, user_id: str, symptom_filter: Optional[str] = None) -> HistoryColumns:
+        history, _ = await self._run(self._select, user_id, symptom_filter, None, None, None, None, 0)
+        return history
+    
+    async def query_history(
+        self,
+        user_id: str,
+        symptom_filter: Optional[str] = None,
+        symptom_type: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: int = 0
+    ) -> Tuple[HistoryColumns, Optional[int]]:
+        return await self._run(
+            self._select, user_id, symptom_filter, symptom_type, from_date, to_date, limit, cursor
+        )
+    
+    def _mirror_once(self) -> int:
+        """Copy unmirrored rows to Sheets and mark them (blocking)"""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT id, user_id, date, time, symptom_type, value FROM symptoms "
+            "WHERE mirrored = 0 ORDER BY id LIMIT ?",
+            (self.mirror_batch,)
+        ).fetchall()
+        if not rows:
+            return 0
+        
+        rows_by_sheet: Dict[str, List[List[str]]] = {}
+        for row in rows:
+            rows_by_sheet.setdefault(f"User_{row['user_id']}", []).append(
+                [row['date'], row['time'], row['symptom_type'], row['value']]
+            )
+        sheets_service.append_rows_batch(rows_by_sheet)
+        
+        with conn:
+            conn.executemany(
+                "UPDATE symptoms SET mirrored = 1 WHERE id = ?",
+                [(row['id'],) for row in rows]
+            )
+        return len(rows)
+    
+    async def _mirror_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.mirror_interval)
+            try:
+                mirrored = await google_executor.run('sheets', self._mirror_once)
+                self._stats['mirrored'] += mirrored
+                if mirrored:
+                    logger.info(f"Mirrored {mirrored} symptoms to Google Sheets")
+            except Exception as e:
+                self._stats['failed_mirrors'] += 1
+                logger.error(f"Failed to mirror symptoms to Sheets: {e}")
+    
+    async def start(self) -> None:
+        await self._run(self._connect)
+        if self.mirror_to_sheets and self._mirror_task is None:
+            self._mirror_task = asyncio.create_task(self._mirror_loop())
+    
+    async def stop(self) -> None:
+        if self._mirror_task is not None:
+            self._mirror_task.cancel()
+            try:
+                await self._mirror_task
+            except asyncio.CancelledError:
+                pass
+            self._mirror_task = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': 'sqlite', 'mirror': self.mirror_to_sheets, **self._stats}
+
+def create_storage() -> SymptomStorage:
+    """Create the storage backend selected in settings"""
+    settings = get_settings()
+    if settings.STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(
+            path=settings.SQLITE_PATH,
+            mirror_to_sheets=settings.SQLITE_MIRROR_TO_SHEETS,
+            mirror_interval=settings.SQLITE_MIRROR_INTERVAL
+        )
+    if settings.STORAGE_BACKEND != "sheets":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+    return SheetsStorage(
+        write_behind=settings.SYMPTOM_WRITE_BEHIND,
+        idempotency_window=settings.IDEMPOTENCY_WINDOW
+    )
+
+# Global storage instance
+symptom_storage = create_storage()
@@ -0,0 +1,202 @@
+"""
+Per-user symptom aggregates, updated incrementally
+"""
+import math
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from ..config import get_settings
+from ..models import SYMPTOM_TYPE_CATALOG
+from .history_columns import HistoryColumns, type_name
+
+ROLLING_WINDOWS = (7, 30)
+
+# Keys of a flat series summary, for types split into parts
+SERIES_KEYS = ('count', 'min', 'max', 'mean', 'out_of_range') + tuple(f'mean_{window}d' for window in ROLLING_WINDOWS)
+
+class SeriesStats:
+    """
+    Running count/sum/min/max, out-of-range count and per-day sums of one series
+    
+    Folding in new readings costs O(1) each. Rolling averages are read from
+    the per-day buckets, so they cost at most one lookup per day in the window.
+    """
+    
+    __slots__ = ('low', 'high', 'count', 'total', 'min', 'max', 'out_of_range', 'days')
+    
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.out_of_range = 0
+        self.days: Dict[int, List[float]] = {}  # day ordinal -> [sum, count]
+    
+    def extend(self, values: array, days: array) -> None:
+        """Add many readings; totals and extremes are single C-level passes"""
+        if not values:
+            return
+        self.count += len(values)
+        self.total += sum(values)
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        if low < self.low or high > self.high:
+            self.out_of_range += sum(1 for value in values if not self.low <= value <= self.high)
+        for value, day in zip(values, days):
+            bucket = self.days.get(day)
+            if bucket is None:
+                self.days[day] = [value, 1]
+            else:
+                bucket[0] += value
+                bucket[1] += 1
+    
+    def rolling_mean(self, today: int, window: int) -> Optional[float]:
+        """Mean of the readings from the last window days, today included"""
+        total, count = 0.0, 0
+        for day in range(today - window + 1, today + 1):
+            bucket = self.days.get(day)
+            if bucket is not None:
+                total += bucket[0]
+                count += bucket[1]
+        return round(total / count, 1) if count else None
+    
+    def to_dict(self, today: int) -> Dict[str, Any]:
+        summary = {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': round(self.total / self.count, 1) if self.count else None,
+            'out_of_range': self.out_of_range
+        }
+        for window in ROLLING_WINDOWS:
+            summary[f'mean_{window}d'] = self.rolling_mean(today, window)
+        return summary
+
+class UserSummary:
+    """Aggregates for every symptom type of one user"""
+    
+    def __init__(self):
+        self.series: Dict[str, Dict[str, SeriesStats]] = {}
+        for entry in SYMPTOM_TYPE_CATALOG:
+            ranges = entry['range']
+            if 'min' in ranges:
+                self.series[entry['name']] = {'value': SeriesStats(ranges['min'], ranges['max'])}
+            else:
+                self.series[entry['name']] = {
+                    part: SeriesStats(bounds['min'], bounds['max']) for part, bounds in ranges.items()
+                }
+        self.last: Dict[str, Dict[str, str]] = {}
+        self._last_at: Dict[str, Tuple[int, int]] = {}  # (day, seconds) of each last reading
+        self.invalid = 0
+    
+    def extend(self, records: HistoryColumns) -> None:
+        """
+        Fold many records, split into per-series columns first
+        
+        Readings are already parsed: a single number has NaN as its second
+        part, a "systolic/diastolic" pair has both, and a day of 0 or a NaN
+        first part means the row did not parse at all.
+        """
+        columns: Dict[int, Tuple[array, array]] = {}
+        last: Dict[str, int] = {}
+        days, seconds, types, first, second = records.days, records.seconds, records.types, records.first, records.second
+        for i in range(len(records)):
+            name = type_name(types[i])
+            series = self.series.get(name)
+            day = days[i]
+            if series is None or not day or math.isnan(first[i]) or math.isnan(second[i]) != (len(series) == 1):
+                self.invalid += 1
+                continue
+            values = (first[i],) if len(series) == 1 else (first[i], second[i])
+            for stats, value in zip(series.values(), values):
+                column = columns.get(id(stats))
+                if column is None:
+                    column = columns[id(stats)] = (array('d'), array('l'))
+                column[0].append(value)
+                column[1].append(day)
+            # Latest by date and time; backdated rows from offline sync arrive late
+            at = (day, seconds[i])
+            if at >= self._last_at.get(name, (0, 0)):
+                self._last_at[name] = at
+                last[name] = i
+        for name, i in last.items():
+            self.last[name] = records[i]
+        
+        for series in self.series.values():
+            for stats in series.values():
+                column = columns.get(id(stats))
+                if column is not None:
+                    stats.extend(*column)
+    
+    def to_dict(self, today: int) -> Dict[str, Any]:
+        """Every SummaryResponse key filled in, so the result needs no model pass"""
+        types = []
+        for entry in SYMPTOM_TYPE_CATALOG:
+            series = self.series[entry['name']]
+            summary: Dict[str, Any] = {'id': entry['id'], 'name': entry['name'], 'unit': entry['unit']}
+            if 'value' in series:
+                summary.update(series['value'].to_dict(today))
+                summary.update(systolic=None, diastolic=None)
+            else:
+                parts = {part: stats.to_dict(today) for part, stats in series.items()}
+                summary.update(dict.fromkeys(SERIES_KEYS))
+                summary['count'] = next(iter(parts.values()))['count']
+                summary.update(parts)
+            last = self.last.get(entry['name'])
+            summary['last'] = {'date': last['date'], 'time': last['time'], 'value': last['value']} if last else None
+            types.append(summary)
+        return {'types': types, 'invalid': self.invalid}
+
+class SummaryCache:
+    """
+    Bounded LRU of per-user aggregates over their append-only history
+    
+    Each entry remembers how many history rows it has folded in, so a
+    request only processes rows added since the last one. If the history
+    got shorter or its last folded row changed, it is rebuilt from scratch.
+    """
+    
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._entries: "OrderedDict[str, Tuple[UserSummary, int, Dict[str, str]]]" = OrderedDict()
+        self._stats = {'incremental': 0, 'rebuilds': 0, 'rows_folded': 0}
+    
+    def get(self, user_id: str, history: Union[HistoryColumns, Sequence[Dict[str, str]]]) -> UserSummary:
+        """Aggregates for a user's full history, oldest first"""
+        if not isinstance(history, HistoryColumns):
+            history = HistoryColumns.from_records(history)
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            summary, seen, last = entry
+            if seen <= len(history) and (seen == 0 or history[seen - 1] == last):
+                summary.extend(history[seen:])
+                self._stats['incremental'] += 1
+                self._stats['rows_folded'] += len(history) - seen
+                self._store(user_id, summary, history)
+                return summary
+        
+        summary = UserSummary()
+        summary.extend(history)
+        self._stats['rebuilds'] += 1
+        self._stats['rows_folded'] += len(history)
+        self._store(user_id, summary, history)
+        return summary
+    
+    def _store(self, user_id: str, summary: UserSummary, history: HistoryColumns) -> None:
+        self._entries[user_id] = (summary, len(history), history[-1] if history else {})
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {**self._stats, 'size': len(self._entries)}
+
+def _create_cache() -> SummaryCache:
+    settings = get_settings()
+    return SummaryCache(max_users=settings.HISTORY_CACHE_MAX_USERS)
+
+# Global summary cache instance
+summary_cache = _create_cache()
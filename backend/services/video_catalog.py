@@ -0,0 +1,242 @@
+"""
+Video catalog kept in sync with Drive through the changes feed
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from googleapiclient.errors import HttpError
+from ..config import get_settings
+from ..models import VideosResponse
+from .executor import google_executor
+from .google_drive import FOLDER_MIME_TYPE, GoogleDriveService, drive_service, file_to_video, is_listed_file
+from ..utils.http_cache import dump_json, make_etag
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Drive answers these when a page token is no longer usable
+EXPIRED_TOKEN_STATUSES = {400, 404, 410}
+
+def build_video_listing(videos: List[Dict[str, Any]], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Serialize a disease's videos once; an unchanged body keeps its Last-Modified"""
+    body = dump_json(VideosResponse(videos=videos).model_dump(mode="json"))
+    etag = make_etag(body)
+    if previous and previous['etag'] == etag:
+        last_modified = previous['last_modified']
+    else:
+        last_modified = int(time.time())
+    
+    return {
+        'body': body.decode("utf-8"),
+        'etag': etag,
+        'last_modified': last_modified,
+        'count': len(videos)
+    }
+
+class VideoCatalog:
+    """
+    In-memory index of every disease folder, updated from the Drive changes feed
+    
+    The folders are listed once; after that each poll is a single
+    changes.list call, which is empty most of the time. Changes are fetched
+    on the executor and applied on the event loop, so readers never see a
+    half-applied page and need no locks. A disease folder being renamed,
+    moved, trashed or recreated, or an expired page token, triggers a full
+    reload. Once loaded, the index keeps serving through Drive outages.
+    """
+    
+    def __init__(self, drive: GoogleDriveService, interval: float):
+        self.drive = drive
+        self.settings = drive.settings
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._page_token: Optional[str] = None
+        self._needs_reload = True
+        self._folder_diseases: Dict[str, str] = {}  # folder ID -> disease
+        self._files: Dict[str, Dict[str, Dict[str, Any]]] = {}  # disease -> file ID -> file
+        self._file_diseases: Dict[str, str] = {}  # file ID -> disease
+        self._listings: Dict[str, Dict[str, Any]] = {}
+        self._failures = 0
+        self._last_synced_at: Optional[float] = None
+        self._stats = {
+            'reloads': 0,
+            'polls': 0,
+            'changes_applied': 0,
+            'errors': 0
+        }
+    
+    @property
+    def ready(self) -> bool:
+        return self._last_synced_at is not None
+    
+    def get_listing(self, disease: str) -> Optional[Dict[str, Any]]:
+        """Serialized listing for a disease, or None until the first load completes"""
+        if not self.ready:
+            return None
+        return self._listings.get(disease)
+    
+    async def reload(self) -> None:
+        """Rebuild the whole index from folder listings"""
+        # Take the token first: anything changed while listing is replayed by the next poll
+        page_token = await google_executor.run('drive', self.drive.get_start_page_token)
+        folder_ids = await google_executor.run('drive', self.drive.warm_folder_ids, True)
+        
+        diseases = [
+            (disease, folder_ids[name])
+            for disease, name in self.settings.DISEASE_FOLDERS.items()
+            if name in folder_ids
+        ]
+        listings = await asyncio.gather(*(
+            google_executor.run('drive', self.drive.list_folder_files, folder_id)
+            for _, folder_id in diseases
+        ))
+        
+        self._folder_diseases = {folder_id: disease for disease, folder_id in diseases}
+        self._files = {disease: {} for disease in self.settings.DISEASE_FOLDERS}
+        self._file_diseases = {}
+        for (disease, _), files in zip(diseases, listings):
+            for file in files:
+                self._files[disease][file['id']] = file
+                self._file_diseases[file['id']] = disease
+        for disease in self.settings.DISEASE_FOLDERS:
+            self._rebuild(disease)
+        
+        self._page_token = page_token
+        self._needs_reload = False
+        self._stats['reloads'] += 1
+        logger.info(f"Video catalog loaded: {len(self._file_diseases)} files in {len(diseases)} folders")
+    
+    def _fetch_changes(self, page_token: str) -> Tuple[List[Dict[str, Any]], str]:
+        """Read the changes feed up to its head (blocking)"""
+        changes: List[Dict[str, Any]] = []
+        while True:
+            page = self.drive.list_changes(page_token)
+            changes.extend(page.get('changes', []))
+            if 'newStartPageToken' in page:
+                return changes, page['newStartPageToken']
+            page_token = page['nextPageToken']
+    
+    async def poll(self) -> None:
+        """Apply everything that changed since the last poll"""
+        changes, page_token = await google_executor.run('drive', self._fetch_changes, self._page_token)
+        for disease in self._apply(changes):
+            self._rebuild(disease)
+        self._page_token = page_token
+        self._stats['polls'] += 1
+        if changes:
+            logger.info(f"Video catalog applied {len(changes)} changes")
+    
+    def _affects_folders(self, change: Dict[str, Any]) -> bool:
+        """Whether a change can alter which folder a disease maps to"""
+        file = change.get('file') or {}
+        disease = self._folder_diseases.get(change.get('fileId'))
+        if disease is not None:
+            return (
+                change.get('removed')
+                or file.get('trashed')
+                or file.get('name') != self.settings.DISEASE_FOLDERS[disease]
+                or self.settings.MAIN_FOLDER_ID not in file.get('parents', [])
+            )
+        # A new or restored folder for a disease that currently has none
+        tracked = {self.settings.DISEASE_FOLDERS[d] for d in self._folder_diseases.values()}
+        return (
+            file.get('mimeType') == FOLDER_MIME_TYPE
+            and not file.get('trashed')
+            and file.get('name') in set(self.settings.DISEASE_FOLDERS.values()) - tracked
+            and self.settings.MAIN_FOLDER_ID in file.get('parents', [])
+        )
+    
+    def _apply(self, changes: List[Dict[str, Any]]) -> Set[str]:
+        """Apply changes to the index; returns the diseases whose listing changed"""
+        dirty: Set[str] = set()
+        for change in changes:
+            if self._affects_folders(change):
+                self._needs_reload = True
+                continue
+            
+            # Uploads, edits, moves and deletions: drop the old entry, then re-add if listed
+            file_id = change.get('fileId')
+            file = change.get('file') or {}
+            disease = self._file_diseases.pop(file_id, None)
+            if disease is not None:
+                del self._files[disease][file_id]
+                dirty.add(disease)
+            if change.get('removed') or not is_listed_file(file):
+                continue
+            for parent in file.get('parents', []):
+                disease = self._folder_diseases.get(parent)
+                if disease is not None:
+                    self._files[disease][file_id] = file
+                    self._file_diseases[file_id] = disease
+                    dirty.add(disease)
+                    break
+        
+        self._stats['changes_applied'] += len(changes)
+        return dirty
+    
+    def _rebuild(self, disease: str) -> None:
+        """Reserialize one disease's listing in Drive's name order"""
+        files = sorted(self._files.get(disease, {}).values(), key=lambda file: file['name'])
+        self._listings[disease] = build_video_listing(
+            [file_to_video(file) for file in files],
+            self._listings.get(disease)
+        )
+    
+    async def sync_once(self) -> None:
+        """One sync step: a poll, or a full reload when one is due"""
+        if not self._needs_reload:
+            try:
+                await self.poll()
+            except HttpError as e:
+                if e.resp.status not in EXPIRED_TOKEN_STATUSES:
+                    raise
+                logger.warning(f"Drive changes token rejected ({e.resp.status}), reloading catalog")
+                self._needs_reload = True
+        if self._needs_reload:
+            await self.reload()
+        self._last_synced_at = time.monotonic()
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as e:
+                self._stats['errors'] += 1
+                self._failures += 1
+                if self._failures == 1:
+                    logger.warning(f"Video catalog sync failed: {e}")
+            else:
+                if self._failures:
+                    logger.info("Video catalog sync recovered")
+                self._failures = 0
+            await asyncio.sleep(self.interval)
+    
+    def start(self) -> None:
+        """Start syncing in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop syncing"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'files': len(self._file_diseases),
+            'seconds_since_sync': round(time.monotonic() - self._last_synced_at, 1) if self.ready else None,
+            **self._stats
+        }
+
+def _create_catalog() -> VideoCatalog:
+    settings = get_settings()
+    return VideoCatalog(drive_service, interval=settings.VIDEO_CATALOG_POLL_INTERVAL)
+
+# Global catalog instance
+video_catalog = _create_catalog()
@@ -0,0 +1,441 @@
+"""
+Write-behind queue for symptom submissions
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from ..config import get_settings
+from .executor import google_executor
+from .google_sheets import sheets_service, current_iran_timestamp, row_to_record
+from .history_cache import history_cache
+from .resilience import is_ambiguous, is_transient
+from ..utils.logger import setup_logger
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = setup_logger(__name__)
+
+# Journal lock files held by this process. flock conflicts between two
+# descriptors even within one process, so queues on one journal share them.
+_held_locks: Dict[str, int] = {}
+_held_locks_lock = threading.Lock()
+
+def _lock_file(path: str, blocking: bool) -> Optional[int]:
+    """flock a lock file; returns its descriptor, or None if another process holds it"""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        # An adopting worker may have deleted the file while we waited; lock the new one
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+class SymptomWriteQueue:
+    """
+    Durable write-behind queue in front of Google Sheets
+    
+    Entries are journaled before being acknowledged and only removed from the
+    journal after a successful flush, so delivery is at-least-once. A write
+    whose outcome is unknown (a timeout or 5xx after the request was sent, or
+    a crash mid-flush) is never simply sent again: the sheet is read back
+    first and rows already there are acknowledged instead.
+    
+    A flush is one grouped write. If it fails with a non-transient error,
+    each sheet is retried on its own so one broken tab does not hold back
+    everyone else; entries whose sheet keeps failing are moved to a
+    dead-letter file after max_attempts flushes.
+    
+    Every worker process journals to its own file (journal_path plus the pid)
+    and holds a lock on it while running. On start, journals whose lock is
+    free belong to workers that have exited and are adopted.
+    """
+    
+    MAX_BACKOFF = 60  # seconds between flush attempts after unexpected errors
+    
+    def __init__(
+        self,
+        journal_path: str,
+        max_batch: int,
+        flush_interval: float,
+        writer: Optional[Callable[[Dict[str, List[List[str]]]], None]] = None,
+        max_attempts: int = 5,
+        dead_letter_path: Optional[str] = None,
+        reader: Optional[Callable[[str], List[List[str]]]] = None
+    ):
+        self.journal_path = journal_path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path or f"{journal_path}.dead"
+        self._writer = writer or sheets_service.append_rows_batch
+        self._reader = reader or sheets_service.get_rows
+        self._pending: List[Dict[str, Any]] = []
+        self._journal_lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            'submitted': 0, 'flushed': 0, 'flushes': 0, 'failed_flushes': 0,
+            'dead_lettered': 0, 'confirmed': 0, 'adopted': 0
+        }
+    
+    @property
+    def own_journal_path(self) -> str:
+        """This process's journal; the pid is read on use so forked workers get their own"""
+        return f"{self.journal_path}.{os.getpid()}"
+    
+    def _claim_journal(self) -> None:
+        """Lock this process's journal so no other worker adopts it while we run"""
+        if fcntl is None:
+            return
+        lock_path = f"{self.own_journal_path}.lock"
+        with _held_locks_lock:
+            if lock_path not in _held_locks:
+                directory = os.path.dirname(lock_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                _held_locks[lock_path] = _lock_file(lock_path, blocking=True)
+    
+    def _append_lines(self, path: str, records: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            if fcntl is not None:
+                # The dead-letter file is shared by every worker
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _append_journal(self, records: List[Dict[str, Any]]) -> None:
+        """Append records to the journal and sync them to disk"""
+        with self._journal_lock:
+            self._claim_journal()
+            self._append_lines(self.own_journal_path, records)
+    
+    def _dead_letter(self, records: List[Dict[str, Any]]) -> None:
+        """Move entries that keep failing out of the journal into the dead-letter file"""
+        with self._journal_lock:
+            self._append_lines(self.dead_letter_path, records)
+        self._acknowledge({record['id'] for record in records})
+    
+    def _read_entries(self, path: str) -> List[Dict[str, Any]]:
+        """Read all entries currently in a journal"""
+        if not os.path.exists(path):
+            return []
+        
+        entries = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn write from a crash; everything before it is intact
+                    logger.warning("Skipping corrupt journal line")
+        return entries
+    
+    def _read_journal(self) -> List[Dict[str, Any]]:
+        """Read unacknowledged entries from this process's journal"""
+        with self._journal_lock:
+            self._claim_journal()
+            return self._read_entries(self.own_journal_path)
+    
+    def _adopt_orphans(self) -> int:
+        """Move entries from the journals of exited workers into this process's journal"""
+        if fcntl is None:
+            return 0
+        directory = os.path.dirname(self.journal_path) or '.'
+        if not os.path.isdir(directory):
+            return 0
+        
+        # journal_path itself is the single journal older versions shared
+        pattern = re.compile(re.escape(os.path.basename(self.journal_path)) + r'(\.\d+)?')
+        own = os.path.basename(self.own_journal_path)
+        adopted = 0
+        for filename in sorted(os.listdir(directory)):
+            if filename == own or not pattern.fullmatch(filename):
+                continue
+            path = os.path.join(directory, filename)
+            fd = _lock_file(f"{path}.lock", blocking=False)
+            if fd is None:
+                continue  # its worker is still running
+            try:
+                entries = self._read_entries(path)
+                if entries:
+                    with self._journal_lock:
+                        self._append_lines(self.own_journal_path, entries)
+                for leftover in (path, f"{path}.lock"):
+                    try:
+                        os.remove(leftover)
+                    except FileNotFoundError:
+                        pass
+                adopted += len(entries)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return adopted
+    
+    def _acknowledge(self, entry_ids: Set[str]) -> None:
+        """Atomically drop flushed entries from the journal"""
+        with self._journal_lock:
+            journal = self.own_journal_path
+            remaining = [e for e in self._read_entries(journal) if e['id'] not in entry_ids]
+            tmp_path = f"{journal}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in remaining:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, journal)
+    
+    async def submit(self, user_id: str, symptom_type: str, value: str) -> Dict[str, Any]:
+        """Journal a symptom and acknowledge it without waiting for Sheets"""
+        current_date, current_time = current_iran_timestamp()
+        await self.submit_rows([(user_id, [current_date, current_time, symptom_type, value])])
+        
+        logger.info("Queued symptom for %s: %s = %s", user_id, symptom_type, value)
+        return {
+            "success": True,
+            "message": "Symptom saved successfully",
+            "timestamp": f"{current_date} {current_time}"
+        }
+    
+    async def submit_rows(self, user_rows: List[Tuple[str, List[str]]]) -> None:
+        """Journal several (user_id, row) pairs with a single disk write"""
+        entries = [
+            {
+                'id': uuid.uuid4().hex,
+                'user_id': user_id,
+                'sheet': f"User_{user_id}",
+                'row': row
+            }
+            for user_id, row in user_rows
+        ]
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._append_journal, entries)
+        for entry in entries:
+            self._pending.append(entry)
+            history_cache.add_pending(entry['user_id'], entry['id'], row_to_record(entry['row']))
+        self._stats['submitted'] += len(entries)
+        
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+    
+    async def _confirm(self, entries_by_sheet: Dict[str, List[Dict[str, Any]]]) -> Set[str]:
+        """
+        Look up unconfirmed entries in their sheets; returns the ids already written
+        
+        Found entries are removed from entries_by_sheet, and so is every
+        sheet that could not be read, so nothing of unknown outcome is sent.
+        """
+        found: Set[str] = set()
+        for sheet, entries in list(entries_by_sheet.items()):
+            unconfirmed = [e for e in entries if e.get('unconfirmed')]
+            if not unconfirmed:
+                continue
+            try:
+                rows = await google_executor.run('sheets', self._reader, sheet)
+            except Exception as e:
+                logger.error(f"Could not check {sheet} for {len(unconfirmed)} unconfirmed symptoms: {e}")
+                del entries_by_sheet[sheet]
+                continue
+            
+            present = Counter(tuple(row[:4]) for row in rows)
+            for entry in unconfirmed:
+                row = tuple(entry['row'])
+                if present[row]:
+                    present[row] -= 1
+                    found.add(entry['id'])
+                del entry['unconfirmed']
+            remaining = [e for e in entries if e['id'] not in found]
+            if remaining:
+                entries_by_sheet[sheet] = remaining
+            else:
+                del entries_by_sheet[sheet]
+        return found
+    
+    async def _write_sheets(self, entries_by_sheet: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Exception]:
+        """
+        Write entries grouped per sheet; returns the sheets that failed
+        
+        Everything goes out as one write first. Only a non-transient error
+        (a bad tab rather than an unhealthy upstream) is worth splitting the
+        batch for, to find which sheets are at fault. Each write is waited
+        for to the end, even past the executor timeout, so its outcome is
+        known before anything is sent again.
+        """
+        rows_by_sheet = {sheet: [e['row'] for e in entries] for sheet, entries in entries_by_sheet.items()}
+        try:
+            await google_executor.run('sheets', self._writer, rows_by_sheet, wait_for_worker=True)
+            return {}
+        except Exception as e:
+            if len(rows_by_sheet) == 1 or is_transient(e):
+                return {sheet: e for sheet in rows_by_sheet}
+        
+        failed: Dict[str, Exception] = {}
+        for sheet, rows in rows_by_sheet.items():
+            try:
+                await google_executor.run('sheets', self._writer, {sheet: rows}, wait_for_worker=True)
+            except Exception as e:
+                failed[sheet] = e
+        return failed
+    
+    async def flush(self) -> int:
+        """Write all pending entries to Sheets, grouped into as few writes as possible"""
+        async with self._flush_lock:
+            batch = list(self._pending)
+            if not batch:
+                return 0
+            
+            entries_by_sheet: Dict[str, List[Dict[str, Any]]] = {}
+            for entry in batch:
+                entries_by_sheet.setdefault(entry['sheet'], []).append(entry)
+            user_ids = {entry['user_id'] for entry in batch}
+            
+            history_cache.begin_flush(user_ids)
+            try:
+                confirmed = await self._confirm(entries_by_sheet)
+                failed = await self._write_sheets(entries_by_sheet) if entries_by_sheet else {}
+            except BaseException:
+                history_cache.end_flush(user_ids, set())
+                raise
+            
+            written = [e for sheet, entries in entries_by_sheet.items() if sheet not in failed for e in entries]
+            flushed = [e for e in batch if e['id'] in confirmed] + written
+            dead: List[Dict[str, Any]] = []
+            for sheet, error in failed.items():
+                logger.error(f"Failed to flush {len(entries_by_sheet[sheet])} queued symptoms for {sheet}: {error}")
+                if is_ambiguous(error):
+                    # May have been applied anyway; check the sheet before sending these again
+                    for entry in entries_by_sheet[sheet]:
+                        entry['unconfirmed'] = True
+                    continue
+                if is_transient(error):
+                    continue
+                for entry in entries_by_sheet[sheet]:
+                    entry['attempts'] = entry.get('attempts', 0) + 1
+                    if entry['attempts'] >= self.max_attempts:
+                        dead.append(entry)
+            
+            done_ids = {e['id'] for e in flushed} | {e['id'] for e in dead}
+            history_cache.end_flush(user_ids, done_ids)
+            self._pending = [e for e in self._pending if e['id'] not in done_ids]
+            
+            loop = asyncio.get_running_loop()
+            if flushed:
+                await loop.run_in_executor(None, self._acknowledge, {e['id'] for e in flushed})
+            if dead:
+                await loop.run_in_executor(None, self._dead_letter, dead)
+                for user_id in {e['user_id'] for e in dead}:
+                    # The cached history still shows rows that will never reach the sheet
+                    history_cache.invalidate(user_id)
+                self._stats['dead_lettered'] += len(dead)
+                logger.error(f"Moved {len(dead)} symptoms to {self.dead_letter_path} after {self.max_attempts} failed flushes")
+            
+            if failed:
+                self._stats['failed_flushes'] += 1
+            if confirmed:
+                self._stats['confirmed'] += len(confirmed)
+                logger.info(f"Found {len(confirmed)} unconfirmed symptoms already in their sheets")
+            if flushed:
+                self._stats['flushes'] += 1
+                self._stats['flushed'] += len(flushed)
+                logger.info(f"Flushed {len(written)} queued symptoms to {len(entries_by_sheet) - len(failed)} sheets")
+            return len(flushed)
+    
+    async def _flush_loop(self) -> None:
+        """Flush on every time window or when the batch is full"""
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                failures = 0
+            except Exception as e:
+                # A full disk or a bad journal must not stop the flusher for good
+                failures += 1
+                self._stats['failed_flushes'] += 1
+                delay = min(self.flush_interval * 2 ** failures, self.MAX_BACKOFF)
+                logger.error(f"Write queue flush failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+    
+    async def start(self) -> None:
+        """Adopt journals of exited workers, replay this one's and start the background flusher"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._claim_journal)
+        adopted = await loop.run_in_executor(None, self._adopt_orphans)
+        if adopted:
+            self._stats['adopted'] += adopted
+            logger.info(f"Adopted {adopted} symptoms from journals of exited workers")
+        
+        replayed = await loop.run_in_executor(None, self._read_journal)
+        if replayed:
+            known = {entry['id'] for entry in self._pending}
+            unique = {e['id']: e for e in replayed if e['id'] not in known}
+            replayed = list(unique.values())
+            for entry in replayed:
+                # The previous run may have stopped mid-write, so look before resending
+                entry['unconfirmed'] = True
+                history_cache.add_pending(entry['user_id'], entry['id'], row_to_record(entry['row']))
+            self._pending = replayed + self._pending
+            logger.info(f"Replayed {len(replayed)} symptoms from journal")
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+    
+    async def stop(self) -> None:
+        """Stop the background flusher and flush what is left"""
+        if self._task is not None:
+            # Cancel only between flushes; a write cut off midway has an unknown outcome
+            async with self._flush_lock:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+        await self.flush()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue statistics"""
+        return {**self._stats, 'pending': len(self._pending)}
+
+def _create_queue() -> SymptomWriteQueue:
+    settings = get_settings()
+    return SymptomWriteQueue(
+        journal_path=settings.SYMPTOM_JOURNAL_PATH,
+        max_batch=settings.SYMPTOM_FLUSH_MAX_BATCH,
+        flush_interval=settings.SYMPTOM_FLUSH_INTERVAL,
+        max_attempts=settings.SYMPTOM_FLUSH_MAX_ATTEMPTS,
+        dead_letter_path=settings.SYMPTOM_DEAD_LETTER_PATH
+    )
+
+# Global queue instance
+symptom_queue = _create_queue()
@@ -0,0 +1,38 @@
+"""
+JSON encoding for response bodies - orjson when installed, stdlib otherwise
+"""
+import json
+from typing import Any, Callable, Optional
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional; pip install orjson for faster encoding
+    orjson = None
+
+def stdlib_dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, Persian text left unescaped"""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _orjson_dumps(content: Any) -> bytes:
+    # orjson already writes compact, unescaped UTF-8; like json it stringifies non-str keys
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+orjson_dumps: Optional[Callable[[Any], bytes]] = _orjson_dumps if orjson is not None else None
+
+dumps: Callable[[Any], bytes] = orjson_dumps or stdlib_dumps
+
+JSON_ENCODER = "orjson" if orjson is not None else "stdlib"
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with the fastest available encoder
+    
+    Used as the app's default response class. Handlers whose payload is
+    built from already validated data can also return one directly; FastAPI
+    then skips response_model validation and jsonable_encoder, while the
+    model still documents the schema.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
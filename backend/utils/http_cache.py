@@ -0,0 +1,78 @@
+"""
+HTTP caching helpers - ETags and conditional responses
+"""
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional
+from fastapi import Request, Response
+from .fast_json import dumps
+
+def dump_json(content: Any) -> bytes:
+    """Serialize the way our API bodies are serialized everywhere else"""
+    return dumps(content)
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag from the exact bytes of a body"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as If-None-Match requires (RFC 9110 13.1.2)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def http_date(timestamp: float) -> str:
+    """Format a Unix time as an HTTP date"""
+    return formatdate(timestamp, usegmt=True)
+
+def not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """
+    Evaluate conditional GET headers
+    
+    If-None-Match wins when present; If-Modified-Since is only consulted
+    without it, as RFC 9110 requires.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def json_response(request: Request, body: bytes, headers: Dict[str, str], etag: str, last_modified: Optional[float] = None) -> Response:
+    """Prebuilt JSON body, or an empty 304 when the client's copy is current"""
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+class PrecomputedJSON:
+    """
+    A constant JSON body serialized once, with a strong ETag
+    
+    Handlers return respond(request): a header comparison and a prebuilt
+    body, with no per-request dict building or model validation.
+    """
+    
+    def __init__(self, content: Any, max_age: int):
+        self.body = dump_json(content)
+        self.etag = make_etag(self.body)
+        self.headers: Dict[str, str] = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={max_age}"
+        }
+    
+    def respond(self, request: Request) -> Response:
+        return json_response(request, self.body, self.headers, self.etag)
@@ -1,10 +1,150 @@
 """
 Logging configuration
+
+Every module logger hands records to one shared QueueHandler. A single
+QueueListener thread formats and writes them, so a log call on the event
+loop costs a level check and a queue put: no string formatting and no
+blocking stdout write.
 """
+import atexit
+import json
 import logging
+import queue
 import sys
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
 from ..config import get_settings
 
+# Set per request by RequestIDMiddleware; copied into executor threads
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        sample_rate = getattr(record, 'sample_rate', 1.0)
+        if sample_rate < 1.0:
+            entry['sample_rate'] = sample_rate
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fixed share of INFO and DEBUG records per logger
+    
+    Sampling is deterministic (every 1/rate-th record), so a steady stream
+    stays steady in the output. Warnings and errors always pass.
+    """
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._seen: Dict[str, int] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.name)
+        if rate is None or rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        seen = self._seen.get(record.name, 0) + 1
+        self._seen[record.name] = seen
+        record.sample_rate = rate
+        return int(seen * rate) != int((seen - 1) * rate)
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """Parse "logger=rate,logger=rate" into a rate map"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Enqueues records without formatting them in the caller
+    
+    The stock QueueHandler formats the message before enqueueing so records
+    can cross process boundaries; ours stay in-process, so formatting is
+    left to the listener thread. Only the request ID is captured here,
+    since it lives in the caller's context. A full queue drops the record
+    rather than blocking the event loop.
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+_lock = threading.Lock()
+
+def _create_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        return JSONFormatter()
+    if log_format == "text":
+        return logging.Formatter(TEXT_FORMAT, datefmt=TEXT_DATEFMT)
+    raise ValueError(f"Unknown LOG_FORMAT: {log_format}")
+
+def _get_handler() -> NonBlockingQueueHandler:
+    """Create the shared queue handler and start its listener on first use"""
+    global _handler, _listener
+    with _lock:
+        if _handler is None:
+            settings = get_settings()
+            log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+            
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(_create_formatter(settings.LOG_FORMAT))
+            
+            handler = NonBlockingQueueHandler(log_queue)
+            handler.setLevel(getattr(logging, settings.LOG_LEVEL))
+            handler.addFilter(SamplingFilter(parse_sampling(settings.LOG_SAMPLING)))
+            
+            _listener = QueueListener(log_queue, stream)
+            _listener.start()
+            atexit.register(stop_logging)
+            _handler = handler
+    return _handler
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def get_logging_stats() -> Dict[str, int]:
+    """Queue depth and records dropped on a full queue"""
+    if _handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped}
+
 def setup_logger(name: str = __name__) -> logging.Logger:
     """Setup and return a logger instance"""
     settings = get_settings()
@@ -17,18 +157,7 @@ def setup_logger(name: str = __name__) -> logging.Logger:
     if logger.handlers:
         return logger
     
-    # Create console handler
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(getattr(logging, settings.LOG_LEVEL))
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    handler.setFormatter(formatter)
-    
-    # Add handler to logger
-    logger.addHandler(handler)
+    # Hand records to the shared background writer
+    logger.addHandler(_get_handler())
     
     return logger
@@ -0,0 +1,96 @@
+"""
+Memory and encoding cost of columnar symptom history
+
+Builds one user's history as the sheet returns it and compares three ways
+of holding and serving it: one dict per row validated through
+HistoryResponse, one dict per row encoded with json.dumps (how the history
+endpoint streamed before) and HistoryColumns encoded with to_json. Memory
+is what tracemalloc sees allocated while building the parsed history.
+
+Run from the repository root:
+    python -m benchmarks.history_columns
+"""
+import json
+import time
+import tracemalloc
+from backend.models import HistoryResponse, SYMPTOM_TYPES
+from backend.services.history_columns import HistoryColumns
+from backend.services.history_query import select_history
+
+ROWS = 20000
+ROUNDS = 5
+
+def sheet_rows(count: int):
+    """Rows shaped like values.get output: two years of readings, several a day"""
+    rows = []
+    for i in range(count):
+        day = i // 8
+        symptom_type = SYMPTOM_TYPES[i % len(SYMPTOM_TYPES)]
+        value = f"{110 + i % 40}/{70 + i % 20}" if symptom_type == 'فشار خون' else str(80 + i % 120)
+        rows.append([
+            f"{1401 + day // 336}-{day // 28 % 12 + 1:02d}-{day % 28 + 1:02d}",
+            f"{6 + i % 8 * 2:02d}:{i % 60:02d}:00",
+            symptom_type,
+            value
+        ])
+    return rows
+
+def build_dicts(rows):
+    return [{'date': r[0], 'time': r[1], 'type': r[2], 'value': r[3]} for r in rows]
+
+def encode_validated(records):
+    response = HistoryResponse(data=records, next_cursor=None)
+    return response.model_dump_json().encode("utf-8")
+
+def encode_dumps(records):
+    body = ",".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in records)
+    return ('{"data":[' + body + '],"next_cursor":null}').encode("utf-8")
+
+def encode_columns(columns):
+    return ('{"data":[' + columns.to_json() + '],"next_cursor":null}').encode("utf-8")
+
+def measure_memory(build, rows) -> float:
+    """KiB allocated and still held after building the history"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = build(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del history
+    return (after - before) / 1024
+
+def measure_time(function, *args) -> float:
+    """Best of ROUNDS, in milliseconds"""
+    best = None
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+def main():
+    rows = sheet_rows(ROWS)
+    records = build_dicts(rows)
+    columns = HistoryColumns.from_rows(rows)
+    assert encode_dumps(records) == encode_columns(columns)
+    
+    print(f"{ROWS} rows, {len(columns._exact)} kept as exact strings")
+    print(f"{'container':24} {'KiB':>8} {'build ms':>9}")
+    print(f"{'dict per row':24} {measure_memory(build_dicts, rows):8.0f} {measure_time(build_dicts, rows):9.1f}")
+    print(f"{'HistoryColumns':24} {measure_memory(HistoryColumns.from_rows, rows):8.0f} "
+          f"{measure_time(HistoryColumns.from_rows, rows):9.1f}")
+    
+    print()
+    print(f"{'encode full history':32} {'ms':>8}")
+    print(f"{'dicts + HistoryResponse':32} {measure_time(encode_validated, records):8.1f}")
+    print(f"{'dicts + json.dumps per row':32} {measure_time(encode_dumps, records):8.1f}")
+    print(f"{'HistoryColumns.to_json':32} {measure_time(encode_columns, columns):8.1f}")
+    
+    print()
+    print(f"{'filter one type, 50 rows':32} {'ms':>8}")
+    print(f"{'dict list, converted per call':32} {measure_time(select_history, records, None, 'وزن', None, None, 50):8.2f}")
+    print(f"{'HistoryColumns':32} {measure_time(select_history, columns, None, 'وزن', None, None, 50):8.2f}")
+
+if __name__ == "__main__":
+    main()
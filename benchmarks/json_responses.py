@@ -0,0 +1,84 @@
+"""
+Serialization cost of response bodies, per endpoint
+
+For a representative payload of each JSON endpoint, times the path FastAPI
+takes for a returned dict (response_model validation, serialization and
+jsonable_encoder, then render) with the stock JSONResponse and with
+FastJSONResponse, and the trusted path where a handler returns
+FastJSONResponse directly and only the encoder runs. Encoders are timed
+alone too; the orjson column is empty when orjson is not installed.
+
+Run from the repository root:
+    python -m benchmarks.json_responses
+"""
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from backend.models import (
+    ContactInfo, HistoryResponse, SummaryResponse, SymptomBatchResponse, SymptomResponse, VideosResponse
+)
+from backend.services.history_columns import HistoryColumns
+from backend.services.symptom_summary import UserSummary
+from backend.utils.fast_json import JSON_ENCODER, FastJSONResponse, orjson_dumps, stdlib_dumps
+
+ROUNDS = 2000
+
+def payloads():
+    videos = {
+        "videos": [
+            {
+                "id": f"file{i:04d}", "name": f"آموزش تزریق انسولین - قسمت {i}.mp4", "type": "video",
+                "url": f"https://drive.google.com/file/d/file{i:04d}/preview", "size": 1048576
+            }
+            for i in range(30)
+        ]
+    }
+    history = [
+        {'date': f'1403-01-{i % 28 + 1:02d}', 'time': '08:00:00', 'type': 'قند ناشتا', 'value': str(90 + i % 60)}
+        for i in range(200)
+    ]
+    summary = UserSummary()
+    summary.extend(HistoryColumns.from_records(history))
+    batch = {
+        "saved": 50, "duplicates": 0, "failed": 0,
+        "results": [
+            {"index": i, "idempotency_key": f"reading-{i:04d}", "success": True,
+             "duplicate": False, "timestamp": "1403-01-01 08:00:00", "error": None}
+            for i in range(50)
+        ]
+    }
+    return [
+        ("/api/videos/{disease}", VideosResponse, videos),
+        ("/api/symptoms/history", HistoryResponse, {"data": history, "next_cursor": 200}),
+        ("/api/symptoms", SymptomResponse, {"success": True, "message": "Symptom saved successfully", "timestamp": "1403-01-01 08:00:00"}),
+        ("/api/symptoms/batch", SymptomBatchResponse, batch),
+        ("/api/symptoms/summary", SummaryResponse, {"as_of": "1403-01-28", **summary.to_dict(0)}),
+        ("/api/contact", ContactInfo, {"eitaa": "@support", "phone": "۰۲۱-۱۲۳۴۵۶۷۸", "email": "support@example.com", "address": "تهران، خیابان ولیعصر"}),
+    ]
+
+def per_call(function, *args) -> float:
+    """Microseconds per call"""
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        function(*args)
+    return (time.perf_counter() - started) / ROUNDS * 1e6
+
+def model_path(adapter, response_class, content):
+    validated = adapter.validate_python(content)
+    return response_class(jsonable_encoder(adapter.dump_python(validated, mode="json")))
+
+def main():
+    print(f"encoder in use: {JSON_ENCODER}; microseconds per response")
+    print(f"{'endpoint':24} {'model+JSON':>11} {'model+fast':>11} {'trusted':>9} {'stdlib':>8} {'orjson':>8}")
+    for path, model, content in payloads():
+        adapter = TypeAdapter(model)
+        stock = per_call(model_path, adapter, JSONResponse, content)
+        fast = per_call(model_path, adapter, FastJSONResponse, content)
+        trusted = per_call(FastJSONResponse, content)
+        stdlib = per_call(stdlib_dumps, content)
+        orjson = f"{per_call(orjson_dumps, content):8.1f}" if orjson_dumps is not None else f"{'-':>8}"
+        print(f"{path:24} {stock:11.1f} {fast:11.1f} {trusted:9.1f} {stdlib:8.1f} {orjson}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Per-request overhead of the rate limiter
+
+Drives the ASGI app directly (no sockets) so the numbers isolate the
+middleware. Compares no limiter, the same limiter wrapped in
+BaseHTTPMiddleware (how it used to be mounted), and the plain ASGI
+RateLimitMiddleware with memory and SQLite stores.
+
+Run from the repository root:
+    python -m benchmarks.rate_limit_overhead
+"""
+import asyncio
+import math
+import os
+import tempfile
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from backend.middleware.rate_limit import RateLimitMiddleware
+from backend.middleware.rate_limit_stores import MemoryRateLimitStore, SQLiteRateLimitStore
+
+REQUESTS = 5000
+LIMIT = 10 ** 9  # never reject; measure the pass-through path
+
+class BaseHTTPRateLimit(BaseHTTPMiddleware):
+    """The pre-ASGI shape: same store, dispatched through BaseHTTPMiddleware"""
+    
+    def __init__(self, app, store):
+        super().__init__(app)
+        self.store = store
+    
+    async def dispatch(self, request: Request, call_next):
+        client_ip = request.client.host if request.client else "unknown"
+        allowed, remaining, wait = self.store.hit("default", client_ip, LIMIT)
+        if not allowed:
+            return JSONResponse(status_code=429, content={"detail": "Too many requests"})
+        response = await call_next(request)
+        response.headers["RateLimit-Remaining"] = str(remaining)
+        response.headers["RateLimit-Reset"] = str(math.ceil(wait))
+        return response
+
+def build_app(middleware=None, **options) -> FastAPI:
+    app = FastAPI()
+    
+    @app.get("/api/diseases")
+    async def diseases():
+        return {"diseases": ["دیابت", "فشار خون"]}
+    
+    if middleware is not None:
+        app.add_middleware(middleware, **options)
+    return app
+
+async def drive(app, requests: int) -> float:
+    """Send requests straight through the ASGI interface; returns microseconds per request"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/api/diseases", "raw_path": b"/api/diseases",
+        "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")],
+        "client": ("10.0.0.1", 5000), "server": ("bench", 80),
+    }
+    
+    def make_receive():
+        messages = iter([{"type": "http.request", "body": b"", "more_body": False}])
+        
+        async def receive():
+            return next(messages, {"type": "http.disconnect"})
+        return receive
+    
+    async def send(message):
+        pass
+    
+    # Warm up routing, middleware stack build and the store
+    for _ in range(200):
+        await app(dict(scope), make_receive(), send)
+    
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), make_receive(), send)
+    return (time.perf_counter() - started) / requests * 1e6
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_path = os.path.join(directory, "rate_limit.db")
+        variants = [
+            ("no limiter", build_app()),
+            ("BaseHTTPMiddleware + memory", build_app(BaseHTTPRateLimit, store=MemoryRateLimitStore())),
+            ("ASGI + memory", build_app(
+                RateLimitMiddleware, rules=[], default_per_minute=LIMIT, store=MemoryRateLimitStore()
+            )),
+            ("ASGI + sqlite", build_app(
+                RateLimitMiddleware, rules=[], default_per_minute=LIMIT,
+                store=SQLiteRateLimitStore(sqlite_path)
+            )),
+        ]
+        
+        baseline = None
+        print(f"{'variant':32} {'us/req':>8} {'overhead':>9}")
+        for name, app in variants:
+            per_request = await drive(app, REQUESTS)
+            baseline = per_request if baseline is None else baseline
+            print(f"{name:32} {per_request:8.1f} {per_request - baseline:+9.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,21 @@
 """
 Backend tests
 """
+import json
 import pytest
 from fastapi.testclient import TestClient
 from backend.main import app
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def isolated_symptom_queue(tmp_path, monkeypatch):
+    """Keep saves made through the app out of the real journal, which is replayed into Sheets on startup"""
+    from backend.services.write_queue import symptom_queue
+    
+    monkeypatch.setattr(symptom_queue, "journal_path", str(tmp_path / "symptom_journal.jsonl"))
+    monkeypatch.setattr(symptom_queue, "_pending", [])
+
 def test_root():
     """Test root endpoint"""
     response = client.get("/")
@@ -22,6 +31,59 @@ def test_health_check():
     data = response.json()
     assert "status" in data
     assert "services" in data
+    assert {"hits", "misses", "evictions"} <= set(data["history_cache"])
+    assert {"incremental", "rebuilds", "size"} <= set(data["summary_cache"])
+
+@pytest.mark.parametrize("path", ["/api/diseases", "/api/symptoms/types", "/api/contact", "/api/support"])
+def test_catalog_conditional_get(path):
+    """Test catalogs carry a strong ETag and revalidate with 304"""
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert not etag.startswith("W/")
+    assert "max-age" in response.headers["cache-control"]
+    
+    revalidated = client.get(path, headers={"If-None-Match": f'"stale", {etag}'})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+def test_videos_conditional_get(monkeypatch):
+    """Test the videos listing is served with validators and revalidates with 304"""
+    from backend.routers import education
+    from backend.services.cache import CacheService
+    from backend.services.cache_backends import MemoryCacheBackend
+    
+    fetches = []
+    
+    async def fake_videos(disease):
+        fetches.append(disease)
+        return [{"id": "v1", "name": "آموزش.mp4", "type": "video", "url": "https://drive.google.com/file/d/v1/preview", "size": 10}]
+    
+    monkeypatch.setattr(education, "cache_service", CacheService(MemoryCacheBackend(10)))
+    monkeypatch.setattr(education.drive_service, "get_videos_for_disease", fake_videos)
+    
+    response = client.get("/api/videos/diabetes")
+    assert response.status_code == 200
+    assert response.json()["videos"][0]["name"] == "آموزش.mp4"
+    assert "no-cache" in response.headers["cache-control"]
+    assert "max-age" not in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    
+    assert client.get("/api/videos/diabetes", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/videos/diabetes", headers={"If-Modified-Since": last_modified}).status_code == 304
+    # If-None-Match takes precedence over If-Modified-Since
+    stale = client.get("/api/videos/diabetes", headers={"If-None-Match": '"old"', "If-Modified-Since": last_modified})
+    assert stale.status_code == 200
+    assert fetches == ["diabetes"]
+
+def test_liveness_and_readiness():
+    """Test liveness never depends on upstreams and readiness waits for probes"""
+    assert client.get("/api/health/live").json() == {"status": "alive"}
+    response = client.get("/api/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "not_ready"
 
 def test_get_diseases():
     """Test diseases list endpoint"""
@@ -79,9 +141,285 @@ def test_save_symptom_invalid_value():
     })
     assert response.status_code == 422
 
+def test_metrics_endpoint():
+    """Test route latency is labelled by route template"""
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="200"}' in response.text
+    assert "# TYPE google_api_request_duration_seconds histogram" in response.text
+    assert "# TYPE cache_hit_ratio gauge" in response.text
+
+def test_request_id_header():
+    """Test a sane incoming request ID is echoed and anything else is replaced"""
+    response = client.get("/", headers={"X-Request-ID": "abc-123"})
+    assert response.headers["x-request-id"] == "abc-123"
+    
+    response = client.get("/", headers={"X-Request-ID": "bad id\nwith newline"})
+    assert response.headers["x-request-id"] != "bad id\nwith newline"
+    assert len(response.headers["x-request-id"]) == 32
+
 @pytest.mark.asyncio
 async def test_rate_limiting():
     """Test rate limiting"""
-    # این تست باید تعداد زیادی request بفرستد
-    # برای اینکه rate limit trigger شود
-    pass
+    from fastapi import FastAPI
+    from backend.middleware.rate_limit import RateLimitMiddleware, RateLimitRule
+    
+    limited = FastAPI()
+    limited.add_middleware(
+        RateLimitMiddleware,
+        rules=[RateLimitRule("writes", ("/api/symptoms",), ("POST",), 2)],
+        default_per_minute=3
+    )
+    
+    @limited.get("/api/ping")
+    async def ping():
+        return {"ok": True}
+    
+    @limited.post("/api/symptoms")
+    async def write():
+        return {"ok": True}
+    
+    @limited.post("/api/symptoms/history")
+    async def history():
+        return {"ok": True}
+    
+    limited_client = TestClient(limited)
+    
+    # Writes have their own, tighter bucket
+    assert limited_client.post("/api/symptoms").headers["RateLimit-Remaining"] == "1"
+    assert limited_client.post("/api/symptoms").status_code == 200
+    response = limited_client.post("/api/symptoms")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["RateLimit-Limit"] == "2"
+    
+    # Reads are unaffected by exhausted writes, POST reads included
+    assert limited_client.post("/api/symptoms/history").status_code == 200
+    for _ in range(2):
+        assert limited_client.get("/api/ping").status_code == 200
+    assert limited_client.get("/api/ping").status_code == 429
+
+def test_gcra_limiter_refills_and_sweeps():
+    """Test token refill and idle-key sweep"""
+    from backend.middleware.rate_limit_stores import GCRALimiter
+    
+    limiter = GCRALimiter(per_minute=60, burst=2)
+    assert limiter.hit("a", now=0)[0]
+    assert limiter.hit("a", now=0)[0]
+    allowed, _, retry_after = limiter.hit("a", now=0)
+    assert not allowed and retry_after == pytest.approx(1.0)
+    assert limiter.hit("a", now=1.0)[0]
+    
+    assert limiter.sweep(now=100) == 1
+    assert len(limiter) == 0
+
+def test_sqlite_rate_limit_store_shared_between_workers(tmp_path):
+    """Test two workers draw from the same bucket"""
+    from backend.middleware.rate_limit_stores import SQLiteRateLimitStore
+    
+    path = str(tmp_path / "rate_limit.db")
+    worker_a = SQLiteRateLimitStore(path)
+    worker_b = SQLiteRateLimitStore(path)
+    
+    assert worker_a.hit("writes", "1.2.3.4", 2)[0]
+    assert worker_b.hit("writes", "1.2.3.4", 2)[0]
+    assert not worker_a.hit("writes", "1.2.3.4", 2)[0]
+    assert worker_b.hit("default", "1.2.3.4", 2)[0]
+    assert worker_a.size() == 2
+
+def test_sqlite_rate_limit_store_runs_off_event_loop(tmp_path):
+    """Test the shared store is hit on a worker thread, not the event loop"""
+    import threading
+    from fastapi import FastAPI
+    from backend.middleware.rate_limit import RateLimitMiddleware
+    from backend.middleware.rate_limit_stores import SQLiteRateLimitStore
+    
+    store = SQLiteRateLimitStore(str(tmp_path / "rate_limit.db"))
+    hit_threads = []
+    original_hit = store.hit
+    
+    def recording_hit(*args):
+        hit_threads.append(threading.get_ident())
+        return original_hit(*args)
+    
+    store.hit = recording_hit
+    limited = FastAPI()
+    limited.add_middleware(RateLimitMiddleware, rules=[], default_per_minute=10, store=store)
+    
+    @limited.get("/api/ping")
+    async def ping():
+        return {"loop_thread": threading.get_ident()}
+    
+    response = TestClient(limited).get("/api/ping")
+    assert response.headers["RateLimit-Remaining"] == "9"
+    assert hit_threads and response.json()["loop_thread"] not in hit_threads
+
+def test_rate_limit_fails_open_when_store_breaks(tmp_path):
+    """Test a locked shared store lets requests through instead of answering 500"""
+    import sqlite3
+    from fastapi import FastAPI
+    from backend.middleware.rate_limit import RateLimitMiddleware
+    from backend.middleware.rate_limit_stores import SQLiteRateLimitStore
+    from backend.services.executor import google_executor
+    
+    store = SQLiteRateLimitStore(str(tmp_path / "rate_limit.db"))
+    
+    def locked_hit(*args):
+        raise sqlite3.OperationalError("database is locked")
+    
+    store.hit = locked_hit
+    limited = FastAPI()
+    limited.add_middleware(RateLimitMiddleware, rules=[], default_per_minute=10, store=store)
+    
+    @limited.get("/api/ping")
+    async def ping():
+        return {"ok": True}
+    
+    response = TestClient(limited).get("/api/ping")
+    assert response.status_code == 200 and "RateLimit-Remaining" not in response.headers
+    assert google_executor.get_stats()['backends']['rate_limit']['errors'] >= 1
+
+@pytest.mark.asyncio
+async def test_save_symptom_batch(tmp_path, monkeypatch):
+    """Test batch save reports per-item results and dedupes retries"""
+    from backend.models import SymptomBatch, SymptomBatchResponse
+    from backend.routers import symptoms
+    from backend.services.storage import SQLiteStorage
+    
+    monkeypatch.setattr(symptoms, "symptom_storage", SQLiteStorage(str(tmp_path / "symptoms.db")))
+    items = [
+        {"user_id": "user_test123", "symptom_type": "وزن", "value": "70",
+         "idempotency_key": "reading-0001", "client_timestamp": "2024-03-20T08:00:00+03:30"},
+        {"user_id": "user_test123", "symptom_type": "وزن", "value": "70",
+         "idempotency_key": "reading-0001"},
+        {"user_id": "user_test123", "symptom_type": "وزن", "value": "999",
+         "idempotency_key": "reading-0002"},
+    ]
+    
+    response = json.loads((await symptoms.save_symptom_batch(SymptomBatch(items=items))).body)
+    assert (response["saved"], response["duplicates"], response["failed"]) == (1, 1, 1)
+    assert response["results"][0]["timestamp"] == "1403-01-01 08:00:00"
+    
+    assert response == SymptomBatchResponse.model_validate(response).model_dump()
+    
+    retry = json.loads((await symptoms.save_symptom_batch(SymptomBatch(items=items[:1]))).body)
+    assert retry["saved"] == 0 and retry["results"][0]["duplicate"] is True
+
+@pytest.mark.asyncio
+async def test_batch_backdated_readings_keep_date_order(monkeypatch):
+    """Test offline readings appended after newer ones are filtered, paged and summarized by date"""
+    from backend.models import SymptomBatch
+    from backend.routers import symptoms
+    from backend.services.history_cache import history_cache
+    from backend.services.history_columns import HistoryColumns
+    from backend.services.storage import SheetsStorage
+    
+    monkeypatch.setattr(symptoms, "symptom_storage", SheetsStorage(write_behind=True))
+    user_id = "user_offline1"
+    history_cache.fill(user_id, HistoryColumns.from_rows([
+        ["1403-05-10", "08:00:00", "وزن", "70"],
+        ["1403-05-20", "08:00:00", "وزن", "72"],
+    ]), history_cache.begin_fill())
+    items = [
+        {"user_id": user_id, "symptom_type": "وزن", "value": "71",
+         "idempotency_key": "offline-0001", "client_timestamp": "2024-08-02T08:00:00+03:30"},
+        {"user_id": user_id, "symptom_type": "وزن", "value": "69",
+         "idempotency_key": "offline-0002", "client_timestamp": "2024-03-25T08:00:00+03:30"},
+    ]
+    try:
+        await symptoms.save_symptom_batch(SymptomBatch(items=items))
+        
+        def values(**query):
+            response = client.post("/api/symptoms/history", json={"user_id": user_id, **query})
+            return [r["value"] for r in response.json()["data"]]
+        
+        assert values(from_date="1403-05-11", to_date="1403-05-15") == ["71"]
+        assert values(to_date="1403-02-01") == ["69"]
+        assert values(limit=2) == ["72", "71"]
+        assert values(limit=2, cursor=2) == ["70", "69"]
+        
+        summary = client.post("/api/symptoms/summary", json={"user_id": user_id}).json()
+        weight = summary["types"][3]
+        assert weight["count"] == 4 and weight["last"]["value"] == "72"
+    finally:
+        history_cache.invalidate(user_id)
+
+def test_batch_out_of_range_timestamp_fails_only_that_item(monkeypatch):
+    """Test a client timestamp jdatetime cannot convert is reported per item, not as a 500"""
+    from backend.routers import symptoms
+    
+    item = {"user_id": "user_test123", "symptom_type": "وزن", "value": "70",
+            "idempotency_key": "ancient-0001", "client_timestamp": "0622-03-01T00:00:00+00:00"}
+    response = client.post("/api/symptoms/batch", json={"items": [item]})
+    assert response.status_code == 200
+    assert response.json()["failed"] == 1
+    
+    def unrepresentable(moment=None):
+        raise ValueError("year is out of range")
+    
+    monkeypatch.setattr(symptoms, "current_iran_timestamp", unrepresentable)
+    item["client_timestamp"] = "2024-03-20T08:00:00+03:30"
+    response = client.post("/api/symptoms/batch", json={"items": [item]})
+    assert response.status_code == 200
+    result = response.json()["results"][0]
+    assert result["success"] is False and "year is out of range" in result["error"]
+
+@pytest.mark.asyncio
+async def test_symptom_summary(tmp_path, monkeypatch):
+    """Test the summary aggregates per type, splits blood pressure and counts out-of-range readings"""
+    from datetime import datetime, timedelta, timezone
+    from backend.models import SummaryResponse
+    from backend.routers import symptoms
+    from backend.services.storage import SQLiteStorage
+    
+    storage = SQLiteStorage(str(tmp_path / "symptoms.db"))
+    monkeypatch.setattr(symptoms, "symptom_storage", storage)
+    old = (datetime.now(timezone.utc) - timedelta(days=60)).isoformat()
+    
+    await storage.save_symptom("user_summary", "قند ناشتا", "100")
+    await storage.save_symptom("user_summary", "قند ناشتا", "140")
+    await storage.save_symptom("user_summary", "فشار خون", "120/80")
+    records = []
+    for key, value in (("k1", "2000"), ("k2", "abc")):
+        date, time = symptoms.current_iran_timestamp(datetime.fromisoformat(old))
+        records.append({"user_id": "user_summary", "symptom_type": "قند ناشتا", "value": value,
+                        "date": date, "time": time, "idempotency_key": key})
+    await storage.save_batch(records)
+    
+    response = client.post("/api/symptoms/summary", json={"user_id": "user_summary"})
+    assert response.status_code == 200
+    data = response.json()
+    fasting, _, pressure, weight = data["types"]
+    assert (fasting["count"], fasting["min"], fasting["max"]) == (3, 100, 2000)
+    assert fasting["out_of_range"] == 1
+    assert fasting["mean_7d"] == 120 and fasting["mean_30d"] == 120
+    assert pressure["systolic"]["mean"] == 120 and pressure["diastolic"]["mean"] == 80
+    assert weight["count"] == 0 and weight["mean"] is None
+    assert data["invalid"] == 1
+    # Returned without a model pass, so it must already be the model's full shape
+    assert data == SummaryResponse.model_validate(data).model_dump()
+    
+    bad = client.post("/api/symptoms/summary", json={"user_id": "nope_123"})
+    assert bad.status_code == 422
+
+def test_fast_json_matches_stdlib():
+    """Test the orjson path, when installed, writes the same bytes as json"""
+    from backend.utils.fast_json import dumps, orjson_dumps, stdlib_dumps
+    
+    content = {"name": "قند ناشتا", "value": 95.5, "count": 3, "last": None, "ok": True, "items": [1, "۲"], 7: "x"}
+    assert json.loads(dumps(content)) == {**{k: v for k, v in content.items() if k != 7}, "7": "x"}
+    if orjson_dumps is not None:
+        assert orjson_dumps(content) == stdlib_dumps(content)
+
+def test_default_rate_limit_rules_match_write_paths_exactly():
+    """Test history and summary reads are not counted as writes"""
+    from backend.middleware.rate_limit import RateLimitMiddleware
+    
+    middleware = RateLimitMiddleware(app=None, store=object())
+    assert middleware._match("POST", "/api/symptoms").name == "writes"
+    assert middleware._match("POST", "/api/symptoms/batch").name == "writes"
+    assert middleware._match("POST", "/api/symptoms/history").name == "default"
+    assert middleware._match("POST", "/api/symptoms/summary").name == "default"
+    assert middleware._match("GET", "/api/videos/diabetes").name == "videos"
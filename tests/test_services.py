@@ -0,0 +1,1006 @@
+"""
+Service layer tests
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from backend.services.cache import CacheService
+from backend.services.cache_backends import MemoryCacheBackend, SQLiteCacheBackend
+from backend.services.executor import BlockingExecutor, call_deadline, google_executor
+from backend.services.google_clients import GoogleClients
+from backend.services.google_drive import GoogleDriveService
+from backend.services.google_http import GoogleAsyncTransport
+from backend.services.google_sheets import GoogleSheetsService
+from backend.services.health import HealthProber
+from backend.services.history_cache import HistoryCache
+from backend.services.history_columns import HistoryColumns, jalali_ordinal
+from backend.services.history_query import select_history
+from backend.services.keyed_locks import FileKeyedLocks, KeyedLocks
+from backend.services.resilience import CircuitBreaker, CircuitOpenError, Resilience
+from backend.services.metrics import (
+    GoogleCallTimer, MetricsRegistry, google_api_errors, google_api_latency
+)
+from backend.services.sheet_index import SheetIndex
+from backend.services.video_catalog import VideoCatalog
+from backend.services.storage import SQLiteStorage
+from backend.services.symptom_summary import SummaryCache
+from backend.services.write_queue import SymptomWriteQueue
+from backend.utils.logger import JSONFormatter, NonBlockingQueueHandler, SamplingFilter, request_id_var
+
+@pytest.mark.asyncio
+async def test_executor_runs_off_event_loop():
+    """Test blocking calls run on a worker thread"""
+    executor = BlockingExecutor(max_workers=2, limits={'sheets': 1}, timeout=5)
+    main_thread = threading.get_ident()
+    
+    thread_id = await executor.run('sheets', threading.get_ident)
+    
+    assert thread_id != main_thread
+    assert executor.get_stats()['backends']['sheets']['completed'] == 1
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_executor_concurrency_cap_and_timeout():
+    """Test per-backend cap and per-call timeout"""
+    executor = BlockingExecutor(max_workers=4, limits={'drive': 1}, timeout=5)
+    
+    first = asyncio.create_task(executor.run('drive', time.sleep, 0.2))
+    await asyncio.sleep(0.05)
+    second = asyncio.create_task(executor.run('drive', time.sleep, 0))
+    await asyncio.sleep(0.05)
+    assert executor.get_stats()['backends']['drive']['waiting'] == 1
+    await asyncio.gather(first, second)
+    
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run('drive', time.sleep, 0.5, timeout=0.05)
+    assert executor.get_stats()['backends']['drive']['timeouts'] == 1
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_executor_holds_slot_until_timed_out_call_returns():
+    """Test a timed out call keeps its backend slot until the thread is done"""
+    executor = BlockingExecutor(max_workers=4, limits={'sheets': 1}, timeout=5)
+    
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run('sheets', time.sleep, 0.3, timeout=0.05)
+    assert executor.get_stats()['backends']['sheets']['in_flight'] == 1
+    
+    started = time.monotonic()
+    await executor.run('sheets', time.sleep, 0)
+    assert time.monotonic() - started >= 0.2
+    assert executor.get_stats()['backends']['sheets']['in_flight'] == 0
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_executor_can_wait_past_timeout_for_outcome():
+    """Test wait_for_worker returns the late result instead of abandoning the write"""
+    executor = BlockingExecutor(max_workers=1, limits={'sheets': 1}, timeout=5)
+    
+    def slow_write():
+        time.sleep(0.2)
+        return "written"
+    
+    assert await executor.run('sheets', slow_write, timeout=0.05, wait_for_worker=True) == "written"
+    stats = executor.get_stats()['backends']['sheets']
+    assert (stats['timeouts'], stats['completed']) == (1, 1)
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_write_queue_groups_rows_per_sheet(tmp_path):
+    """Test queued symptoms are flushed in one grouped write"""
+    writes = []
+    queue = SymptomWriteQueue(
+        journal_path=str(tmp_path / "journal.jsonl"),
+        max_batch=100,
+        flush_interval=60,
+        writer=writes.append
+    )
+    
+    result = await queue.submit("user_a1234", "وزن", "70")
+    await queue.submit("user_a1234", "وزن", "71")
+    await queue.submit("user_b1234", "قند ناشتا", "100")
+    assert result["success"] is True
+    
+    assert await queue.flush() == 3
+    assert len(writes) == 1
+    assert len(writes[0]["User_user_a1234"]) == 2
+    assert len(writes[0]["User_user_b1234"]) == 1
+    assert queue._read_journal() == []
+
+@pytest.mark.asyncio
+async def test_write_queue_replays_journal(tmp_path):
+    """Test unflushed entries survive a restart"""
+    journal = str(tmp_path / "journal.jsonl")
+    
+    def failing_writer(rows_by_sheet):
+        raise RuntimeError("quota exceeded")
+    
+    crashed = SymptomWriteQueue(journal, max_batch=100, flush_interval=60, writer=failing_writer)
+    await crashed.submit("user_a1234", "وزن", "70")
+    assert await crashed.flush() == 0
+    
+    writes = []
+    restarted = SymptomWriteQueue(journal, max_batch=100, flush_interval=60, writer=writes.append, reader=lambda sheet: [])
+    await restarted.start()
+    await restarted.stop()
+    
+    assert writes[0]["User_user_a1234"][0][2:] == ["وزن", "70"]
+
+@pytest.mark.asyncio
+async def test_write_queue_isolates_failing_sheet(tmp_path):
+    """Test one broken tab does not block other users and is dead-lettered"""
+    writes = []
+    
+    def writer(rows_by_sheet):
+        if "User_user_bad123" in rows_by_sheet:
+            raise RuntimeError("Unable to parse range")
+        writes.append(rows_by_sheet)
+    
+    journal = str(tmp_path / "journal.jsonl")
+    queue = SymptomWriteQueue(journal, max_batch=100, flush_interval=60, writer=writer, max_attempts=2)
+    await queue.submit("user_a1234", "وزن", "70")
+    await queue.submit("user_bad123", "وزن", "71")
+    
+    assert await queue.flush() == 1
+    assert list(writes[0]) == ["User_user_a1234"]
+    assert [e['user_id'] for e in queue._read_journal()] == ["user_bad123"]
+    
+    await queue.submit("user_a1234", "وزن", "72")
+    assert await queue.flush() == 1
+    assert queue._read_journal() == []
+    assert queue.get_stats()['dead_lettered'] == 1 and queue.get_stats()['pending'] == 0
+    with open(queue.dead_letter_path, encoding="utf-8") as f:
+        assert json.loads(f.readline())['row'][2:] == ["وزن", "71"]
+
+@pytest.mark.asyncio
+async def test_write_queue_checks_sheet_before_resending(tmp_path):
+    """Test a write that timed out after reaching the sheet is not sent again"""
+    sheet: list = []
+    
+    def writer(rows_by_sheet):
+        sheet.extend(rows_by_sheet["User_user_a1234"])
+        if len(sheet) == 1:
+            raise TimeoutError("The read operation timed out")
+    
+    queue = SymptomWriteQueue(
+        str(tmp_path / "journal.jsonl"), max_batch=100, flush_interval=60,
+        writer=writer, reader=lambda name: list(sheet)
+    )
+    await queue.submit("user_a1234", "وزن", "70")
+    assert await queue.flush() == 0
+    assert queue._pending[0]['unconfirmed'] is True
+    
+    await queue.submit("user_a1234", "وزن", "71")
+    assert await queue.flush() == 2
+    assert [row[3] for row in sheet] == ["70", "71"]
+    assert queue.get_stats()['confirmed'] == 1
+    assert queue._read_journal() == []
+
+@pytest.mark.asyncio
+async def test_write_queue_flush_loop_survives_errors(tmp_path, monkeypatch):
+    """Test a failing journal rewrite does not stop the background flusher"""
+    writes = []
+    queue = SymptomWriteQueue(str(tmp_path / "journal.jsonl"), max_batch=1, flush_interval=0.01, writer=writes.append)
+    acknowledge = queue._acknowledge
+    failures = [OSError("No space left on device")]
+    
+    def flaky_acknowledge(entry_ids):
+        if failures:
+            raise failures.pop()
+        acknowledge(entry_ids)
+    
+    monkeypatch.setattr(queue, '_acknowledge', flaky_acknowledge)
+    await queue.start()
+    await queue.submit("user_a1234", "وزن", "70")
+    await asyncio.sleep(0.1)
+    await queue.submit("user_a1234", "وزن", "71")
+    await asyncio.sleep(0.1)
+    
+    assert not queue._task.done()
+    assert len(writes) == 2
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_write_queue_adopts_only_journals_of_exited_workers(tmp_path):
+    """Test each worker keeps its own journal and picks up those left by dead workers"""
+    import fcntl
+    
+    journal = str(tmp_path / "journal.jsonl")
+    def entry(value):
+        return {'id': value, 'user_id': "user_a1234", 'sheet': "User_user_a1234", 'row': ["1403-01-01", "08:00:00", "وزن", value]}
+    
+    for pid, value in ((999999, "70"), (888888, "71")):
+        with open(f"{journal}.{pid}", "w", encoding="utf-8") as f:
+            f.write(json.dumps(entry(value)) + "\n")
+    live = open(f"{journal}.888888.lock", "w")
+    fcntl.flock(live, fcntl.LOCK_EX)
+    
+    writes = []
+    queue = SymptomWriteQueue(journal, max_batch=100, flush_interval=60, writer=writes.append, reader=lambda name: [])
+    await queue.start()
+    await queue.stop()
+    live.close()
+    
+    assert [row[3] for row in writes[0]["User_user_a1234"]] == ["70"]
+    assert queue.get_stats()['adopted'] == 1
+    assert not (tmp_path / "journal.jsonl.999999").exists()
+    assert (tmp_path / "journal.jsonl.888888").exists()
+
+def test_sheet_index_loads_once():
+    """Test tab lookups hit the in-memory index after the first load"""
+    calls = []
+    
+    def loader():
+        calls.append(1)
+        return {"User_user_a1234": 1}
+    
+    index = SheetIndex(loader, ttl=600)
+    
+    assert "User_user_a1234" in index
+    assert "User_user_b1234" not in index
+    index.add("User_user_b1234", 2)
+    assert index.get("User_user_b1234") == 2
+    assert len(calls) == 1
+
+def test_history_cache_write_through_and_eviction():
+    """Test saves append to cached history and LRU eviction"""
+    cache = HistoryCache(max_users=1, ttl=300)
+    row = {'date': '1403-01-01', 'time': '08:00:00', 'type': 'وزن', 'value': '70'}
+    
+    assert cache.get("user_a1234") is None
+    cache.fill("user_a1234", HistoryColumns(), cache.begin_fill())
+    cache.append("user_a1234", row)
+    assert list(cache.get("user_a1234")) == [row]
+    
+    cache.fill("user_b1234", HistoryColumns(), cache.begin_fill())
+    assert cache.get("user_a1234") is None
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 2, 1)
+
+def test_history_cache_keeps_pending_rows():
+    """Test a fill racing a queued write is merged but not stored"""
+    cache = HistoryCache(max_users=10, ttl=300)
+    row = {'date': '1403-01-01', 'time': '08:00:00', 'type': 'وزن', 'value': '70'}
+    
+    started = cache.begin_fill()
+    cache.add_pending("user_a1234", "entry-1", row)
+    assert list(cache.fill("user_a1234", HistoryColumns(), started)) == [row]
+    assert cache.get("user_a1234") is None
+    
+    assert list(cache.fill("user_a1234", HistoryColumns(), cache.begin_fill())) == [row]
+    assert list(cache.get("user_a1234")) == [row]
+
+def test_history_columns_roundtrip_and_json():
+    """Test columnar history gives back the exact rows and json.dumps bytes"""
+    rows = [
+        ['1403-01-01', '08:00:00', 'وزن', '70'],
+        ['1403-01-01', '09:30:05', 'فشار خون', '120/80'],
+        ['1403-01-02', '20:15:00', 'قند ناشتا', '95.5'],
+        ['1403-01-02', '20:15:00', 'وزن', '70.50'],
+        ['1403-1-3', '8:00', 'علامت "دیگر"', 'زیاد'],
+    ]
+    columns = HistoryColumns.from_rows(rows)
+    records = [dict(zip(('date', 'time', 'type', 'value'), row)) for row in rows]
+    
+    assert list(columns) == records
+    assert [columns.is_exact(i) for i in range(len(rows))] == [False, False, False, True, True]
+    assert columns.to_json() == ",".join(
+        json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in records
+    )
+    assert columns.to_json(3, 10) == ",".join(
+        json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in records[3:]
+    )
+    assert list(columns[1:4]) == records[1:4]
+    assert columns[-1] == records[-1]
+
+def test_history_columns_free_text_types_share_one_code():
+    """Test types outside the catalog neither grow the code table nor lose their text"""
+    rows = [['1403-01-01', '08:00:00', f'علامت {n}', '1'] for n in range(70000)]
+    rows.append(['1403-01-02', '08:00:00', 'وزن', '70'])
+    columns = HistoryColumns.from_rows(rows)
+    
+    assert len(set(columns.types)) == 2
+    assert columns[69999]['type'] == 'علامت 69999'
+    assert columns[-1]['type'] == 'وزن'
+    page, _ = select_history(columns, symptom_type='علامت 12')
+    assert [r['type'] for r in page] == ['علامت 12']
+    page, _ = select_history(columns, symptom_filter='علامت 6999', limit=20)
+    assert len(page) == 11 and page[0]['type'] == 'علامت 69999'
+
+def test_select_history_pages_newest_first():
+    """Test cursor pagination, exact type and Jalali date range"""
+    records = [
+        {'date': f'1403-01-{day:02d}', 'time': '08:00:00', 'type': 'وزن' if day % 2 else 'قند ناشتا', 'value': str(day)}
+        for day in range(1, 11)
+    ]
+    
+    page, cursor = select_history(records, limit=3)
+    assert [r['value'] for r in page] == ['10', '9', '8'] and cursor == 3
+    page, cursor = select_history(records, limit=3, cursor=9)
+    assert [r['value'] for r in page] == ['1'] and cursor is None
+    
+    page, cursor = select_history(records, symptom_type='وزن', limit=2, cursor=2)
+    assert [r['value'] for r in page] == ['5', '3'] and cursor == 4
+    
+    page, cursor = select_history(records, from_date='1403-01-03', to_date='1403-01-05')
+    assert [r['value'] for r in page] == ['3', '4', '5'] and cursor is None
+
+def test_select_history_with_rows_out_of_order():
+    """Test backdated rows appended late are still filtered and paged by date"""
+    records = [
+        {'date': date, 'time': '08:00:00', 'type': 'وزن', 'value': value}
+        for date, value in (('1403-05-10', '1'), ('1403-05-12', '2'), ('1403-01-01', '3'), ('1403-05-20', '4'))
+    ]
+    assert not HistoryColumns.from_records(records).sorted
+    
+    page, _ = select_history(records, from_date='1403-05-01')
+    assert [r['value'] for r in page] == ['1', '2', '4']
+    page, _ = select_history(records, to_date='1403-02-01')
+    assert [r['value'] for r in page] == ['3']
+    page, _ = select_history(records, from_date='1403-05-11', to_date='1403-05-15')
+    assert [r['value'] for r in page] == ['2']
+    
+    page, cursor = select_history(records, limit=2)
+    assert [r['value'] for r in page] == ['4', '2'] and cursor == 2
+    page, cursor = select_history(records, limit=2, cursor=2)
+    assert [r['value'] for r in page] == ['1', '3'] and cursor is None
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_roundtrip(tmp_path):
+    """Test the SQLite backend saves and pages history offline"""
+    storage = SQLiteStorage(str(tmp_path / "symptoms.db"))
+    await storage.start()
+    
+    for value in ("100", "110", "120"):
+        await storage.save_symptom("user_a1234", "قند ناشتا", value)
+    await storage.save_symptom("user_a1234", "وزن", "70")
+    await storage.save_symptom("user_b1234", "وزن", "80")
+    
+    history = await storage.get_user_history("user_a1234")
+    assert [h['value'] for h in history] == ["100", "110", "120", "70"]
+    
+    page, cursor = await storage.query_history("user_a1234", symptom_type="قند ناشتا", limit=2)
+    assert [h['value'] for h in page] == ["120", "110"] and cursor == 2
+    page, cursor = await storage.query_history("user_a1234", symptom_type="قند ناشتا", limit=2, cursor=2)
+    assert [h['value'] for h in page] == ["100"] and cursor is None
+    await storage.stop()
+
+class FakeRequest:
+    def __init__(self, handler, kwargs):
+        self.handler = handler
+        self.kwargs = kwargs
+    
+    def execute(self, http=None):
+        return self.handler(**self.kwargs)
+
+class FakeChanges:
+    """changes() resource of FakeDrive; page tokens are offsets into the change log"""
+    
+    def __init__(self, log):
+        self.log = log
+    
+    def getStartPageToken(self):
+        return FakeRequest(lambda: {'startPageToken': str(len(self.log))}, {})
+    
+    def list(self, pageToken, **kwargs):
+        return FakeRequest(self._list, {'start': int(pageToken)})
+    
+    def _list(self, start):
+        return {'changes': self.log[start:], 'newStartPageToken': str(len(self.log))}
+
+class FakeDrive:
+    """Minimal stand-in for the Drive v3 discovery client"""
+    
+    def __init__(self, folders, files):
+        self.folders = folders  # name -> id
+        self.files_by_folder = files  # id -> [file]
+        self.change_log = []
+        self.calls = []
+        self.page_size = None
+    
+    def files(self):
+        return self
+    
+    def changes(self):
+        return FakeChanges(self.change_log)
+    
+    def list(self, **kwargs):
+        return FakeRequest(self._list, kwargs)
+    
+    def _list(self, q, pageToken=None, **kwargs):
+        self.calls.append(q)
+        if "application/vnd.google-apps.folder" in q:
+            return {'files': [
+                {'id': fid, 'name': name} for name, fid in self.folders.items() if f"name='{name}'" in q or "name=" not in q
+            ]}
+        folder_id = q.split("'")[1]
+        if folder_id not in self.files_by_folder:
+            raise HttpError(type("Resp", (), {"status": 404, "reason": "Not Found"})(), b"File not found")
+        files = self.files_by_folder[folder_id]
+        if self.page_size is None:
+            return {'files': files}
+        start = int(pageToken or 0)
+        end = start + self.page_size
+        return {'files': files[start:end], **({'nextPageToken': str(end)} if end < len(files) else {})}
+
+def make_drive_service(fake):
+    service = GoogleDriveService()
+    service._service = fake
+    service.transport = None
+    service._execute = lambda request: request.execute()
+    return service
+
+@pytest.mark.asyncio
+async def test_drive_folder_ids_resolved_once():
+    """Test listings cost one Drive call once folder IDs are known"""
+    video = {'id': 'v1', 'name': 'intro.mp4', 'mimeType': 'video/mp4', 'size': '10'}
+    fake = FakeDrive({'Diabetes Mellitus': 'f1'}, {'f1': [video]})
+    drive = make_drive_service(fake)
+    
+    drive.warm_folder_ids()
+    assert len(fake.calls) == 1
+    
+    videos = await drive.get_videos_for_disease('diabetes')
+    assert videos[0]['id'] == 'v1'
+    assert len(fake.calls) == 2
+    
+    # Folder recreated under a new ID: a 404 triggers one re-resolution
+    fake.folders['Diabetes Mellitus'] = 'f2'
+    fake.files_by_folder = {'f2': [video]}
+    assert len(await drive.get_videos_for_disease('diabetes')) == 1
+    assert drive._folder_ids['Diabetes Mellitus'] == 'f2'
+
+@pytest.mark.asyncio
+async def test_drive_listing_follows_every_page():
+    """Test a folder listing reads all pages and skips the executor for known folder IDs"""
+    videos = [{'id': f'v{n}', 'name': f'{n}.mp4', 'mimeType': 'video/mp4', 'size': '10'} for n in range(5)]
+    fake = FakeDrive({'Diabetes Mellitus': 'f1'}, {'f1': videos})
+    fake.page_size = 2
+    drive = make_drive_service(fake)
+    drive.warm_folder_ids()
+    completed = google_executor.get_stats()['backends']['drive']['completed']
+    
+    listed = await drive.get_videos_for_disease('diabetes')
+    assert [v['id'] for v in listed] == [v['id'] for v in videos]
+    assert len(fake.calls) == 4
+    assert google_executor.get_stats()['backends']['drive']['completed'] == completed + 3
+
+@pytest.mark.asyncio
+async def test_video_catalog_follows_changes_feed():
+    """Test the catalog lists folders once, then applies uploads, moves and trashes incrementally"""
+    video = {'id': 'v1', 'name': 'intro.mp4', 'mimeType': 'video/mp4', 'size': '10'}
+    fake = FakeDrive(
+        {'Diabetes Mellitus': 'f1', 'Hypertension': 'f2', 'Heart disease': 'f3'},
+        {'f1': [video], 'f2': [], 'f3': []}
+    )
+    drive = make_drive_service(fake)
+    catalog = VideoCatalog(drive, interval=10)
+    assert catalog.get_listing('diabetes') is None
+    
+    await catalog.sync_once()
+    listing = catalog.get_listing('diabetes')
+    assert json.loads(listing['body'])['videos'][0]['id'] == 'v1'
+    assert catalog.get_listing('cardiac')['count'] == 0
+    listed = len(fake.calls)
+    
+    # Nothing changed: one changes.list call, no folder listings, same ETag
+    await catalog.sync_once()
+    assert len(fake.calls) == listed
+    assert catalog.get_listing('diabetes')['etag'] == listing['etag']
+    
+    main = drive.settings.MAIN_FOLDER_ID
+    fake.change_log.extend([
+        {'fileId': 'v2', 'removed': False, 'file': {'id': 'v2', 'name': 'diet.pdf', 'mimeType': 'application/pdf', 'size': '5', 'parents': ['f1']}},
+        {'fileId': 'v1', 'removed': False, 'file': {**video, 'parents': ['f2']}},
+        {'fileId': 'x1', 'removed': False, 'file': {'id': 'x1', 'name': 'notes.txt', 'mimeType': 'text/plain', 'parents': ['f1']}},
+        {'fileId': 'f9', 'removed': False, 'file': {'id': 'f9', 'name': 'Other', 'mimeType': 'application/vnd.google-apps.folder', 'parents': [main]}}
+    ])
+    await catalog.sync_once()
+    assert len(fake.calls) == listed
+    assert [v['id'] for v in json.loads(catalog.get_listing('diabetes')['body'])['videos']] == ['v2']
+    assert [v['id'] for v in json.loads(catalog.get_listing('hypertension')['body'])['videos']] == ['v1']
+    
+    fake.change_log.append({'fileId': 'v2', 'removed': False, 'file': {'id': 'v2', 'name': 'diet.pdf', 'trashed': True, 'parents': ['f1']}})
+    await catalog.sync_once()
+    assert catalog.get_listing('diabetes')['count'] == 0
+    
+    # A disease folder being trashed forces a full reload
+    fake.change_log.append({'fileId': 'f3', 'removed': False, 'file': {'id': 'f3', 'name': 'Heart disease', 'trashed': True, 'parents': [main]}})
+    del fake.folders['Heart disease']
+    await catalog.sync_once()
+    assert len(fake.calls) > listed
+    assert catalog.get_stats()['reloads'] == 2
+    assert catalog.get_listing('cardiac')['count'] == 0
+
+@pytest.mark.asyncio
+async def test_cache_single_flight_and_stale_on_error():
+    """Test concurrent misses share one fetch and stale data survives an outage"""
+    cache = CacheService(MemoryCacheBackend(max_entries=10))
+    calls = []
+    
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ['video']
+    
+    results = await asyncio.gather(*(cache.get_or_fetch('videos_x', fetch) for _ in range(5)))
+    assert results == [['video']] * 5
+    assert len(calls) == 1
+    
+    async def outage():
+        raise RuntimeError("drive down")
+    
+    # Age the entry past both the TTL and the revalidate window
+    age = cache.settings.VIDEO_CACHE_DURATION + cache.settings.CACHE_STALE_WHILE_REVALIDATE
+    cache.backend.set('videos_x', ['video'], ttl=cache._retention, stored_at=time.time() - age)
+    assert await cache.get_or_fetch('videos_x', outage) == ['video']
+    assert cache.get_stats()['stale_on_error'] == 1
+
+def test_sqlite_cache_backend_shared_between_instances(tmp_path):
+    """Test two workers see the same entries, with TTL and size bounds"""
+    path = str(tmp_path / "cache.db")
+    worker_a = SQLiteCacheBackend(path, max_entries=2)
+    worker_b = SQLiteCacheBackend(path, max_entries=2)
+    
+    worker_a.set('videos_diabetes', [{'name': 'دیابت'}], ttl=60)
+    value, _ = worker_b.get('videos_diabetes')
+    assert value == [{'name': 'دیابت'}]
+    
+    worker_a.set('expired', [], ttl=-1)
+    assert worker_b.get('expired') is None
+    
+    worker_b.set('videos_cardiac', [], ttl=60)
+    worker_b.set('videos_hypertension', [], ttl=60)
+    assert worker_a.get('videos_diabetes') is None
+    assert sorted(worker_a.keys()) == ['videos_cardiac', 'videos_hypertension']
+
+@pytest.mark.asyncio
+async def test_sqlite_cache_runs_off_event_loop(tmp_path):
+    """Test CacheService calls a blocking backend on a worker thread"""
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"), max_entries=10)
+    threads = []
+    original_set = backend.set
+    
+    def recording_set(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return original_set(*args, **kwargs)
+    
+    backend.set = recording_set
+    service = CacheService(backend)
+    
+    async def fetch():
+        return ['video']
+    
+    assert await service.get_or_fetch('videos_diabetes', fetch) == ['video']
+    assert await service.peek_async('videos_diabetes') == ['video']
+    assert threads and threading.get_ident() not in threads
+    # Not the slots symptom storage writes wait on
+    assert google_executor.get_stats()['backends']['cache']['completed'] >= 2
+
+def test_metrics_sharded_across_threads():
+    """Test per-thread shards sum up and render in text format"""
+    registry = MetricsRegistry()
+    calls = registry.counter("calls_total", "Calls", ("api",))
+    latency = registry.histogram("latency_seconds", "Latency", ("api",), buckets=(0.1, 1.0))
+    
+    def work():
+        for _ in range(1000):
+            calls.inc("sheets")
+            latency.observe(0.5, "sheets")
+    
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    text = registry.render()
+    assert 'calls_total{api="sheets"} 4000' in text
+    assert 'latency_seconds_bucket{api="sheets",le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{api="sheets",le="1.0"} 4000' in text
+    assert 'latency_seconds_count{api="sheets"} 4000' in text
+
+def test_google_call_timer_labels_method_and_errors():
+    """Test Google calls are recorded per API method, with failures by status"""
+    class Request:
+        methodId = "sheets.spreadsheets.values.append"
+    
+    before = google_api_errors.values().get(("sheets", "values.append", "RuntimeError"), 0)
+    with GoogleCallTimer("sheets", Request()):
+        pass
+    with pytest.raises(RuntimeError):
+        with GoogleCallTimer("sheets", Request()):
+            raise RuntimeError("boom")
+    
+    assert google_api_latency.values()[("sheets", "values.append")][-1] >= 2
+    assert google_api_errors.values()[("sheets", "values.append", "RuntimeError")] == before + 1
+
+@pytest.mark.asyncio
+async def test_health_prober_snapshot():
+    """Test probe outcomes are recorded and drive readiness"""
+    def sheets_ok():
+        pass
+    
+    def drive_down():
+        raise RuntimeError("drive unreachable")
+    
+    prober = HealthProber({'sheets': sheets_ok, 'drive': drive_down}, interval=30, timeout=1)
+    assert prober.snapshot()['sheets']['status'] == 'unknown'
+    
+    await prober.probe_all()
+    snapshot = prober.snapshot()
+    assert snapshot['sheets']['status'] == 'ok'
+    assert snapshot['sheets']['last_success'] is not None
+    assert snapshot['drive']['status'] == 'error'
+    assert snapshot['drive']['consecutive_failures'] == 1
+    assert 'drive unreachable' in snapshot['drive']['last_error']
+    assert not prober.is_ready()
+    
+    prober.probes['drive'] = sheets_ok
+    await prober.probe('drive')
+    assert prober.is_ready()
+
+def test_google_clients_scope_credentials_per_api_and_refresh_once(monkeypatch):
+    """Test each client builds offline on its own least-privilege credentials with one refresh"""
+    import rsa
+    
+    clients = GoogleClients()
+    monkeypatch.setattr(clients.settings, 'GOOGLE_CREDENTIALS_JSON', json.dumps({
+        'type': 'service_account',
+        'client_email': 'bot@example.iam.gserviceaccount.com',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'private_key': rsa.newkeys(512)[1].save_pkcs1().decode()
+    }))
+    
+    sheets = clients.build('sheets', 'v4')
+    drive = clients.build('drive', 'v3')
+    assert sheets._http.credentials is clients.credentials('sheets')
+    assert drive._http.credentials is clients.credentials('drive')
+    assert list(clients.credentials('sheets').scopes) == clients.settings.SCOPES_SHEETS
+    assert list(clients.credentials('drive').scopes) == ['https://www.googleapis.com/auth/drive.readonly']
+    assert 'sheets_build_seconds' in clients.timings
+    assert clients.http().timeout == clients.settings.GOOGLE_CALL_TIMEOUT
+    with pytest.raises(ValueError):
+        clients.credentials('gmail')
+    
+    refreshes = []
+    credentials = clients.credentials('sheets')
+    
+    def refresh(request):
+        refreshes.append(request)
+        time.sleep(0.05)
+        credentials.token = 'token'
+    
+    monkeypatch.setattr(credentials, 'refresh', refresh)
+    threads = [threading.Thread(target=clients.ensure_fresh, args=('sheets',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(refreshes) == 1
+    assert clients.credentials('drive').token is None
+
+@pytest.mark.asyncio
+async def test_async_transport_sends_discovery_requests():
+    """Test discovery-built requests go over httpx with a bearer token and keep HttpError semantics"""
+    import httpx
+    from googleapiclient.discovery import build
+    from googleapiclient.http import build_http
+    
+    class FakeCredentials:
+        valid = True
+        token = 'secret-token'
+    
+    class FakeClients:
+        @staticmethod
+        def credentials(api):
+            return FakeCredentials
+    
+    seen = []
+    
+    def handler(request):
+        seen.append(request)
+        if 'missing' in request.url.params['q']:
+            return httpx.Response(404, json={'error': {'code': 404, 'message': 'File not found'}})
+        return httpx.Response(200, json={'files': [{'id': 'v1', 'name': 'intro.mp4'}]})
+    
+    drive = build('drive', 'v3', http=build_http(), static_discovery=True, cache_discovery=False)
+    transport = GoogleAsyncTransport(
+        max_connections=4, max_keepalive=2, timeout=5,
+        clients=FakeClients, transport=httpx.MockTransport(handler)
+    )
+    
+    result = await transport.execute('drive', drive.files().list(q="'folder' in parents"))
+    assert result == {'files': [{'id': 'v1', 'name': 'intro.mp4'}]}
+    assert seen[0].headers['authorization'] == 'Bearer secret-token'
+    assert seen[0].url.path == '/drive/v3/files'
+    
+    with pytest.raises(HttpError) as error:
+        await transport.execute('drive', drive.files().list(q="'missing' in parents"))
+    assert error.value.resp.status == 404
+    await transport.aclose()
+
+def http_error(status, retry_after=None):
+    headers = {'status': status}
+    if retry_after is not None:
+        headers['retry-after'] = str(retry_after)
+    return HttpError(httplib2.Response(headers), b'{}')
+
+def make_resilience(**kwargs):
+    breaker = CircuitBreaker('sheets', failure_threshold=kwargs.pop('threshold', 3), reset_timeout=kwargs.pop('reset', 60))
+    return Resilience('sheets', max_attempts=4, base_delay=0.001, max_delay=1, breaker=breaker, **kwargs)
+
+def test_retry_respects_idempotency_and_retry_after(monkeypatch):
+    """Test appends only retry on quota errors and Retry-After sets the minimum wait"""
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    resilience = make_resilience(threshold=10)
+    
+    outcomes = [http_error(429, retry_after=0.5), http_error(503), 'ok']
+    def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    
+    assert resilience.call_sync(flaky) == 'ok'
+    assert sleeps[0] >= 0.5
+    assert resilience.get_stats()['retries'] == 2
+    
+    # A non-idempotent append may have been applied on a 503, so it is not repeated
+    calls = []
+    def append():
+        calls.append(1)
+        raise http_error(503)
+    with pytest.raises(HttpError):
+        resilience.call_sync(append, idempotent=False)
+    assert len(calls) == 1
+    
+    # A 404 is the caller's problem: no retry, and it does not count against the backend
+    def missing():
+        raise http_error(404)
+    with pytest.raises(HttpError):
+        resilience.call_sync(missing)
+    assert resilience.breaker.failures == 0
+
+@pytest.mark.asyncio
+async def test_retries_stop_at_the_executor_deadline():
+    """Test a worker thread stops retrying once its caller has timed out"""
+    executor = BlockingExecutor(max_workers=1, limits={'sheets': 1}, timeout=5)
+    resilience = make_resilience(threshold=10)
+    calls = []
+    
+    def read():
+        calls.append(1)
+        time.sleep(0.1)
+        raise http_error(503)
+    
+    def execute():
+        return resilience.call_sync(read, deadline=call_deadline.get())
+    
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run('sheets', execute, timeout=0.05)
+    await asyncio.sleep(0.3)
+    assert len(calls) == 1
+    assert resilience.get_stats()['gave_up'] == 1
+    executor.shutdown()
+
+def test_circuit_breaker_fails_fast_then_recovers():
+    """Test the circuit opens after repeated failures and a trial call closes it"""
+    breaker = CircuitBreaker('drive', failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_after > 1
+    
+    breaker.opened_until = time.monotonic() - 1
+    breaker.before_call()  # half-open trial
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.get_stats()['state'] == 'closed'
+    
+    # A long Retry-After opens the circuit on the first failure
+    breaker.record_failure(hold_for=300)
+    assert breaker.state == 'open' and breaker.get_stats()['open_for_seconds'] > 200
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_releases_half_open_slot():
+    """Test a cancelled half-open trial does not leave the circuit stuck"""
+    resilience = make_resilience()
+    resilience.breaker.state = CircuitBreaker.OPEN
+    resilience.breaker.opened_until = time.monotonic() - 1
+    
+    async def slow():
+        await asyncio.sleep(10)
+    
+    trial = asyncio.ensure_future(resilience.call_async(slow))
+    await asyncio.sleep(0)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+    
+    async def ok():
+        return "ok"
+    assert await resilience.call_async(ok) == "ok"
+    assert resilience.breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_hedged_read_takes_first_success():
+    """Test a slow read is hedged and the faster copy wins"""
+    resilience = make_resilience()
+    delays = [1.0, 0.0]
+    
+    async def read():
+        await asyncio.sleep(delays.pop(0))
+        return ['row']
+    
+    started = time.monotonic()
+    assert await resilience.hedged(read, delay=0.05) == ['row']
+    assert time.monotonic() - started < 0.5
+    assert resilience.get_stats()['hedges'] == 1
+    assert resilience.get_stats()['hedge_wins'] == 1
+
+def test_log_pipeline_defers_formatting_and_samples():
+    """Test records are queued unformatted with the request ID, and hot INFO lines are sampled"""
+    log_queue = queue.Queue(maxsize=10)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter({'test.hot': 0.25}))
+    
+    quiet = logging.getLogger('test.quiet')
+    hot = logging.getLogger('test.hot')
+    for logger in (quiet, hot):
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+    
+    token = request_id_var.set('req-1')
+    try:
+        quiet.info("Saved %s = %d", "fbs", 120)
+    finally:
+        request_id_var.reset(token)
+    record = log_queue.get_nowait()
+    assert record.msg == "Saved %s = %d" and record.args == ("fbs", 120)
+    
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry['message'] == "Saved fbs = 120"
+    assert entry['request_id'] == 'req-1'
+    
+    for i in range(8):
+        hot.info("tick %d", i)
+    hot.warning("always kept")
+    kept = [log_queue.get_nowait() for _ in range(log_queue.qsize())]
+    assert [r.getMessage() for r in kept] == ["tick 3", "tick 7", "always kept"]
+    assert json.loads(JSONFormatter().format(kept[0]))['sample_rate'] == 0.25
+    
+    # A full queue drops instead of blocking
+    for i in range(12):
+        quiet.info("fill %d", i)
+    assert handler.dropped == 2
+
+@pytest.mark.asyncio
+async def test_keyed_locks_serialize_and_evict():
+    """Test writes for one key run one at a time and idle keys are dropped"""
+    locks = KeyedLocks()
+    order = []
+    
+    async def write(key, tag):
+        async with locks.hold(key):
+            order.append(f"{tag}-start")
+            await asyncio.sleep(0.01)
+            order.append(f"{tag}-end")
+    
+    await asyncio.gather(write('User_1', 'a'), write('User_1', 'b'), write('User_2', 'c'))
+    assert order.index('a-end') < order.index('b-start')
+    assert len(locks) == 0
+    assert locks.get_stats()['contended'] == 1
+
+@pytest.mark.asyncio
+async def test_file_keyed_locks_exclude_other_processes(tmp_path):
+    """Test two managers on one directory (as two workers would be) exclude each other"""
+    worker_a = FileKeyedLocks(str(tmp_path), poll_interval=0.001)
+    worker_b = FileKeyedLocks(str(tmp_path), poll_interval=0.001)
+    order = []
+    
+    async def write(locks, tag):
+        async with locks.hold('User_1'):
+            order.append(f"{tag}-start")
+            await asyncio.sleep(0.02)
+            order.append(f"{tag}-end")
+    
+    await asyncio.gather(write(worker_a, 'a'), write(worker_b, 'b'))
+    assert order in (['a-start', 'a-end', 'b-start', 'b-end'], ['b-start', 'b-end', 'a-start', 'a-end'])
+    assert worker_a.get_stats()['file_waits'] + worker_b.get_stats()['file_waits'] == 1
+
+class FakeSpreadsheets:
+    """Spreadsheet stand-in where another worker already added some tabs"""
+    
+    def __init__(self, tabs):
+        self.tabs = tabs  # title -> sheetId
+        self.added = []
+        self.headers = []
+    
+    def spreadsheets(self):
+        return self
+    
+    def values(self):
+        return self
+    
+    def get(self, **kwargs):
+        return FakeRequest(lambda: {'sheets': [
+            {'properties': {'title': title, 'sheetId': sheet_id}} for title, sheet_id in self.tabs.items()
+        ]}, {})
+    
+    def update(self, range, **kwargs):
+        return FakeRequest(lambda: self.headers.append(range), {})
+    
+    def batchUpdate(self, body, **kwargs):
+        return FakeRequest(self._add, {'title': body['requests'][0]['addSheet']['properties']['title']})
+    
+    def _add(self, title):
+        if title in self.tabs:
+            content = json.dumps({'error': {'message': f'A sheet with the name "{title}" already exists.'}})
+            raise HttpError(httplib2.Response({'status': 400}), content.encode())
+        self.tabs[title] = len(self.tabs) + 1
+        self.added.append(title)
+        return {'replies': [{'addSheet': {'properties': {'title': title, 'sheetId': self.tabs[title]}}}]}
+
+def test_ensure_sheet_is_idempotent():
+    """Test creating a tab another worker just created adopts it instead of failing"""
+    fake = FakeSpreadsheets({})
+    service = GoogleSheetsService()
+    service._service = fake
+    service._execute = lambda request: request.execute()
+    
+    assert service.ensure_sheet('User_1') == 1
+    assert service.ensure_sheet('User_1') == 1
+    assert fake.added == ['User_1'] and fake.headers == ['User_1!A1:D1']
+    
+    # Created elsewhere after our index was loaded
+    fake.tabs['User_2'] = 7
+    assert service.ensure_sheet('User_2') == 7
+    assert fake.added == ['User_1'] and len(fake.headers) == 1
+
+def test_summary_cache_folds_only_new_rows():
+    """Test appended readings update cached aggregates without reprocessing history"""
+    cache = SummaryCache(max_users=2)
+    history = [
+        {'date': '1403-01-01', 'time': '08:00:00', 'type': 'وزن', 'value': '70'},
+        {'date': '1403-01-10', 'time': '08:00:00', 'type': 'وزن', 'value': '80'}
+    ]
+    today = jalali_ordinal('1403-01-10')
+    
+    weight = cache.get('user_1', history).to_dict(today)['types'][3]
+    assert (weight['count'], weight['mean'], weight['mean_7d'], weight['mean_30d']) == (2, 75, 80, 75)
+    
+    history.append({'date': '1403-01-10', 'time': '09:00:00', 'type': 'وزن', 'value': '90'})
+    weight = cache.get('user_1', history).to_dict(today)['types'][3]
+    assert (weight['count'], weight['max'], weight['mean_7d']) == (3, 90, 85)
+    assert weight['last']['value'] == '90'
+    assert cache.get_stats()['rows_folded'] == 3
+    
+    # History rewritten underneath the cache: rebuilt from scratch
+    weight = cache.get('user_1', history[:1]).to_dict(today)['types'][3]
+    assert weight['count'] == 1
+    assert cache.get_stats()['rebuilds'] == 2
+
+def test_summary_counts_non_finite_readings_as_invalid():
+    """Test "inf" and overflowing readings never reach the aggregates"""
+    history = [
+        {'date': '1403-01-01', 'time': '08:00:00', 'type': 'وزن', 'value': value}
+        for value in ('70', 'inf', '1e400', '-Infinity', 'nan')
+    ]
+    summary = SummaryCache(max_users=1).get('user_1', history)
+    weight = summary.to_dict(jalali_ordinal('1403-01-01'))['types'][3]
+    
+    assert (weight['count'], weight['min'], weight['max']) == (1, 70, 70)
+    assert summary.invalid == 4
+    assert [r['value'] for r in HistoryColumns.from_records(history)] == [r['value'] for r in history]